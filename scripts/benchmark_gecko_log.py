@@ -0,0 +1,83 @@
+#!./dev_env/python/bin/python2.7
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import os
+import sys
+import tempfile
+
+from rp_utils import gecko_log_benchmark as B
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=('Benchmark the gecko log pipeline on synthetic logs '
+                     'and compare the results to a stored baseline.'))
+    parser.add_argument("-s", "--sizes",
+                        default=",".join(str(n) for n in B.DEFAULT_SIZES),
+                        help=('comma-separated numbers of log lines '
+                              '(default: %(default)s)'))
+    parser.add_argument("-b", "--benchmark", dest="benchmarks",
+                        action="append", metavar="NAME",
+                        choices=[name for (name, _) in B.CASES],
+                        help='run only this benchmark (repeatable)')
+    parser.add_argument("-d", "--dir",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "rp-gecko-log-benchmark"),
+                        help=('directory for the synthetic logs, which are '
+                              'kept for later runs (default: %(default)s)'))
+    parser.add_argument("--baseline", default=B.DEFAULT_BASELINE,
+                        help='baseline file (default: %(default)s)')
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=('store the results as baseline; without this '
+                              'option, the baseline has to exist'))
+    parser.add_argument("-t", "--tolerance", type=float,
+                        default=B.DEFAULT_TOLERANCE,
+                        help=('allowed regression as a fraction of the '
+                              'baseline (default: %(default)s)'))
+    parser.add_argument("--scale", action="store_true",
+                        help=('scale the baseline by the calibration scores, '
+                              'for a baseline of another machine'))
+    args = parser.parse_args()
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error("no baseline at {}, record one with --save-baseline"
+                     .format(args.baseline))
+    return args
+
+
+def log(message):
+    print message
+    sys.stdout.flush()
+
+
+def main():
+    args = parse_args()
+    sizes = [int(n) for n in args.sizes.split(",")]
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+
+    results = B.run_benchmarks(args.dir, sizes=sizes,
+                               names=args.benchmarks, log=log)
+
+    if args.save_baseline:
+        B.save_baseline(args.baseline, results)
+        log("baseline saved to {}".format(args.baseline))
+        return
+    regressions = B.compare_to_baseline(
+        results, B.load_baseline(args.baseline),
+        tolerance=args.tolerance, scale=args.scale)
+    if len(regressions) > 0:
+        log("")
+        log("PERFORMANCE REGRESSIONS ({}):".format(len(regressions)))
+        for message in regressions:
+            log("  " + message)
+        exit(code=1)
+    log("no regressions compared to {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,25 +6,133 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
-from rp_utils.utils import get_gecko_log_error_lines
+import json
+import sys
+from itertools import islice
+from rp_utils.gecko_log_fingerprints import ErrorFingerprintDatabase
+from rp_utils.gecko_log_report import (ErrorSummary, analyze_gecko_logs,
+                                       find_gecko_logs,
+                                       iter_error_lines_by_test,
+                                       merge_summaries)
+from rp_utils.utils import iter_gecko_log_error_lines
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description='Check a Gecko logfile for errors.')
+        description='Check Gecko logfiles for errors.')
     parser.add_argument("-p", "--print", dest="do_print", action="store_true",
                         help='print error lines')
-    parser.add_argument('file', help='path to the gecko log')
-    return parser.parse_args()
+    parser.add_argument("-n", "--max-errors", type=int, default=None,
+                        help='stop after the first N error lines')
+    parser.add_argument("-r", "--report",
+                        help=('write a JSON report on all logs to REPORT '
+                              '("-" for stdout)'))
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help=('number of logs to check in parallel '
+                              '(default: number of CPUs)'))
+    parser.add_argument("--db",
+                        help=('record the errors in this SQLite database of '
+                              'error fingerprints'))
+    parser.add_argument("--top-recurring", type=int, metavar="N",
+                        help=('print the N errors which recurred most often '
+                              'in the last 50 runs recorded in --db'))
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help=('path to a gecko log, or to a directory '
+                              'containing *.gecko.log files'))
+    args = parser.parse_args()
+    if len(args.files) == 0 and args.db is None:
+        parser.error("no gecko log given")
+    if args.top_recurring is not None and args.db is None:
+        parser.error("--top-recurring requires --db")
+    return args
+
+
+def check_single_log(args, path):
+    lines = islice(iter_gecko_log_error_lines(path), args.max_errors)
+    found_errors = False
+    for line in lines:
+        found_errors = True
+        if not args.do_print:
+            break
+        print line
+    return found_errors
+
+
+def check_logs(args, paths):
+    report = analyze_gecko_logs(paths, processes=args.jobs,
+                                max_errors=args.max_errors)
+    return output_report(args, report)
+
+
+def output_report(args, report):
+    if args.report == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print
+    elif args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.do_print:
+        for file_report in report["files"]:
+            if file_report["n_errors"] == 0:
+                continue
+            print u"{}: {} error(s), first error: {}".format(
+                file_report["path"], file_report["n_errors"],
+                file_report["first_error"])
+    return report["n_errors"] > 0
+
+
+def _iter_and_summarize(error_lines, summary):
+    for (test_name, line) in error_lines:
+        summary.add(test_name, line)
+        yield (test_name, line)
+
+
+def check_and_record_logs(args, paths):
+    """Check the logs and record their errors in the fingerprint
+    database, reading each log only once.
+
+    The logs are read one after another, as all runs go into the same
+    database.
+    """
+
+    db = ErrorFingerprintDatabase(args.db)
+    files = []
+    try:
+        for path in paths:
+            summary = ErrorSummary(path, max_errors=args.max_errors)
+            run_id = db.add_run(path, _iter_and_summarize(
+                iter_error_lines_by_test(path), summary))
+            files.append(summary.to_dict())
+            new_errors = db.get_new_fingerprints(run_id)
+            if args.do_print and len(new_errors) > 0:
+                print u"{}: {} new error(s):".format(path, len(new_errors))
+                for (fingerprint, example) in new_errors:
+                    print u"  [{}] {}".format(fingerprint, example)
+        if args.top_recurring is not None:
+            print u"most recurring errors in the last 50 runs:"
+            for (fingerprint, example, n_runs, n_occurrences) in (
+                    db.get_top_recurring(limit=args.top_recurring)):
+                print u"  [{}] {} runs, {} occurrences: {}".format(
+                    fingerprint, n_runs, n_occurrences, example)
+    finally:
+        db.close()
+    return output_report(args, merge_summaries(files))
 
 
 def main():
     args = parse_args()
-    lines = get_gecko_log_error_lines(args.file)
-    if len(lines) > 0:
-        if args.do_print:
-            for line in lines:
-                print line
+    paths = find_gecko_logs(args.files)
+    if len(args.files) > 0 and len(paths) == 0:
+        sys.exit("error: no gecko logs found in {}".format(
+            ", ".join(args.files)))
+    found_errors = False
+    if args.db is not None:
+        found_errors = check_and_record_logs(args, paths)
+    elif len(paths) == 1 and args.report is None:
+        found_errors = check_single_log(args, paths[0])
+    else:
+        found_errors = check_logs(args, paths)
+    if found_errors:
         exit(code=1)
 
 
@@ -0,0 +1,72 @@
+#!./dev_env/python/bin/python2.7
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import sys
+from collections import Counter
+from rp_utils.ruleset_matcher import (DEFAULT_POLICY,
+                                      DEFAULT_POLICY_INCONSISTENT_RULES,
+                                      IDENTICAL_IDENTIFIER,
+                                      SUBSCRIPTION_POLICY, USER_POLICY,
+                                      Policy)
+
+
+REASON_NAMES = {
+    USER_POLICY: "user-policy",
+    SUBSCRIPTION_POLICY: "subscription-policy",
+    DEFAULT_POLICY: "default-policy",
+    DEFAULT_POLICY_INCONSISTENT_RULES: "inconsistent-rules",
+    IDENTICAL_IDENTIFIER: "identical-identifier",
+}
+ALLOWED_NAMES = {True: "allow", False: "deny", None: "default"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=('Decide on requests like RequestPolicy does, using the '
+                     'rules of a profile, without a browser.'))
+    parser.add_argument("policy_dir",
+                        help=('the "requestpolicy" directory of a profile'))
+    parser.add_argument("files", nargs="*", metavar="file",
+                        help=('files with one request per line, the origin '
+                              'and the destination URI separated by a tab '
+                              '(default: stdin)'))
+    parser.add_argument("-s", "--summary", action="store_true",
+                        help='only print the number of requests per decision')
+    return parser.parse_args()
+
+
+def iter_pairs(files):
+    for f in files:
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) >= 2:
+                yield (fields[0], fields[1])
+
+
+def main():
+    args = parse_args()
+    policy = Policy.from_directory(args.policy_dir)
+    files = [open(path, "r") for path in args.files] or [sys.stdin]
+    counts = Counter()
+    for (origin, dest) in iter_pairs(files):
+        try:
+            (allowed, reason) = policy.decide(origin, dest)
+            decision = "{}\t{}".format(ALLOWED_NAMES[allowed],
+                                       REASON_NAMES[reason])
+        except ValueError:
+            decision = "invalid\t-"
+        if args.summary:
+            counts[decision] += 1
+        else:
+            print "{}\t{}\t{}".format(origin, dest, decision)
+    for (decision, count) in counts.most_common():
+        print "{}\t{}".format(count, decision)
+
+
+if __name__ == "__main__":
+    main()
@@ -1058,6 +1058,7 @@ export namespace XPCOM {
 
   export interface nsXPCComponents_Utils {
     import<T = any>(aResourceURI: string, targetObj?: any): T;
+    now?(): number;
   }
 
   // https://developer.mozilla.org/en-US/docs/Mozilla/Firefox/Multiprocess_Firefox/Message_Manager/Message_manager_overview
@@ -28,7 +28,7 @@ import {C} from "data/constants";
 import { MaybePromise } from "lib/classes/maybe-promise";
 import {Module} from "lib/classes/module";
 import {RequestResult} from "lib/classes/request-result";
-import {RawRuleset, Ruleset} from "./ruleset";
+import {RawRuleset, RuleHitCounter, Ruleset} from "./ruleset";
 
 export const RULES_CHANGED_TOPIC = "rpcontinued-rules-changed";
 
@@ -46,6 +46,8 @@ export class Policy extends Module implements App.IPolicy {
 
   public userRulesetExistedOnStartup: boolean;
   private userRulesets: any = {};
+  // Only counting rule hits if not null. See `startCountingRuleHits()`.
+  private ruleHitCounter: RuleHitCounter | null = null;
 
   protected get subModules() {
     return {
@@ -284,6 +286,10 @@ export class Policy extends Module implements App.IPolicy {
 
       // TODO wrap this in a try/catch.
       const [tempAllows, tempDenies] = ruleset.check(origin, dest);
+      if (this.ruleHitCounter) {
+        this.ruleHitCounter.countMatches(name, C.RULE_ACTION_ALLOW, tempAllows);
+        this.ruleHitCounter.countMatches(name, C.RULE_ACTION_DENY, tempDenies);
+      }
       // I'm not convinced I like appending these [ruleset, matchedRule] arrays,
       // but it works for now.
       for (const tempAllow of tempAllows) {
@@ -296,6 +302,37 @@ export class Policy extends Module implements App.IPolicy {
     return result;
   }
 
+  /**
+   * Starts counting how often each rule is matched by `checkRequest()`.
+   * Counting is off by default. Previous counts are discarded.
+   */
+  public startCountingRuleHits() {
+    this.ruleHitCounter = new RuleHitCounter();
+  }
+
+  public stopCountingRuleHits() {
+    this.ruleHitCounter = null;
+  }
+
+  public isCountingRuleHits() {
+    return this.ruleHitCounter !== null;
+  }
+
+  /**
+   * Returns the rules matched since counting started, with the name of
+   * the ruleset ("user", "temp" or the subscription's name), the rule
+   * action, the rule data and the number of hits.
+   */
+  public getRuleHits() {
+    return this.ruleHitCounter ? this.ruleHitCounter.getHits() : [];
+  }
+
+  public resetRuleHits() {
+    if (this.ruleHitCounter) {
+      this.ruleHitCounter.reset();
+    }
+  }
+
   // ---------------------------------------------------------------------------
   // alias functions
   // ---------------------------------------------------------------------------
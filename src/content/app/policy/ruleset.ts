@@ -312,10 +312,18 @@ export class RawRuleset implements IRawRuleset {
    * |RawRuleset|.
    *
    * @param {string} name
+   * @param {boolean} lazy Whether entries with a host are only added to the
+   *     ruleset when their host is needed, see `Ruleset.deferEntry()`.
+   *     Otherwise the whole ruleset is built right away.
    * @return {Ruleset}
    */
-  public toRuleset(name: string) {
+  public toRuleset(name: string, lazy: boolean = true) {
     const policy = new Ruleset(this.log, this.uriService, name);
+    if (lazy) {
+      policy.setDeferredEntryAdder((aEntry, aRuleAction) => {
+        this._addEntryToRuleset(aEntry, aRuleAction, policy);
+      });
+    }
 
     // tslint:disable-next-line prefer-const forin
     for (let actionStr in this.entries) {
@@ -330,7 +338,9 @@ export class RawRuleset implements IRawRuleset {
       // tslint:disable-next-line prefer-const forin
       for (let i in entryArray) {
         // this.log.info("toRuleset: adding entry");
-        this._addEntryToRuleset(entryArray[i], ruleAction, policy);
+        if (!policy.deferEntry(entryArray[i], ruleAction)) {
+          this._addEntryToRuleset(entryArray[i], ruleAction, policy);
+        }
       }
     }
 
@@ -866,6 +876,47 @@ type ODMatch = [
 ];
 type Match = EndpointMatch | ODMatch;
 
+type DeferredEntry = [IRuleSpec, RuleAction];
+type EntryAdder = (entry: IRuleSpec, ruleAction: RuleAction) => void;
+
+/**
+ * Throws the errors which adding an entry to a ruleset would throw, so that
+ * an invalid entry is rejected when it is deferred, not on its first lookup.
+ */
+function checkDeferredEntry(entry: IRuleSpec) {
+  // tslint:disable-next-line prefer-const
+  for (let entryPart of [entry.o, entry.d]) {
+    if (!entryPart) {
+      continue;
+    }
+    if (typeof entryPart !== "object") {
+      throw new Error("Invalid entry part: " + entryPart);
+    }
+    if (entryPart.h && typeof entryPart.h !== "string") {
+      throw new Error("Invalid host: " + entryPart.h);
+    }
+    if (!entryPart.pathPre && entryPart.pathRegex) {
+      // Throws a SyntaxError if the expression is invalid.
+      // tslint:disable-next-line no-unused-expression
+      new RegExp(entryPart.pathRegex);
+    }
+  }
+}
+
+/**
+ * Returns the last two labels of a host, or the host itself if it has
+ * fewer labels. Deferred entries are grouped by this key.
+ */
+function getDeferralKey(host: string) {
+  const lastDot = host.lastIndexOf(".");
+  if (lastDot === -1) {
+    return host;
+  }
+  const secondLastDot = lastDot === 0 ? -1 :
+      host.lastIndexOf(".", lastDot - 1);
+  return host.slice(secondLastDot + 1);
+}
+
 // tslint:disable-next-line max-classes-per-file
 export class Ruleset {
   /**
@@ -992,6 +1043,14 @@ export class Ruleset {
 
   private ipAddr: {[k: string]: IPAddressEntry};
 
+  /**
+   * Entries (rules) with a host are added to the tree only when the host is
+   * needed, see `deferEntry()`. Most hosts of a large ruleset are never
+   * looked up, so this makes loading it cheap.
+   */
+  private deferredEntries: Map<string, DeferredEntry[]> | null = null;
+  private deferredEntryAdder: EntryAdder | null = null;
+
   constructor(
       private log: Common.ILog,
       private uriService: App.services.IUriService,
@@ -1015,6 +1074,7 @@ export class Ruleset {
       indent += "  ";
     }
     this.log.info(indent + this.toString());
+    this.addAllDeferredEntries();
     this.domain.print(depth + 1);
     // this._ipAddr.print(depth + 1);
     this.rules.print(depth + 1);
@@ -1025,6 +1085,9 @@ export class Ruleset {
       // eslint-disable-next-line no-throw-literal
       throw new Error("INVALID_HOST");
     }
+    if (this.deferredEntries) {
+      this.addDeferredEntries(getDeferralKey(host));
+    }
     if (this.uriService.isIPAddress(host)) {
       return this._getIPAddress(host);
     } else {
@@ -1037,6 +1100,9 @@ export class Ruleset {
       // eslint-disable-next-line no-throw-literal
       throw new Error("INVALID_HOST");
     }
+    if (this.deferredEntries) {
+      this.addDeferredEntries(getDeferralKey(host));
+    }
     if (this.uriService.isIPAddress(host)) {
       return this._addIPAddress(host);
     } else {
@@ -1044,6 +1110,48 @@ export class Ruleset {
     }
   }
 
+  public setDeferredEntryAdder(adder: EntryAdder) {
+    this.deferredEntryAdder = adder;
+  }
+
+  /**
+   * Defers adding an entry until its host is needed. The entry is added
+   * using the function set by `setDeferredEntryAdder()`.
+   *
+   * @return {boolean} false if the entry has to be added right away, that
+   *     is, if it has no host or no entry adder has been set.
+   */
+  public deferEntry(entry: IRuleSpec, ruleAction: RuleAction): boolean {
+    // Like `RawRuleset._addEntryToRuleset()`, the origin determines where
+    // origin-to-destination rules are added.
+    const endpointSpec = entry.o || entry.d;
+    if (!this.deferredEntryAdder || !endpointSpec || !endpointSpec.h) {
+      return false;
+    }
+    checkDeferredEntry(entry);
+    if (!this.deferredEntries) {
+      this.deferredEntries = new Map();
+    }
+    const key = getDeferralKey(endpointSpec.h);
+    const entries = this.deferredEntries.get(key);
+    if (entries) {
+      entries.push([entry, ruleAction]);
+    } else {
+      this.deferredEntries.set(key, [[entry, ruleAction]]);
+    }
+    return true;
+  }
+
+  public addAllDeferredEntries() {
+    if (!this.deferredEntries) {
+      return;
+    }
+    // tslint:disable-next-line prefer-const
+    for (let key of Array.from(this.deferredEntries.keys())) {
+      this.addDeferredEntries(key);
+    }
+  }
+
   /**
    * Yields all matching hosts, that is, DomainEntry or IPAddressEntry
    * objects. For domains, this is in top-down order. For
@@ -1068,12 +1176,18 @@ export class Ruleset {
     }
 
     if (this.uriService.isIPAddress(host)) {
+      if (this.deferredEntries) {
+        this.addDeferredEntries(getDeferralKey(host));
+      }
       const addrEntry = this.ipAddr[host];
       if (addrEntry) {
         yield [addrEntry, true];
       }
     } else {
       const parts = host.split(".");
+      if (this.deferredEntries) {
+        this.addDeferredEntriesOfLookup(parts);
+      }
       let curLevel = this.domain;
       // Start by checking for a wildcard at the highest level.
       let nextLevel = curLevel.getLowerLevel("*");
@@ -1244,4 +1358,87 @@ export class Ruleset {
     }
     return curLevel;
   }
+
+  private addDeferredEntries(key: string) {
+    if (!this.deferredEntries) {
+      return;
+    }
+    const entries = this.deferredEntries.get(key);
+    if (!entries) {
+      return;
+    }
+    // Removed first, as adding the entries calls this method again.
+    this.deferredEntries.delete(key);
+    if (this.deferredEntries.size === 0) {
+      this.deferredEntries = null;
+    }
+    const addEntry = this.deferredEntryAdder as EntryAdder;
+    // tslint:disable-next-line prefer-const
+    for (let [entry, ruleAction] of entries) {
+      addEntry(entry, ruleAction);
+    }
+  }
+
+  /**
+   * Adds the deferred entries of all domain entries which a lookup of a
+   * host walks through: the "*" entry, the top-level domain, its wildcard
+   * entry, and all entries below the host's last two labels.
+   */
+  private addDeferredEntriesOfLookup(parts: string[]) {
+    const topLevel = parts[parts.length - 1];
+    this.addDeferredEntries("*");
+    this.addDeferredEntries(topLevel);
+    this.addDeferredEntries("*." + topLevel);
+    if (parts.length > 1) {
+      this.addDeferredEntries(parts[parts.length - 2] + "." + topLevel);
+    }
+  }
+}
+
+export interface IRuleHits {
+  ruleset: string;
+  ruleAction: RuleAction;
+  rule: IRuleSpec;
+  hits: number;
+}
+
+/**
+ * Counts how often each rule is matched. Rules are identified by their
+ * canonical string, so the counts are kept when a ruleset is rebuilt,
+ * e.g. when the user rules are loaded again.
+ */
+export class RuleHitCounter {
+  private hits = new Map<string, IRuleHits>();
+
+  /**
+   * @param {string} rulesetName
+   * @param {RuleAction} ruleAction
+   * @param {Array} matches as returned by calls to |Ruleset.check()|.
+   */
+  public countMatches(
+      rulesetName: string,
+      ruleAction: RuleAction,
+      matches: Match[],
+  ) {
+    // tslint:disable-next-line prefer-const
+    for (let match of matches) {
+      const rule = Ruleset.matchToRawRule(match);
+      const key = rulesetName + " " + ruleAction + " " +
+          Ruleset.rawRuleToCanonicalString(rule);
+      const ruleHits = this.hits.get(key);
+      if (ruleHits) {
+        ruleHits.hits++;
+      } else {
+        this.hits.set(key, {ruleset: rulesetName, ruleAction, rule, hits: 1});
+      }
+    }
+  }
+
+  public getHits(): IRuleHits[] {
+    return Array.from(this.hits.values());
+  }
+
+  public reset() {
+    this.hits.clear();
+  }
 }
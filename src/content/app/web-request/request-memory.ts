@@ -29,6 +29,7 @@ import { Module } from "lib/classes/module";
 import { RequestResult } from "lib/classes/request-result";
 import { RequestSet } from "lib/classes/request-set";
 import { createListenersMap } from "lib/utils/listener-factories";
+import { now } from "lib/utils/misc-utils";
 
 export class RequestMemory extends Module
     implements App.webRequest.IRequestMemory {
@@ -74,6 +75,14 @@ export class RequestMemory extends Module
     this.requestSets.rejectedRequests.removeOriginUri(uri);
   }
 
+  /**
+   * Remember a request and emit `onRequest`.
+   *
+   * The event contains the latencies in milliseconds, if known: the time
+   * taken to decide on the request (`decision`), including policy lookup
+   * and redirect checks, and the time taken to remember it here
+   * (`bookkeeping`).
+   */
   public notifyNewRequest({
       originUri,
       destUri,
@@ -81,6 +90,7 @@ export class RequestMemory extends Module
       requestResult,
       unforbidable,
       isInsert,
+      decisionTime,
   }: {
       originUri: string,
       destUri: string,
@@ -88,7 +98,9 @@ export class RequestMemory extends Module
       requestResult: RequestResult,
       unforbidable?: boolean,
       isInsert: boolean,
+      decisionTime?: number,
   }) {
+    const bookkeepingStartTime = now();
     if (isAllowed) {
       // We aren't recording the request so it doesn't show up in the menu,
       // but we want it to still show up in the request log.
@@ -122,11 +134,18 @@ export class RequestMemory extends Module
           destUri,
       );
     }
+    const timings: {[phase: string]: number} = {
+      bookkeeping: now() - bookkeepingStartTime,
+    };
+    if (decisionTime !== undefined) {
+      timings.decision = decisionTime;
+    }
     this.eventListenersMap.onRequest.emit({
       destUri,
       isAllowed,
       originUri,
       requestResult,
+      timings,
     });
   }
 
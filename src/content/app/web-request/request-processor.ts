@@ -38,6 +38,7 @@ import {
   RequestResult,
 } from "lib/classes/request-result";
 import { XPCOMObserverModule } from "lib/classes/xpcom-observer-module";
+import { now } from "lib/utils/misc-utils";
 import {
   getRequestHeaderFromHttpChannel,
   queryInterface,
@@ -172,6 +173,7 @@ export class RequestProcessor extends Module {
         request.destURI,
     );
     this.requestMemory.notifyNewRequest({
+      decisionTime: this.getDecisionTime(request),
       destUri: request.destURI,
       isAllowed: false,
       isInsert: false,
@@ -224,6 +226,7 @@ export class RequestProcessor extends Module {
 
     this.cacheShouldLoadResult(this.CP_OK, request.originURI, request.destURI);
     this.requestMemory.notifyNewRequest({
+      decisionTime: this.getDecisionTime(request),
       destUri: request.destURI,
       isAllowed: true,
       isInsert: false,
@@ -235,6 +238,16 @@ export class RequestProcessor extends Module {
     return this.CP_OK;
   }
 
+  /**
+   * Return the milliseconds since processing of the request started.
+   */
+  private getDecisionTime(request: Request): number | undefined {
+    if (request.processingStartTime === undefined) {
+      return undefined;
+    }
+    return now() - request.processingStartTime;
+  }
+
   private cacheShouldLoadResult(
       result: number,
       originUri: string | undefined,
@@ -304,6 +317,7 @@ export class RequestProcessor extends Module {
     //              " -->  "+request.aContentLocation.spec);
     // log.dir(request.aRequestOrigin);
     // log.dir(request.aContentLocation);
+    request.processingStartTime = now();
     try {
       if (this.requestService.isInternalRequest(request)) {
         this.log.log(`Allowing a request that seems to be internal. ` +
@@ -1014,6 +1028,8 @@ export class RequestProcessor extends Module {
     // TODO: Make user aware of blocked headers so they can allow them if
     // desired.
 
+    request.processingStartTime = now();
+
     // Check for internal redirections. For example, the add-on
     // "Decentraleyes" redirects external resources like jQuery
     // to a "data" URI.
@@ -1073,6 +1089,7 @@ export class RequestProcessor extends Module {
           `Same hosts or allowed origin/destination.`,
       );
       this.requestMemory.notifyNewRequest({
+        decisionTime: this.getDecisionTime(request),
         destUri: destURI,
         isAllowed: true,
         isInsert: false,
@@ -1165,6 +1182,7 @@ export class RequestProcessor extends Module {
       }
 
       this.requestMemory.notifyNewRequest({
+        decisionTime: this.getDecisionTime(request),
         destUri: request.destURI,
         isAllowed: false,
         isInsert: false,
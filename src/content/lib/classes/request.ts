@@ -38,6 +38,10 @@ export abstract class Request {
   // TODO: Merge "RequestResult" into this class.
   public requestResult: RequestResult;
 
+  // The time when processing the request started, for measuring the
+  // decision latency. See `RequestMemory.onRequest`.
+  public processingStartTime?: number;
+
   constructor(
       originURI: string | undefined,
       destURI: string,
@@ -24,8 +24,20 @@
 import { JSMs, XPCOM } from "bootstrap/api/interfaces";
 
 declare const Ci: XPCOM.nsXPCComponents_Interfaces;
+declare const Cu: XPCOM.nsXPCComponents_Utils;
 declare const Services: JSMs.Services;
 
+/**
+ * Return a high-resolution timestamp in milliseconds, for measuring
+ * durations. Falls back to `Date.now()` where `Cu.now()` is missing.
+ */
+export function now(): number {
+  if (typeof Cu !== "undefined" && typeof Cu.now === "function") {
+    return Cu.now();
+  }
+  return Date.now();
+}
+
 /**
  * Posts an action to the event queue of the current thread to run it
  * asynchronously. Any additional parameters to this function are passed
@@ -3,7 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from firefox_puppeteer.base import BaseLib
-from marionette_driver.wait import Wait
+from .gecko_log_follower import GeckoLogFollower
 from .gecko_log_parser import GeckoLogParser
 
 
@@ -12,9 +12,14 @@ class GeckoLog(BaseLib, GeckoLogParser):
     def __init__(self, marionette_getter):
         BaseLib.__init__(self, marionette_getter)
         GeckoLogParser.__init__(self, self.marionette.instance.gecko_log)
+        self._fail_fast_subscription = None
+
+    @property
+    def follower(self):
+        return GeckoLogFollower.get(self.path)
 
     def find(self, strings, min_line=0):
-        all_lines = self.get_all_lines()
+        all_lines = self._get_lines()
         for i in range(len(all_lines) - 1, min_line - 1, -1):
             line = all_lines[i]
             for s in strings:
@@ -22,8 +27,60 @@ class GeckoLog(BaseLib, GeckoLogParser):
                     return s
         return None
 
-    def currently_ignoring_errors(self):
-        return self._current_ignore_type() is not None
+    # waiting
+
+    def wait_for_line(self, match, start=0, timeout=None):
+        """Wait until a matching line has been logged.
+
+        See `GeckoLogFollower.wait_for_line()`. When failing fast,
+        `ErrorLoggedException` is raised as soon as an error is logged.
+        """
+
+        return self.follower.wait_for_line(
+            match, start=start, timeout=timeout,
+            abort_on=self._fail_fast_subscription)
+
+    def wait_for_quiet(self, duration, timeout=None):
+        """Wait until no line has been logged for `duration` seconds."""
+
+        self.follower.wait_for_quiet(
+            duration, timeout=timeout,
+            abort_on=self._fail_fast_subscription)
+
+    def subscribe_errors(self, callback=None, **filter_kwargs):
+        return self.follower.subscribe_errors(callback, **filter_kwargs)
+
+    # failing fast
+
+    def start_failing_fast(self):
+        """Abort waiting on the log as soon as an error is logged.
+
+        Ignored and expected errors do not abort. Only the waits of this
+        class, e.g. `wait_for_line()`, and `check_for_errors()` raise;
+        other code of a test is not interrupted. This starts the log's
+        `GeckoLogFollower`, whose thread then polls the log every
+        `POLL_INTERVAL` seconds until the end of the session.
+        """
+
+        if self._fail_fast_subscription is None:
+            self._fail_fast_subscription = self.subscribe_errors(
+                return_expected_as_well=False)
+
+    def stop_failing_fast(self):
+        if self._fail_fast_subscription is not None:
+            self._fail_fast_subscription.unsubscribe()
+            self._fail_fast_subscription = None
+
+    def check_for_errors(self):
+        """Raise `ErrorLoggedException` if an error has been logged
+        since failing fast was started.
+        """
+
+        if self._fail_fast_subscription is not None:
+            self.follower.poll()
+            self._fail_fast_subscription.raise_if_errors()
+
+    # ignoring errors
 
     def start_ignoring_errors(self, expected=False):
         assert self.currently_ignoring_errors() is False
@@ -40,25 +97,9 @@ class GeckoLog(BaseLib, GeckoLogParser):
         self.dump_and_wait(msg)
 
     def dump_and_wait(self, message):
-        min_line = len(self.get_all_lines())
+        start = len(self._get_lines())
         self.marionette.execute_script("""
           Components.utils.import("resource://gre/modules/Services.jsm");
           Services.obs.notifyObservers(null, "{}", "{}");
         """.format("requestpolicy-dump-string", message))
-        Wait(self.marionette).until(
-            lambda _: self.find([message], min_line=min_line) == message)
-
-    def _current_ignore_type(self):
-        last_ignore = self.find([
-            self.IGNORE_ERRORS_START,
-            self.IGNORE_ERRORS_END
-        ])
-        if last_ignore is not None and last_ignore == self.IGNORE_ERRORS_START:
-            return "ignore"
-        last_expect = self.find([
-            self.EXPECT_ERRORS_START,
-            self.EXPECT_ERRORS_END
-        ])
-        if last_expect is not None and last_expect == self.EXPECT_ERRORS_START:
-            return "expect"
-        return None
+        self.wait_for_line(message, start=start)
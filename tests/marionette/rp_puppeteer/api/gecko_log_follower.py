@@ -0,0 +1,259 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import threading
+import time
+
+from .gecko_log_parser import ErrorLineFilter, GeckoLogIndex
+
+
+class GeckoLogTimeoutException(Exception):
+    pass
+
+
+class ErrorLoggedException(AssertionError):
+    """An error line has been logged while waiting.
+
+    This is an `AssertionError`, so that a test aborted by it fails
+    just like a test whose errors are found on teardown.
+    """
+
+    def __init__(self, line):
+        AssertionError.__init__(self, u"Error line logged: {}".format(line))
+        self.line = line
+
+
+class ErrorSubscription(object):
+    """Receives the error lines appended to a followed log.
+
+    The error lines are collected in `errors`. If a callback is given,
+    it is called with each error line as well. Callbacks run in the
+    follower's thread.
+    """
+
+    def __init__(self, follower, callback=None, **filter_kwargs):
+        self._follower = follower
+        self._filter = ErrorLineFilter(**filter_kwargs)
+        self.callback = callback
+        self.errors = []
+
+    def unsubscribe(self):
+        self._follower._remove_subscription(self)
+
+    def raise_if_errors(self):
+        if len(self.errors) > 0:
+            raise ErrorLoggedException(self.errors[0])
+
+    def _feed(self, lines):
+        for line in lines:
+            line = self._filter.check(line)
+            if line is None:
+                continue
+            self.errors.append(line)
+            if self.callback is not None:
+                self.callback(line)
+
+
+class GeckoLogFollower(object):
+    """Follow a gecko log in a background thread.
+
+    One thread per log reads the appended lines into the shared
+    `GeckoLogIndex`, wakes up waiting threads and passes error lines
+    to subscribers. Waiting for a line or for the log to become quiet
+    therefore does not read the file again for each waiting caller.
+
+    Followers are shared and started per file path, see `get()`. A
+    started follower's daemon thread polls the log every `interval`
+    seconds until `stop()` is called or the process exits.
+    """
+
+    POLL_INTERVAL = 0.005
+    DEFAULT_TIMEOUT = 5
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path):
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                follower = cls(path)
+                follower.start()
+                cls._instances[key] = follower
+            return cls._instances[key]
+
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.interval = self.POLL_INTERVAL if interval is None else interval
+        self._index = GeckoLogIndex.get(path)
+        self._condition = threading.Condition()
+        self._subscriptions = []
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lines = None
+        self._n_lines = 0
+        self._last_change = time.time()
+        # The `sys.exc_info()` of an exception which ended the thread.
+        self._error = None
+
+    #################################
+    # Public Properties and Methods #
+    #################################
+
+    @property
+    def n_lines(self):
+        """The number of lines seen so far."""
+        return self._n_lines
+
+    def start(self):
+        """Start the thread, or restart it if an error ended it."""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        try:
+            self.poll()
+        except (IOError, OSError):
+            pass
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="GeckoLogFollower " + self.path)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def poll(self):
+        """Read the new lines, then notify waiters and subscribers."""
+
+        (lines, n_lines, _) = self._index.snapshot()
+        with self._condition:
+            if lines is not self._lines:
+                # The index has been reset, i.e. the file was replaced.
+                self._lines = lines
+                self._n_lines = 0
+            new_lines = lines[self._n_lines:n_lines]
+            if len(new_lines) > 0:
+                self._n_lines += len(new_lines)
+                self._last_change = time.time()
+                for subscription in self._subscriptions:
+                    subscription._feed(new_lines)
+            # Waiters are woken up on every poll, also without new
+            # lines, so that they can check the time, e.g. in
+            # `wait_for_quiet()`. (In Python 2 `Condition.wait(timeout)`
+            # sleeps up to 50 ms at a time.)
+            self._condition.notify_all()
+
+    def subscribe_errors(self, callback=None, **filter_kwargs):
+        """Subscribe to the error lines appended from now on.
+
+        :param callback: Called with each error line, in the
+            follower's thread while it holds the follower's lock.
+        :param filter_kwargs: See `ErrorLineFilter`.
+        :returns: An `ErrorSubscription`.
+        """
+
+        subscription = ErrorSubscription(self, callback, **filter_kwargs)
+        with self._condition:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def wait_for_line(self, match, start=0, timeout=None, abort_on=None):
+        """Wait until a matching line has been logged.
+
+        :param match: The line itself, or a function called with each
+            line, returning whether it matches.
+        :param start: The index of the first line to check.
+        :param abort_on: An `ErrorSubscription`. If it receives an
+            error line while waiting, `ErrorLoggedException` is raised.
+        :returns: The index of the matching line.
+        """
+
+        if callable(match):
+            description = u"a matching line"
+        else:
+            description = u"the line {!r}".format(match)
+            expected_line = match
+
+            def match(line):
+                return line == expected_line
+        position = [start]
+
+        def find_line(lines):
+            for i in range(position[0], self._n_lines):
+                if match(lines[i]):
+                    return i
+            position[0] = max(position[0], self._n_lines)
+            return None
+
+        return self._wait(find_line, timeout, abort_on, description)
+
+    def wait_for_quiet(self, duration, timeout=None, abort_on=None):
+        """Wait until no line has been logged for `duration` seconds."""
+
+        def is_quiet(lines):
+            if time.time() - self._last_change >= duration:
+                return True
+            return None
+
+        self._wait(is_quiet, timeout, abort_on,
+                   u"{} s without log lines".format(duration))
+
+    ##################################
+    # Private Properties and Methods #
+    ##################################
+
+    def _wait(self, check, timeout, abort_on, description):
+        """Call `check` with the lines after each poll, until it
+        returns something else than None, and return that.
+
+        An exception which ended the follower's thread is raised here.
+        """
+
+        self.start()
+        timeout = self.DEFAULT_TIMEOUT if timeout is None else timeout
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                if self._error is not None:
+                    (exc_type, exc_value, exc_traceback) = self._error
+                    self._error = None
+                    raise exc_type, exc_value, exc_traceback
+                if abort_on is not None:
+                    abort_on.raise_if_errors()
+                result = check(self._lines)
+                if result is not None:
+                    return result
+                if time.time() >= deadline:
+                    raise GeckoLogTimeoutException(
+                        u"Timed out after {} s waiting for {}".format(
+                            timeout, description))
+                self._condition.wait(max(0, deadline - time.time()))
+
+    def _remove_subscription(self, subscription):
+        with self._condition:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except (IOError, OSError):
+                # The log does not exist (yet).
+                pass
+            except Exception:
+                # E.g. a subscriber's callback failed. Waiters would
+                # otherwise wait until their timeout for nothing.
+                with self._condition:
+                    self._error = sys.exc_info()
+                    self._condition.notify_all()
+                return
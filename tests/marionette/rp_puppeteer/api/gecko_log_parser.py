@@ -2,9 +2,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import codecs
+from itertools import islice
+import os
 import re
-from contextlib import contextmanager
+import threading
+
+from .gecko_log_records import GeckoLogRecords
 
 
 known_bug_1 = (
@@ -51,6 +54,54 @@ WHITELIST = [
 
 retype = type(re.compile(r"^"))
 
+IGNORE_ERRORS_START = "[RP Puppeteer] GeckoLog ignore errors: start"
+IGNORE_ERRORS_END = "[RP Puppeteer] GeckoLog ignore errors: end"
+EXPECT_ERRORS_START = "[RP Puppeteer] GeckoLog expect errors: start"
+EXPECT_ERRORS_END = "[RP Puppeteer] GeckoLog expect errors: end"
+_MARKER_PREFIX = "[RP Puppeteer] GeckoLog "
+
+
+def _whitelist_pattern(entry):
+    if isinstance(entry, retype):
+        return entry.pattern
+    # string
+    return re.escape(entry)
+
+
+# The checks done by `GeckoLogParser._is_rp_exception()`, compiled once.
+# Python 2.7's `re` has no scoped flags, so the case-insensitive check
+# for exception keywords cannot be merged with the other patterns.
+_RP_MARKER_RE = re.compile(r"\[RequestPolicy\]|chrome://rpcontinued/")
+_EXCEPTION_RE = re.compile(
+    r"(?!console\.(?!error)).*?(?:error|warning|exception)",
+    re.I | re.U | re.S)
+_IGNORED_RE = re.compile(
+    u"|".join([u"(?:{})".format(_whitelist_pattern(entry))
+               for entry in WHITELIST] +
+              [r".*?/third-party/"]),
+    re.U | re.S)
+_CONSOLE_PREFIX_RE = re.compile(r"^console.\w+:\s*$")
+_TEST_START_RE = re.compile(r"TEST-START[\s:|]*(.*?)\s*$")
+
+
+def is_rp_exception(line):
+    """Check whether a log line is an error, warning or exception
+    caused by RequestPolicy and not whitelisted.
+    """
+
+    return (_RP_MARKER_RE.search(line) is not None and
+            _EXCEPTION_RE.match(line) is not None and
+            _IGNORED_RE.match(line) is None)
+
+
+def get_test_name(line):
+    """Return the test name of a TEST-START line, or None."""
+
+    match = _TEST_START_RE.search(line)
+    if match is None:
+        return None
+    return match.group(1)
+
 
 class IgnoreHelper(object):
 
@@ -69,15 +120,182 @@ class IgnoreHelper(object):
         return self.ignoring
 
 
+class ErrorLineFilter(object):
+    """Select the error lines of a log, fed line by line.
+
+    The state, i.e. whether errors are currently ignored and whether
+    a "console.*:" line is continued on the next line, is kept between
+    calls, so lines can be fed as they are appended to the log.
+    """
+
+    def __init__(self, return_ignored_as_well=False,
+                 return_expected_as_well=True,
+                 is_error_line=is_rp_exception):
+        self.is_error_line = is_error_line
+        self.ignore_helpers = []
+        if not return_ignored_as_well:
+            self.ignore_helpers.append(IgnoreHelper(
+                IGNORE_ERRORS_START, IGNORE_ERRORS_END
+            ))
+        if not return_expected_as_well:
+            self.ignore_helpers.append(IgnoreHelper(
+                EXPECT_ERRORS_START, EXPECT_ERRORS_END
+            ))
+        self._prepend_to_next_line = ""
+
+    def check(self, line):
+        """Return the line if it is an error line, otherwise None.
+
+        A "console.*:" line is joined with the line following it.
+        """
+
+        line = self._prepend_to_next_line + line
+        self._prepend_to_next_line = ""
+        if _CONSOLE_PREFIX_RE.match(line):
+            self._prepend_to_next_line = line
+            return None
+        ignoring = False
+        for helper in self.ignore_helpers:
+            if helper.update_and_check(line) is True:
+                ignoring = True
+        if ignoring or not self.is_error_line(line):
+            return None
+        return line
+
+
+class GeckoLogIndex(object):
+    """In-memory index of a gecko log, following the file as it grows.
+
+    The file is read from the byte offset where the previous update
+    stopped, so each update costs O(new bytes). Only complete lines
+    are consumed; a trailing line without newline is read again on the
+    next update. Index instances are shared per file path, see `get()`.
+
+    Additionally the index of each "TEST-START" line is recorded, so
+    that the lines of a single test can be sliced out directly.
+    Structured records of the lines are only parsed when `records` is
+    used.
+
+    The state of ignoring or expecting errors is tracked as well, that
+    is, whether the last "ignore errors" or "expect errors" marker was
+    a start marker.
+
+    The index may be updated by a `GeckoLogFollower` thread, so it is
+    read through `snapshot()` and `query_records()`, which hold the
+    index's lock. `lines` and `test_starts` only grow, and are
+    replaced by new lists when the file is replaced.
+    """
+
+    _instances = {}
+
+    @classmethod
+    def get(cls, path):
+        key = os.path.abspath(path)
+        if key not in cls._instances:
+            cls._instances[key] = cls(path)
+        return cls._instances[key]
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def update(self):
+        """Read the lines which have been appended since the last update."""
+
+        with self._lock:
+            self._update()
+
+    def snapshot(self):
+        """Update the index and return `(lines, n_lines, test_starts)`,
+        consistent with each other.
+
+        `lines` is not copied: only its first `n_lines` items belong to
+        the snapshot, and it must not be modified. `test_starts` is a
+        copy.
+        """
+
+        with self._lock:
+            self._update()
+            return (self.lines, len(self.lines), self.test_starts[:])
+
+    def query_records(self, query):
+        """Update the index and its records, then return
+        `query(records, n_tests)`, all while holding the lock.
+        """
+
+        with self._lock:
+            self._update()
+            records = self.records
+            records.update()
+            return query(records, len(self.test_starts))
+
+    def _update(self):
+        with open(self.path, "rb") as file_obj:
+            stat = os.fstat(file_obj.fileno())
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self._file_id or stat.st_size < self.offset:
+                # The file has been replaced or truncated.
+                self._reset(file_id)
+            if stat.st_size == self.offset:
+                return
+            file_obj.seek(self.offset)
+            data = file_obj.read()
+        end = data.rfind(b"\n")
+        if end == -1:
+            return
+        self.offset += end + 1
+        self._add_lines(
+            data[:end].decode("utf-8", "replace").split(u"\n"))
+
+    def _reset(self, file_id):
+        self._file_id = file_id
+        self.offset = 0
+        self.lines = []
+        self.test_starts = []
+        self.ignoring_errors = False
+        self.expecting_errors = False
+        self._records = None
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._records = GeckoLogRecords(self.lines, self.test_starts)
+        return self._records
+
+    def _add_lines(self, new_lines):
+        new_test_starts = []
+        for (i, line) in enumerate(new_lines, len(self.lines)):
+            if line.find("TEST-START") != -1:
+                new_test_starts.append(i)
+            elif line.startswith(_MARKER_PREFIX):
+                self._update_ignore_state(line)
+        # The lines come first, so that a test start never points past
+        # the end of `lines`.
+        self.lines.extend(new_lines)
+        self.test_starts.extend(new_test_starts)
+
+    def _update_ignore_state(self, line):
+        if line == IGNORE_ERRORS_START:
+            self.ignoring_errors = True
+        elif line == IGNORE_ERRORS_END:
+            self.ignoring_errors = False
+        elif line == EXPECT_ERRORS_START:
+            self.expecting_errors = True
+        elif line == EXPECT_ERRORS_END:
+            self.expecting_errors = False
+
+
 class GeckoLogParser(object):
 
-    IGNORE_ERRORS_START = "[RP Puppeteer] GeckoLog ignore errors: start"
-    IGNORE_ERRORS_END = "[RP Puppeteer] GeckoLog ignore errors: end"
-    EXPECT_ERRORS_START = "[RP Puppeteer] GeckoLog expect errors: start"
-    EXPECT_ERRORS_END = "[RP Puppeteer] GeckoLog expect errors: end"
+    IGNORE_ERRORS_START = IGNORE_ERRORS_START
+    IGNORE_ERRORS_END = IGNORE_ERRORS_END
+    EXPECT_ERRORS_START = EXPECT_ERRORS_START
+    EXPECT_ERRORS_END = EXPECT_ERRORS_END
 
     def __init__(self, gecko_log_path):
         self.path = gecko_log_path
+        self._index = GeckoLogIndex.get(gecko_log_path)
 
     #################################
     # Public Properties and Methods #
@@ -86,32 +304,90 @@ class GeckoLogParser(object):
     # lines
 
     def get_all_lines(self):
-        with self._gecko_log_file() as gecko_log:
-            # Take all lines except the last one, which is empty.
-            return gecko_log.read().split("\n")[:-1]
+        return self._get_lines()
 
     def get_lines_before_first_test(self):
-        lines = []
-        for line in self.get_all_lines():
-            if line.find("TEST-START") != -1:
-                break
-            lines.append(line)
-        return lines
+        (lines, n_lines, test_starts) = self._index.snapshot()
+        if len(test_starts) == 0:
+            return lines[:n_lines]
+        return lines[:test_starts[0]]
 
     def get_lines_of_current_test(self):
-        all_lines = self.get_all_lines()
-        lines = []
-        for line in reversed(all_lines):
-            lines.append(line)
-            if line.find("TEST-START") != -1:
-                break
-        lines.reverse()
-        return lines
+        (lines, n_lines, test_starts) = self._index.snapshot()
+        if len(test_starts) == 0:
+            return lines[:n_lines]
+        return lines[test_starts[-1]:n_lines]
+
+    def iter_all_lines(self):
+        """Iterate over all lines without keeping them in memory.
+
+        In contrast to `get_all_lines()` the file is read and decoded
+        line by line, so memory usage does not depend on the file size.
+        """
+
+        with open(self.path, "rb") as file_obj:
+            for line in file_obj:
+                if not line.endswith(b"\n"):
+                    # The last line is incomplete.
+                    break
+                yield line[:-1].decode("utf-8", "replace")
+
+    # ignoring errors
+
+    def currently_ignoring_errors(self):
+        return self._current_ignore_type() is not None
+
+    # records
+
+    def get_records(self, **criteria):
+        """Return parsed records of the lines.
+
+        See `GeckoLogRecords.find()` for the possible criteria.
+        """
+
+        return self._index.query_records(
+            lambda records, n_tests: records.find(**criteria))
+
+    def get_records_of_current_test(self, **criteria):
+        return self._index.query_records(
+            lambda records, n_tests: records.find(test_index=n_tests - 1,
+                                                  **criteria))
+
+    def group_records(self, key, **criteria):
+        """Group parsed records by one of their attributes.
+
+        See `GeckoLogRecords.group_by()`.
+        """
+
+        return self._index.query_records(
+            lambda records, n_tests: records.group_by(key, **criteria))
 
     # error lines
 
     def get_all_error_lines(self, **kwargs):
-        return self._filter_error_lines(self.get_all_lines(), **kwargs)
+        (lines, n_lines, _) = self._index.snapshot()
+        return self._filter_error_lines(islice(lines, n_lines), **kwargs)
+
+    def iter_all_error_lines(self, **kwargs):
+        """Like `get_all_error_lines()`, but in constant memory."""
+
+        return self._iter_error_lines(self.iter_all_lines(), **kwargs)
+
+    def iter_all_error_lines_by_test(self, **kwargs):
+        """Like `iter_all_error_lines()`, but yield `(test_name, line)`
+        tuples. The test name is None for lines before the first test.
+        """
+
+        current_test = [None]
+
+        def lines():
+            for line in self.iter_all_lines():
+                if line.find("TEST-START") != -1:
+                    current_test[0] = get_test_name(line)
+                yield line
+
+        for line in self._iter_error_lines(lines(), **kwargs):
+            yield (current_test[0], line)
 
     def get_error_lines_of_current_test(self, **kwargs):
         return self._filter_error_lines(
@@ -125,69 +401,30 @@ class GeckoLogParser(object):
     # Private Properties and Methods #
     ##################################
 
-    def _filter_error_lines(self, lines,
-                            return_ignored_as_well=False,
-                            return_expected_as_well=True):
-        error_lines = []
-        ignore_helpers = []
-        if not return_ignored_as_well:
-            ignore_helpers.append(IgnoreHelper(
-                self.IGNORE_ERRORS_START, self.IGNORE_ERRORS_END
-            ))
-        if not return_expected_as_well:
-            ignore_helpers.append(IgnoreHelper(
-                self.EXPECT_ERRORS_START, self.EXPECT_ERRORS_END
-            ))
-        prepend_to_next_line = ""
+    def _filter_error_lines(self, lines, **kwargs):
+        return list(self._iter_error_lines(lines, **kwargs))
+
+    def _iter_error_lines(self, lines, **kwargs):
+        error_filter = ErrorLineFilter(is_error_line=self._is_rp_exception,
+                                       **kwargs)
         for line in lines:
-            line = prepend_to_next_line + line
-            prepend_to_next_line = ""
-            if re.match(r"^console.\w+:\s*$", line):
-                prepend_to_next_line = line
-                continue
-            ignoring = False
-            for helper in ignore_helpers:
-                if helper.update_and_check(line) is True:
-                    ignoring = True
-            if ignoring or not self._is_rp_exception(line):
-                continue
-            error_lines.append(line)
-        return error_lines
-
-    @contextmanager
-    def _gecko_log_file(self):
-        with codecs.open(self.path, "r", "utf-8") as file_obj:
-            yield file_obj
-
-    def _is_exception(self, line):
-        line = line.lower()
-        if re.match(r"^console\.(?!error)", line):
-            return False
-        for word in ["error", "warning", "exception"]:
-            if line.find(word) != -1:
-                return True
-        return False
+            line = error_filter.check(line)
+            if line is not None:
+                yield line
+
+    def _current_ignore_type(self):
+        self._index.update()
+        if self._index.ignoring_errors:
+            return "ignore"
+        if self._index.expecting_errors:
+            return "expect"
+        return None
+
+    def _get_lines(self):
+        """Return a copy of the up-to-date list of lines."""
+
+        (lines, n_lines, _) = self._index.snapshot()
+        return lines[:n_lines]
 
     def _is_rp_exception(self, line):
-        if not self._is_exception(line):
-            return False
-
-        if (
-            line.find("[RequestPolicy]") == -1 and
-            line.find("chrome://rpcontinued/") == -1
-        ):
-            return False
-
-        if line.find("/third-party/") != -1:
-            return False
-
-        for pattern in WHITELIST:
-            if isinstance(pattern, retype):
-                if pattern.match(line):
-                    return False
-            else:
-                # string
-                if line.find(pattern) == 0:
-                    return False
-
-        return True
+        return is_rp_exception(line)
@@ -0,0 +1,265 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from array import array
+import re
+
+
+ERROR = "error"
+WARNING = "warning"
+INFO = "info"
+DEBUG = "debug"
+
+# The position in this tuple is the severity's id.
+SEVERITIES = (None, ERROR, WARNING, INFO, DEBUG)
+_SEVERITY_IDS = dict((severity, i) for (i, severity) in enumerate(SEVERITIES))
+
+_LEVELS = {
+    # JavaScript messages
+    "error": ERROR,
+    "warning": WARNING,
+    "strict warning": WARNING,
+    "Error": ERROR,
+    "Warning": WARNING,
+    # console.*
+    "warn": WARNING,
+    "log": INFO,
+    "info": INFO,
+    "debug": DEBUG,
+    "trace": DEBUG,
+    # Log.jsm
+    "FATAL": ERROR,
+    "ERROR": ERROR,
+    "WARN": WARNING,
+    "WARNING": WARNING,
+    "INFO": INFO,
+    "CONFIG": INFO,
+    "DEBUG": DEBUG,
+    "TRACE": DEBUG,
+}
+
+# "JavaScript error: <url>, line <n>: <message>"
+_JS_RE = re.compile(
+    r"JavaScript (error|warning|strict warning): (.*?), line (\d+): ")
+# '[JavaScript Error: "<message>" {file: "<url>" line: <n>}]'
+_JS_CONSOLE_SERVICE_RE = re.compile(
+    r'\[JavaScript (Error|Warning): "(.*)" \{file: "(.*?)" line: (\d+)')
+# "console.error: <message>"
+_CONSOLE_RE = re.compile(r"console\.(\w+):\s*")
+# "<timestamp>\t<module>\t<LEVEL>\t<message>"
+_LOG_JSM_RE = re.compile(r"\d+\t([^\t]*)\t([A-Z]+)\t")
+# "[Parent 123, Main Thread] WARNING: <message>: file <path>, line <n>"
+_NATIVE_RE = re.compile(r"\[[^\]]*\] (WARNING|ERROR): ")
+_NATIVE_FILE_RE = re.compile(r"file (.*?), line (\d+)")
+
+
+class GeckoLogRecord(object):
+    """The parsed form of one log line.
+
+    Records are created on demand from the columns of
+    `GeckoLogRecords`. The line itself is not copied.
+    """
+
+    __slots__ = ("_records", "index", "test_index", "severity", "source",
+                 "source_line", "logger", "message_start", "message_end")
+
+    def __init__(self, records, index):
+        self._records = records
+        self.index = index
+        self.test_index = records.test_indices[index]
+        self.severity = SEVERITIES[records.severity_ids[index]]
+        source_id = records.source_ids[index]
+        self.source = None if source_id == -1 else records.sources[source_id]
+        source_line = records.source_lines[index]
+        self.source_line = None if source_line == -1 else source_line
+        logger_id = records.logger_ids[index]
+        self.logger = None if logger_id == -1 else records.loggers[logger_id]
+        self.message_start = records.message_starts[index]
+        self.message_end = records.message_ends[index]
+
+    def __repr__(self):
+        return ("GeckoLogRecord(index={}, test_index={}, severity={}, "
+                "source={}, source_line={}, logger={})"
+                .format(self.index, self.test_index, self.severity,
+                        self.source, self.source_line, self.logger))
+
+    @property
+    def line(self):
+        return self._records.lines[self.index]
+
+    @property
+    def message(self):
+        return self.line[self.message_start:self.message_end]
+
+
+class GeckoLogRecords(object):
+    """Parsed gecko log lines, stored column-wise in typed arrays.
+
+    Each line takes about 25 bytes. Source URLs and paths are stored
+    once in `sources`, the names of Log.jsm loggers once in `loggers`,
+    and both are referenced by id. `GeckoLogRecord` objects are only
+    created for the lines returned by a query.
+
+    The test index of lines before the first TEST-START line is -1.
+    """
+
+    def __init__(self, lines, test_starts):
+        self.lines = lines
+        self.test_starts = test_starts
+        self.test_indices = array("i")
+        self.severity_ids = array("b")
+        self.source_ids = array("i")
+        self.source_lines = array("i")
+        self.logger_ids = array("i")
+        self.message_starts = array("i")
+        self.message_ends = array("i")
+        self.sources = []
+        self._source_ids = {}
+        self.loggers = []
+        self._logger_ids = {}
+        self._test_index = -1
+        self._console_severity = None
+
+    def __len__(self):
+        return len(self.test_indices)
+
+    def __getitem__(self, index):
+        return GeckoLogRecord(self, index)
+
+    def update(self):
+        """Parse the lines which have been added since the last update."""
+
+        for i in range(len(self), len(self.lines)):
+            self._add_line(self.lines[i])
+
+    def find(self, severity=None, test_index=None, source=None,
+             logger=None):
+        """Return the records matching all given criteria.
+
+        :param severity: A severity or a list of severities.
+        :param test_index: Only return lines of this test, or -1 for
+            the lines before the first test.
+        :param source: A prefix of the source URL or path.
+        :param logger: The name of a Log.jsm logger.
+        """
+
+        self.update()
+        (start, end) = self._get_range(test_index)
+        severity_ids = self._get_severity_ids(severity)
+        if source is not None:
+            source_ids = set(i for (i, url) in enumerate(self.sources)
+                             if url.startswith(source))
+        if logger is not None:
+            logger_id = self._logger_ids.get(logger)
+        records = []
+        for i in range(start, end):
+            if (severity_ids is not None and
+                    self.severity_ids[i] not in severity_ids):
+                continue
+            if source is not None and self.source_ids[i] not in source_ids:
+                continue
+            if logger is not None and self.logger_ids[i] != logger_id:
+                continue
+            records.append(GeckoLogRecord(self, i))
+        return records
+
+    def group_by(self, key, **criteria):
+        """Group the records matching `criteria` by an attribute.
+
+        :param key: The record attribute to group by, e.g. "severity",
+            "test_index", "source" or "logger".
+        :returns: A dict mapping the attribute values to lists of records.
+        """
+
+        groups = {}
+        for record in self.find(**criteria):
+            groups.setdefault(getattr(record, key), []).append(record)
+        return groups
+
+    def _get_range(self, test_index):
+        if test_index is None:
+            return (0, len(self))
+        n_tests = len(self.test_starts)
+        if test_index == -1:
+            return (0, self.test_starts[0] if n_tests > 0 else len(self))
+        if not 0 <= test_index < n_tests:
+            return (0, 0)
+        start = self.test_starts[test_index]
+        if test_index + 1 < n_tests:
+            return (start, self.test_starts[test_index + 1])
+        return (start, len(self))
+
+    def _get_severity_ids(self, severity):
+        if severity is None:
+            return None
+        if not isinstance(severity, (list, tuple, set)):
+            severity = [severity]
+        return set(_SEVERITY_IDS[s] for s in severity)
+
+    @staticmethod
+    def _get_id(value, values, ids):
+        if value is None:
+            return -1
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def _add_line(self, line):
+        if line.find("TEST-START") != -1:
+            self._test_index += 1
+        (severity, source, source_line, logger, message_start,
+         message_end) = self._parse_line(line)
+        self.test_indices.append(self._test_index)
+        self.severity_ids.append(_SEVERITY_IDS[severity])
+        self.source_ids.append(
+            self._get_id(source, self.sources, self._source_ids))
+        self.source_lines.append(-1 if source_line is None else source_line)
+        self.logger_ids.append(
+            self._get_id(logger, self.loggers, self._logger_ids))
+        self.message_starts.append(message_start)
+        self.message_ends.append(message_end)
+
+    def _parse_line(self, line):
+        # A "console.*:" line without message is continued on the next
+        # line, which then gets the console message's severity.
+        console_severity = self._console_severity
+        self._console_severity = None
+
+        if line.startswith("JavaScript "):
+            match = _JS_RE.match(line)
+            if match:
+                return (_LEVELS[match.group(1)], match.group(2),
+                        int(match.group(3)), None, match.end(), len(line))
+        elif line.startswith("[JavaScript "):
+            match = _JS_CONSOLE_SERVICE_RE.match(line)
+            if match:
+                return (_LEVELS[match.group(1)], match.group(3),
+                        int(match.group(4)), None, match.start(2),
+                        match.end(2))
+        elif line.startswith("console."):
+            match = _CONSOLE_RE.match(line)
+            if match:
+                severity = _LEVELS.get(match.group(1), INFO)
+                if match.end() == len(line):
+                    self._console_severity = severity
+                return (severity, None, None, None, match.end(), len(line))
+        elif line[:1].isdigit():
+            match = _LOG_JSM_RE.match(line)
+            if match:
+                return (_LEVELS.get(match.group(2)), None, None,
+                        match.group(1), match.end(), len(line))
+        elif line.startswith("["):
+            match = _NATIVE_RE.match(line)
+            if match:
+                file_match = _NATIVE_FILE_RE.search(line, match.end())
+                if file_match:
+                    return (_LEVELS[match.group(1)], file_match.group(1),
+                            int(file_match.group(2)), None, match.end(),
+                            len(line))
+                return (_LEVELS[match.group(1)], None, None, None,
+                        match.end(), len(line))
+        elif line.startswith("###!!! ASSERTION"):
+            return (ERROR, None, None, None, 0, len(line))
+        return (console_severity, None, None, None, 0, len(line))
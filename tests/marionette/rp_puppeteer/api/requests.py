@@ -4,6 +4,11 @@
 
 from firefox_puppeteer.base import BaseLib
 from contextlib import contextmanager
+from marionette_driver.errors import TimeoutException
+import gzip
+import json
+import os
+import shutil
 
 
 GET_BACKGROUND_PAGE = """
@@ -12,13 +17,599 @@ GET_BACKGROUND_PAGE = """
         FakeWebExt.api.backgroundApi.extension.getBackgroundPage()
 """
 
+# The lower bound in milliseconds and the number of buckets per power
+# of two of the latency histograms.
+LATENCY_HISTOGRAM_MIN = 0.001
+LATENCY_HISTOGRAM_STEPS = 8
+
+# The compact storage rebuilds its string table once it has more than
+# this many strings in addition to four per stored request, that is,
+# twice as many as the requests can reference.
+COMPACT_STRING_SLACK = 1024
+
+# Sets up `this.requestObserver` and starts listening.
+# Arguments: the storage and sampling settings, or null to keep the
+# current settings.
+REQUEST_OBSERVER = """
+  const {requestMemory} = """ + GET_BACKGROUND_PAGE + """.
+      rp.webRequest;
+  const [settings] = arguments;
+
+  // Both storages are ring buffers if a capacity is set: When full,
+  // each new request overwrites the oldest one. `push()` returns the
+  // number of dropped requests.
+
+  function ArrayStorage(aCapacity) {
+    this.capacity = aCapacity;
+    this.clear();
+  }
+  ArrayStorage.prototype = {
+    compact: false,
+    get length() {
+      return this.requests.length;
+    },
+    push(aRequest) {
+      if (this.requests.length === this.capacity) {
+        this.requests[this.head] = aRequest;
+        this.head = (this.head + 1) % this.capacity;
+        return 1;
+      }
+      this.requests.push(aRequest);
+      return 0;
+    },
+    slice(aStart) {
+      if (this.head === 0) {
+        return this.requests.slice(aStart);
+      }
+      return this.requests.slice(this.head).
+          concat(this.requests.slice(0, this.head)).
+          slice(aStart);
+    },
+    clear() {
+      this.requests = [];
+      // the position of the oldest request
+      this.head = 0;
+    },
+  };
+
+  // Stores each URI once, in a string table, and the requests as ids
+  // of their URIs, in typed arrays. The string table is kept on
+  // `clear()`, so readers can cache it. When too many of its strings
+  // are not referenced anymore, because requests were dropped or
+  // cleared, it is rebuilt and the storage gets a new id.
+  function CompactStorage(aCapacity) {
+    this.baseId = Date.now() + "-" + Math.random();
+    this.generation = 0;
+    this.id = this.baseId + "-0";
+    this.startTime = Date.now();
+    this.capacity = aCapacity;
+    this.strings = [];
+    this.stringIds = new Map();
+    this.clear();
+  }
+  CompactStorage.prototype = {
+    compact: true,
+    INITIAL_CAPACITY: 1024,
+    STRING_SLACK: """ + repr(COMPACT_STRING_SLACK) + """,
+    ALLOWED_FLAG: 1,
+    push({origin, dest, isAllowed}) {
+      let dropped = 0;
+      let i;
+      if (this.length === this.capacity) {
+        i = this.head;
+        this.head = (this.head + 1) % this.capacity;
+        dropped = 1;
+      } else {
+        if (this.length === this.origins.length) {
+          this._allocate(Math.min(this.length * 2, this.capacity));
+        }
+        i = this.length++;
+      }
+      this.origins[i] = this._intern(origin);
+      this.dests[i] = this._intern(dest);
+      this.flags[i] = isAllowed ? this.ALLOWED_FLAG : 0;
+      // milliseconds since `startTime`
+      this.times[i] = Date.now() - this.startTime;
+      if (this.strings.length > 4 * this.length + this.STRING_SLACK) {
+        this._rebuildStrings();
+      }
+      return dropped;
+    },
+    get(aIndex) {
+      const i = this._position(aIndex);
+      return {
+        origin: this.strings[this.origins[i]],
+        dest: this.strings[this.dests[i]],
+        isAllowed: (this.flags[i] & this.ALLOWED_FLAG) !== 0,
+      };
+    },
+    slice(aStart) {
+      const requests = [];
+      for (let i = aStart; i < this.length; ++i) {
+        requests.push(this.get(i));
+      }
+      return requests;
+    },
+    clear() {
+      this.length = 0;
+      // the position of the oldest request
+      this.head = 0;
+      this._allocate(Math.min(this.INITIAL_CAPACITY, this.capacity));
+    },
+    // Return the requests from `aStart` on, in compact form. Only the
+    // strings from `aStringStart` on are included.
+    encode(aStart, aStringStart) {
+      const toArray = a => {
+        if (this.head === 0) {
+          return Array.from(a.subarray(aStart, this.length));
+        }
+        const values = [];
+        for (let i = aStart; i < this.length; ++i) {
+          values.push(a[this._position(i)]);
+        }
+        return values;
+      };
+      return {
+        id: this.id,
+        startTime: this.startTime,
+        stringStart: aStringStart,
+        strings: this.strings.slice(aStringStart),
+        origins: toArray(this.origins),
+        dests: toArray(this.dests),
+        flags: toArray(this.flags),
+        times: toArray(this.times),
+      };
+    },
+    _position(aIndex) {
+      return this.head === 0 ? aIndex : (this.head + aIndex) % this.capacity;
+    },
+    _intern(aString) {
+      let id = this.stringIds.get(aString);
+      if (id === undefined) {
+        id = this.strings.length;
+        this.strings.push(aString);
+        this.stringIds.set(aString, id);
+      }
+      return id;
+    },
+    // Keep only the strings of the stored requests.
+    _rebuildStrings() {
+      const oldStrings = this.strings;
+      this.strings = [];
+      this.stringIds = new Map();
+      // All positions below `length` hold requests, also if the ring
+      // has wrapped.
+      for (let ids of [this.origins, this.dests]) {
+        for (let i = 0; i < this.length; ++i) {
+          ids[i] = this._intern(oldStrings[ids[i]]);
+        }
+      }
+      // Readers have to fetch the whole table again.
+      ++this.generation;
+      this.id = this.baseId + "-" + this.generation;
+    },
+    _allocate(aCapacity) {
+      const arrays = {
+        origins: new Uint32Array(aCapacity),
+        dests: new Uint32Array(aCapacity),
+        flags: new Uint8Array(aCapacity),
+        times: new Uint32Array(aCapacity),
+      };
+      for (let name of Object.keys(arrays)) {
+        if (this.length > 0) {
+          arrays[name].set(this[name].subarray(0, this.length));
+        }
+        this[name] = arrays[name];
+      }
+    },
+  };
+
+  // Counts latencies in log-linear buckets: bucket 0 counts values
+  // below `MIN`, bucket i > 0 those from MIN * 2 ** ((i - 1) / STEPS)
+  // on. See `LatencyHistogram` in Python.
+  function LatencyHistogram() {
+    this.count = 0;
+    this.sum = 0;
+    this.min = Infinity;
+    this.max = 0;
+    this.buckets = {};
+  }
+  LatencyHistogram.prototype = {
+    MIN: """ + repr(LATENCY_HISTOGRAM_MIN) + """,
+    STEPS: """ + repr(LATENCY_HISTOGRAM_STEPS) + """,
+    add(aValue) {
+      const i = aValue < this.MIN ? 0 :
+                1 + Math.floor(Math.log2(aValue / this.MIN) * this.STEPS);
+      this.buckets[i] = (this.buckets[i] || 0) + 1;
+      ++this.count;
+      this.sum += aValue;
+      this.min = Math.min(this.min, aValue);
+      this.max = Math.max(this.max, aValue);
+    },
+  };
+
+  this.requestObserver = (function (self) {
+    // the index of the first stored request
+    self.offset = self.offset || 0;
+    if (!self.storage) {
+      self.storage = new ArrayStorage(Infinity);
+    }
+    if (settings !== null) {
+      const capacity = settings.capacity === null ? Infinity :
+                       settings.capacity;
+      if (self.storage.compact !== settings.compact ||
+          self.storage.capacity !== capacity) {
+        self.offset += self.storage.length;
+        self.storage = settings.compact ? new CompactStorage(capacity) :
+                       new ArrayStorage(capacity);
+      }
+      self.sampleEvery = settings.sampleEvery;
+      self.onlyBlocked = settings.onlyBlocked;
+    }
+    self.sampleEvery = self.sampleEvery || 1;
+    self.onlyBlocked = self.onlyBlocked || false;
+    // counters, see `Requests.stats`
+    self.nObserved = self.nObserved || 0;
+    self.nSkipped = self.nSkipped || 0;
+    self.nDropped = self.nDropped || 0;
+    // the number of requests which were not skipped as allowed
+    self.nEligible = self.nEligible || 0;
+    // see `WAIT_FOR_REQUEST`
+    self.waiters = self.waiters || [];
+    // latency histograms by phase, see `Requests.latency_stats()`
+    self.latencies = self.latencies || {};
+    self.LatencyHistogram = LatencyHistogram;
+    if (!self.observeRequest) {
+      self.pushRequest = function({
+          isAllowed: aIsAllowed,
+          originUri: aOriginUri,
+          destUri: aDestUri,
+          requestResult: aRequestResult,
+          timings: aTimings,
+      }) {
+        const request = {
+          origin: aOriginUri,
+          dest: aDestUri,
+          isAllowed: aIsAllowed
+        };
+        ++self.nObserved;
+        if (aTimings) {
+          let total = 0;
+          for (let phase of Object.keys(aTimings)) {
+            self.addLatency(phase, aTimings[phase]);
+            total += aTimings[phase];
+          }
+          self.addLatency("total", total);
+        }
+        if (self.waiters.length !== 0) {
+          self.waiters = self.waiters.filter(w => !w(request));
+        }
+        if ((self.onlyBlocked && aIsAllowed) ||
+            self.nEligible++ % self.sampleEvery !== 0) {
+          ++self.nSkipped;
+          return;
+        }
+        const dropped = self.storage.push(request);
+        self.nDropped += dropped;
+        self.offset += dropped;
+      };
+      self.addLatency = function(aPhase, aValue) {
+        if (!self.latencies.hasOwnProperty(aPhase)) {
+          self.latencies[aPhase] = new self.LatencyHistogram();
+        }
+        self.latencies[aPhase].add(aValue);
+      };
+      self.observeRequest = self.pushRequest;
+    }
+    return self;
+  })(this.requestObserver || {});
+
+  if (this.listening !== true) {
+    requestMemory.onRequest.addListener(this.requestObserver.observeRequest);
+    this.listening = true;
+  }
+"""
+
+# Arguments: the index of the first request, or null; the number of
+# last requests, or null; the id of the compact storage and the number
+# of its strings known to the caller.
+FETCH_REQUESTS = """
+  if (typeof this.requestObserver !== "object") {
+    return null;
+  }
+  const [index, tail, storageId, knownStrings] = arguments;
+  const observer = this.requestObserver;
+  const storage = observer.storage;
+
+  let start = tail === null ? index - observer.offset : storage.length - tail;
+  start = Math.min(Math.max(start, 0), storage.length);
+  const result = {
+    first: observer.offset,
+    next: observer.offset + storage.length,
+  };
+  if (storage.compact) {
+    result.compact = storage.encode(
+        start, storageId === storage.id ? knownStrings : 0);
+  } else {
+    result.requests = storage.slice(start);
+  }
+  return result;
+"""
+
+# Defines `matches(aRequest, aCriteria)`.
+REQUEST_MATCHER = """
+  Components.utils.import("resource://gre/modules/Services.jsm");
+
+  const baseDomains = new Map();
+  function getBaseDomain(aUri) {
+    if (!baseDomains.has(aUri)) {
+      let baseDomain = null;
+      try {
+        const uri = Services.io.newURI(aUri, null, null);
+        try {
+          baseDomain = Services.eTLD.getBaseDomain(uri);
+        } catch (e) {
+          // e.g. IP addresses
+          baseDomain = uri.host;
+        }
+      } catch (e) {
+        // e.g. URIs without host
+      }
+      baseDomains.set(aUri, baseDomain);
+    }
+    return baseDomains.get(aUri);
+  }
+
+  function matches(aRequest, aCriteria) {
+    return (
+      (!("origin" in aCriteria) || aRequest.origin === aCriteria.origin) &&
+      (!("dest" in aCriteria) || aRequest.dest === aCriteria.dest) &&
+      (!("isAllowed" in aCriteria) ||
+          aRequest.isAllowed === aCriteria.isAllowed) &&
+      (!("originBaseDomain" in aCriteria) ||
+          getBaseDomain(aRequest.origin) === aCriteria.originBaseDomain) &&
+      (!("destBaseDomain" in aCriteria) ||
+          getBaseDomain(aRequest.dest) === aCriteria.destBaseDomain)
+    );
+  }
+"""
+
+# Arguments: criteria, aggregation.
+QUERY_REQUESTS = REQUEST_MATCHER + """
+  if (typeof this.requestObserver !== "object") {
+    return null;
+  }
+  const [criteria, aggregation] = arguments;
+  const observer = this.requestObserver;
+
+  const start = Math.max((criteria.since || 0) - observer.offset, 0);
+  const requests = observer.storage.slice(start).
+      filter(r => matches(r, criteria));
+
+  switch (aggregation) {
+    case "list":
+      return requests;
+
+    case "count":
+      return requests.length;
+
+    case "countByDestBaseDomain": {
+      const counts = {};
+      for (let request of requests) {
+        const baseDomain = String(getBaseDomain(request.dest));
+        counts[baseDomain] = (counts[baseDomain] || 0) + 1;
+      }
+      return counts;
+    }
+
+    case "allowedBlockedTotals": {
+      const totals = {allowed: 0, blocked: 0};
+      for (let request of requests) {
+        totals[request.isAllowed ? "allowed" : "blocked"] += 1;
+      }
+      return totals;
+    }
+
+    case "distinctOrigins":
+      return Array.from(new Set(requests.map(r => r.origin)));
+
+    case "distinctDests":
+      return Array.from(new Set(requests.map(r => r.dest)));
+  }
+  throw new Error("Unknown aggregation: " + aggregation);
+"""
+
+# Arguments: criteria, timeout in milliseconds.
+WAIT_FOR_REQUEST = REQUEST_MATCHER + """
+  Components.utils.import("resource://gre/modules/Timer.jsm");
+
+  if (typeof this.requestObserver !== "object" || this.listening !== true) {
+    marionetteScriptFinished(null);
+    return;
+  }
+  const [criteria, timeout] = arguments;
+  const observer = this.requestObserver;
+
+  const start = Math.max((criteria.since || 0) - observer.offset, 0);
+  const request = observer.storage.slice(start).
+      find(r => matches(r, criteria));
+  if (request !== undefined) {
+    marionetteScriptFinished({request});
+    return;
+  }
+
+  // Called by the observer for each new request. Returns whether the
+  // waiter is done.
+  const waiter = function(aRequest) {
+    if (!matches(aRequest, criteria)) {
+      return false;
+    }
+    clearTimeout(timer);
+    marionetteScriptFinished({request: aRequest});
+    return true;
+  };
+  const timer = setTimeout(function() {
+    const index = observer.waiters.indexOf(waiter);
+    if (index !== -1) {
+      observer.waiters.splice(index, 1);
+    }
+    marionetteScriptFinished({timedOut: true});
+  }, timeout);
+  observer.waiters.push(waiter);
+"""
+
+# Sets up `this.requestRecorder`, which appends each request to a file
+# as a line of JSON. The requests are written in batches, off the main
+# thread, by OS.File.
+# Arguments: the path of the file; the number of requests per batch;
+# the interval in milliseconds after which an incomplete batch is
+# written; the maximum number of requests waiting to be written.
+START_RECORDING = """
+  Components.utils.import("resource://gre/modules/osfile.jsm");
+  Components.utils.import("resource://gre/modules/Timer.jsm");
+  Components.utils.importGlobalProperties(["TextEncoder"]);
+  const {requestMemory} = """ + GET_BACKGROUND_PAGE + """.
+      rp.webRequest;
+  const [path, batchSize, flushInterval, maxPending] = arguments;
+
+  if (typeof this.requestRecorder === "object") {
+    return false;
+  }
+  const encoder = new TextEncoder();
+  const recorder = this.requestRecorder = {
+    nObserved: 0,
+    nWritten: 0,
+    nDropped: 0,
+    // requests which are recorded but not written yet
+    nPending: 0,
+    batch: [],
+    error: null,
+    file: null,
+    onRequest({isAllowed, originUri, destUri}) {
+      // Requests dropped because of a full buffer leave a gap in the
+      // indices.
+      const index = recorder.nObserved++;
+      if (recorder.nPending >= maxPending) {
+        ++recorder.nDropped;
+        return;
+      }
+      recorder.batch.push(JSON.stringify({
+        index,
+        time: Date.now(),
+        origin: originUri,
+        dest: destUri,
+        isAllowed,
+      }));
+      ++recorder.nPending;
+      if (recorder.batch.length >= batchSize) {
+        recorder.flush();
+      }
+    },
+    // Return a promise, resolved when all batches are written.
+    flush() {
+      const n = recorder.batch.length;
+      if (n === 0) {
+        return recorder.writing;
+      }
+      const data = encoder.encode(recorder.batch.join("\\n") + "\\n");
+      recorder.batch = [];
+      recorder.writing = recorder.writing.
+          then(() => recorder.file.write(data)).
+          then(() => {
+            recorder.nWritten += n;
+          }, e => {
+            recorder.error = recorder.error || String(e);
+            recorder.nDropped += n;
+          }).
+          then(() => {
+            recorder.nPending -= n;
+          });
+      return recorder.writing;
+    },
+    getStats() {
+      return {
+        observed: recorder.nObserved,
+        written: recorder.nWritten,
+        dropped: recorder.nDropped,
+        pending: recorder.nPending,
+        error: recorder.error,
+      };
+    },
+  };
+  recorder.writing = OS.File.open(path, {write: true, truncate: true}).
+      then(file => {
+        recorder.file = file;
+      }, e => {
+        recorder.error = String(e);
+      });
+  recorder.timer = setInterval(recorder.flush, flushInterval);
+  requestMemory.onRequest.addListener(recorder.onRequest);
+  return true;
+"""
+
+# Stops the recorder and finishes with its stats, once all requests
+# are written and the file is closed.
+STOP_RECORDING = """
+  Components.utils.import("resource://gre/modules/Timer.jsm");
+  const {requestMemory} = """ + GET_BACKGROUND_PAGE + """.
+      rp.webRequest;
+
+  if (typeof this.requestRecorder !== "object") {
+    marionetteScriptFinished(null);
+    return;
+  }
+  const recorder = this.requestRecorder;
+  delete this.requestRecorder;
+  requestMemory.onRequest.removeListener(recorder.onRequest);
+  clearInterval(recorder.timer);
+  recorder.flush().
+      then(() => recorder.file !== null && recorder.file.close()).
+      catch(e => {
+        recorder.error = recorder.error || String(e);
+      }).
+      then(() => marionetteScriptFinished(recorder.getStats()));
+"""
+
+# Python keyword arguments of the query methods, and their JS names.
+_QUERY_CRITERIA = {
+    "origin": "origin",
+    "dest": "dest",
+    "is_allowed": "isAllowed",
+    "origin_base_domain": "originBaseDomain",
+    "dest_base_domain": "destBaseDomain",
+    "since": "since",
+}
+
 
 class Requests(BaseLib):
-    """Class for observing requests."""
+    """Class for observing requests.
+
+    Each observed request gets an index, starting at zero when the
+    sandbox is set up. `clear()` removes requests, but the indices are
+    not reused, so an index can serve as a cursor into the requests.
+
+    In compact mode, see `start_listening()`, the sandbox interns the
+    URIs into a string table and stores the requests in typed arrays.
+    They are transferred in this form as well, and each string only
+    once per `Requests` instance.
+
+    For long runs the storage can be bounded to a capacity, making it
+    a ring buffer which drops the oldest requests, and requests can be
+    sampled. See `stats` for the number of dropped and skipped ones.
+
+    To keep all requests of a long run, record them to a file instead,
+    see `start_recording()`.
+    """
+
+    # Added to the timeout of `wait_for()` for the script timeout, so
+    # that the script times out itself.
+    SCRIPT_TIMEOUT_MARGIN = 5000
 
     def __init__(self, marionette_getter, sandbox="default"):
         super(Requests, self).__init__(marionette_getter)
         self._sandbox = "requestpolicy-requests-" + sandbox
+        self._decoder = CompactRequestsDecoder()
+        self._recording_path = None
 
     def __del__(self):
         self.stop_listening()
@@ -30,13 +621,158 @@ class Requests(BaseLib):
 
     @property
     def all(self):
+        return self.since(0)
+
+    @property
+    def count(self):
+        """The number of requests observed since the sandbox was set up,
+        including cleared requests. This is the index of the next
+        request.
+        """
+
         return self.marionette.execute_script("""
           if (typeof this.requestObserver !== "object") {
             return null;
           }
-          return this.requestObserver.requests;
+          const observer = this.requestObserver;
+          return observer.offset + observer.storage.length;
         """, sandbox=self._sandbox, new_sandbox=False)
 
+    def latency_stats(self, percentiles=(50, 90, 99, 99.9)):
+        """Return the latencies of the requests observed since the last
+        `clear()`, as measured by RequestPolicy for each request.
+
+        The latencies are in milliseconds, by phase: "decision" (policy
+        lookup and redirect checks), "bookkeeping" (the request memory)
+        and "total". The stats of each phase are a dict with "count",
+        "mean", "min", "max", "percentiles", mapping each percentile to
+        its approximate value, and "histogram", a list of
+        `(lower_bound, upper_bound, count)` tuples.
+        """
+
+        latencies = self.marionette.execute_script("""
+          if (typeof this.requestObserver !== "object") {
+            return {};
+          }
+          return this.requestObserver.latencies;
+        """, sandbox=self._sandbox, new_sandbox=False)
+        return dict((phase, LatencyHistogram(data).get_stats(percentiles))
+                    for (phase, data) in latencies.items())
+
+    @property
+    def stats(self):
+        """Counters since the last `clear()`: the number of "observed"
+        requests, of currently "stored" ones, of requests "skipped" by
+        sampling and of stored requests "dropped" because the capacity
+        was reached. Additionally the "capacity", or None.
+        """
+
+        return self.marionette.execute_script("""
+          if (typeof this.requestObserver !== "object") {
+            return null;
+          }
+          const observer = this.requestObserver;
+          const capacity = observer.storage.capacity;
+          return {
+            observed: observer.nObserved,
+            stored: observer.storage.length,
+            skipped: observer.nSkipped,
+            dropped: observer.nDropped,
+            capacity: capacity === Infinity ? null : capacity,
+          };
+        """, sandbox=self._sandbox, new_sandbox=False)
+
+    def since(self, index):
+        """Return the requests from the given index on.
+
+        Only these requests are transferred, so the cost does not
+        depend on the number of earlier requests.
+        """
+
+        result = self._fetch(index=index)
+        return None if result is None else result[2]
+
+    def tail(self, n):
+        """Return the last `n` requests."""
+
+        result = self._fetch(tail=n)
+        return None if result is None else result[2]
+
+    def cursor(self, index=None):
+        """Return a `RequestsCursor` starting at `index`.
+
+        :param index: Defaults to the index of the next request.
+        """
+
+        return RequestsCursor(self, self.count if index is None else index)
+
+    # Queries.
+    #
+    # The following methods are evaluated inside the sandbox, so that
+    # only their result is transferred. They accept these criteria:
+    #
+    # * `origin`, `dest`: the exact URI
+    # * `origin_base_domain`, `dest_base_domain`: the base domain of
+    #   the URI, e.g. "maindomain.test"
+    # * `is_allowed`: True or False
+    # * `since`: only consider requests from this index on
+
+    def find(self, **criteria):
+        """Return the requests matching all criteria."""
+
+        return self._query("list", criteria)
+
+    def count_matching(self, **criteria):
+        return self._query("count", criteria)
+
+    def count_by_dest_base_domain(self, **criteria):
+        """Return a dict mapping destination base domains to the number
+        of requests. For URIs without host the key is "null".
+        """
+
+        return self._query("countByDestBaseDomain", criteria)
+
+    def allowed_blocked_totals(self, **criteria):
+        """Return a dict with the numbers of "allowed" and "blocked"
+        requests.
+        """
+
+        return self._query("allowedBlockedTotals", criteria)
+
+    def distinct_origins(self, **criteria):
+        return self._query("distinctOrigins", criteria)
+
+    def distinct_dests(self, **criteria):
+        return self._query("distinctDests", criteria)
+
+    def wait_for(self, timeout=10, **criteria):
+        """Wait until a request matching the criteria is observed.
+
+        The wait happens inside the sandbox, in a single async script
+        call which finishes as soon as a matching request is observed.
+        Requests observed already are checked first. If `since` is
+        specified, only requests observed at or after that index are
+        considered, including the ones observed already.
+
+        :param timeout: The timeout in seconds.
+        :param criteria: See the query methods.
+        :returns: The matching request.
+        """
+
+        result = self.marionette.execute_async_script(
+            WAIT_FOR_REQUEST,
+            script_args=[self._get_js_criteria(criteria),
+                         int(timeout * 1000)],
+            sandbox=self._sandbox, new_sandbox=False,
+            script_timeout=int(timeout * 1000) + self.SCRIPT_TIMEOUT_MARGIN)
+        if result is None:
+            raise RuntimeError("Requests are not being observed.")
+        if result.get("timedOut"):
+            raise TimeoutException(
+                "No request matching {} within {} s.".format(criteria,
+                                                             timeout))
+        return result["request"]
+
     @property
     def listening(self):
         """Whether or not requests are currently observed."""
@@ -50,44 +786,41 @@ class Requests(BaseLib):
     def sandbox(self):
         return self._sandbox
 
-    def start_listening(self):
-        """Start observing requests."""
+    def start_listening(self, compact=False, capacity=None, sample_every=1,
+                        only_blocked=False):
+        """Start observing requests.
 
-        self.continue_listening()
+        :param compact: Whether to store the requests in compact form.
+        :param capacity: Store at most this number of requests. When
+            full, each new request replaces the oldest one, which is
+            counted as dropped.
+        :param sample_every: Store only every n-th request.
+        :param only_blocked: Store only blocked requests.
+        :raises ValueError: If `capacity` or `sample_every` is less
+            than one.
+        """
+
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity must be at least 1, not {}".format(
+                capacity))
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1, not {}"
+                             .format(sample_every))
+        self._listen({
+            "compact": compact,
+            "capacity": capacity,
+            "sampleEvery": sample_every,
+            "onlyBlocked": only_blocked,
+        })
         self.clear()
 
     def continue_listening(self):
-        """Start observing requests without clearing the requests."""
+        """Start observing requests without clearing the requests.
 
-        # Already listening?
-        if self.listening:
-            return
+        The settings of the previous `start_listening()` are kept.
+        """
 
-        return self.marionette.execute_script("""
-          const {requestMemory} = """ + GET_BACKGROUND_PAGE + """.
-              rp.webRequest;
-
-          this.requestObserver = (function (self) {
-            self.requests = self.requests || [];
-            self.pushRequest = function({
-                isAllowed: aIsAllowed,
-                originUri: aOriginUri,
-                destUri: aDestUri,
-                requestResult: aRequestResult,
-            }) {
-              self.requests.push({
-                origin: aOriginUri,
-                dest: aDestUri,
-                isAllowed: aIsAllowed
-              });
-            };
-            self.observeRequest = self.pushRequest;
-            return self;
-          })(this.requestObserver || {});
-
-          requestMemory.onRequest.addListener(this.requestObserver.observeRequest);
-          this.listening = true;
-        """, sandbox=self._sandbox, new_sandbox=False)
+        self._listen(None)
 
     def stop_listening(self):
         """Stop observing requests."""
@@ -115,6 +848,8 @@ class Requests(BaseLib):
 
         if self.listening:
             self.stop_listening()
+        if self.recording:
+            self.stop_recording()
 
         # Mainly send `new_sandbox=True`.
         self.marionette.execute_script("", sandbox=self._sandbox,
@@ -127,5 +862,274 @@ class Requests(BaseLib):
             return
 
         self.marionette.execute_script("""
-          this.requestObserver.requests = [];
+          const observer = this.requestObserver;
+          observer.offset += observer.storage.length;
+          observer.storage.clear();
+          observer.nObserved = 0;
+          observer.nSkipped = 0;
+          observer.nDropped = 0;
+          observer.nEligible = 0;
+          observer.latencies = {};
+        """, sandbox=self._sandbox, new_sandbox=False)
+
+    def start_recording(self, path, batch_size=500, flush_interval=0.2,
+                        max_pending=100000):
+        """Stream all requests observed from now on to a file.
+
+        Each request is written as a line of JSON (NDJSON) with its
+        "index", "time", "origin", "dest" and "isAllowed". The sandbox
+        collects the requests in batches and appends them to the file
+        asynchronously, so neither the browser nor the test waits for
+        the disk. Recording is independent of `start_listening()`, and
+        the requests are not kept in memory.
+
+        :param path: The file to write. If it ends with ".gz", the
+            file is compressed with gzip by `stop_recording()`.
+        :param batch_size: The number of requests written at once.
+        :param flush_interval: Write incomplete batches after this
+            number of seconds.
+        :param max_pending: The maximum number of requests waiting to
+            be written. Further requests are dropped, leaving a gap in
+            the indices.
+        """
+
+        path = os.path.abspath(path)
+        started = self.marionette.execute_script(
+            START_RECORDING,
+            script_args=[self._get_recording_file(path), batch_size,
+                         int(flush_interval * 1000), max_pending],
+            sandbox=self._sandbox, new_sandbox=False)
+        if not started:
+            raise RuntimeError("Requests are being recorded already.")
+        self._recording_path = path
+
+    def stop_recording(self, timeout=60):
+        """Stop recording and wait until all requests are written.
+
+        :param timeout: The timeout in seconds for writing the file.
+        :returns: The recording stats, see `recording_stats`.
+        """
+
+        stats = self.marionette.execute_async_script(
+            STOP_RECORDING, sandbox=self._sandbox, new_sandbox=False,
+            script_timeout=int(timeout * 1000))
+        if stats is None:
+            return None
+        path = self._recording_path
+        self._recording_path = None
+        if stats["error"] is not None:
+            raise IOError("Recording requests to {} failed: {}".format(
+                path, stats["error"]))
+        recording_file = self._get_recording_file(path)
+        if recording_file != path:
+            with open(recording_file, "rb") as f_in:
+                with gzip.open(path, "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            os.remove(recording_file)
+        return stats
+
+    @contextmanager
+    def record(self, path, **kwargs):
+        self.start_recording(path, **kwargs)
+        try:
+            yield
+        finally:
+            self.stop_recording()
+
+    @property
+    def recording(self):
+        """Whether or not requests are currently recorded."""
+
+        return self.marionette.execute_script("""
+          return typeof this.requestRecorder === "object";
+        """, sandbox=self._sandbox, new_sandbox=False)
+
+    @property
+    def recording_stats(self):
+        """The number of "observed", "written", "dropped" and "pending"
+        requests of the current recording, and the write "error", if
+        any. None if not recording.
+        """
+
+        return self.marionette.execute_script("""
+          if (typeof this.requestRecorder !== "object") {
+            return null;
+          }
+          return this.requestRecorder.getStats();
         """, sandbox=self._sandbox, new_sandbox=False)
+
+    ##################################
+    # Private Properties and Methods #
+    ##################################
+
+    def _get_recording_file(self, path):
+        """Return the file written by the browser."""
+
+        if path.endswith(".gz"):
+            return path[:-len(".gz")] + ".part"
+        return path
+
+    def _listen(self, settings):
+        self.marionette.execute_script(
+            REQUEST_OBSERVER, script_args=[settings],
+            sandbox=self._sandbox, new_sandbox=False)
+
+    def _get_js_criteria(self, criteria):
+        js_criteria = {}
+        for (name, value) in criteria.items():
+            if name not in _QUERY_CRITERIA:
+                raise TypeError("Unknown criterion: {}".format(name))
+            js_criteria[_QUERY_CRITERIA[name]] = value
+        return js_criteria
+
+    def _query(self, aggregation, criteria):
+        return self.marionette.execute_script(
+            QUERY_REQUESTS,
+            script_args=[self._get_js_criteria(criteria), aggregation],
+            sandbox=self._sandbox, new_sandbox=False)
+
+    def _fetch(self, index=None, tail=None):
+        """Return the index of the first stored request, the index of
+        the next request and a list of requests.
+
+        :param index: Fetch the requests from this index on.
+        :param tail: Fetch this number of last requests.
+        """
+
+        result = self.marionette.execute_script(
+            FETCH_REQUESTS,
+            script_args=[index, tail, self._decoder.storage_id,
+                         len(self._decoder.strings)],
+            sandbox=self._sandbox, new_sandbox=False)
+        if result is None:
+            return None
+        if "compact" in result:
+            requests = self._decoder.decode(result["compact"])
+        else:
+            requests = result["requests"]
+        return (result["first"], result["next"], requests)
+
+
+class LatencyHistogram(object):
+    """A latency histogram, as counted in the sandbox.
+
+    Values are counted in log-linear buckets, so each percentile is
+    accurate to about 9 % (`LATENCY_HISTOGRAM_STEPS` buckets per power
+    of two).
+    """
+
+    def __init__(self, data):
+        self.count = data["count"]
+        self.sum = data["sum"]
+        self.min = data["min"]
+        self.max = data["max"]
+        self.buckets = sorted((int(i), count)
+                              for (i, count) in data["buckets"].items())
+
+    @staticmethod
+    def get_bucket_bounds(index):
+        if index == 0:
+            return (0.0, LATENCY_HISTOGRAM_MIN)
+        return tuple(LATENCY_HISTOGRAM_MIN *
+                     2 ** (float(i) / LATENCY_HISTOGRAM_STEPS)
+                     for i in (index - 1, index))
+
+    def get_percentile(self, percentile):
+        """Return the upper bound of the bucket containing the
+        percentile, limited to the maximum.
+        """
+
+        if self.count == 0:
+            return None
+        rank = percentile / 100.0 * self.count
+        seen = 0
+        for (index, count) in self.buckets:
+            seen += count
+            if seen >= rank:
+                break
+        upper_bound = self.get_bucket_bounds(index)[1]
+        return min(max(upper_bound, self.min), self.max)
+
+    def get_stats(self, percentiles):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "min": self.min if self.count > 0 else None,
+            "max": self.max,
+            "percentiles": dict((p, self.get_percentile(p))
+                                for p in percentiles),
+            "histogram": [self.get_bucket_bounds(index) + (count,)
+                          for (index, count) in self.buckets],
+        }
+
+
+class CompactRequestsDecoder(object):
+    """Decodes requests transferred in compact form.
+
+    The string table is cached, so that only new strings have to be
+    transferred. If the storage has rebuilt its table, it has a new id
+    and sends the whole table, which then replaces the cached one.
+    """
+
+    ALLOWED_FLAG = 1
+
+    def __init__(self):
+        self.storage_id = None
+        self.strings = []
+
+    def decode(self, data, include_time=False):
+        """Return the requests as dicts, like `Requests.all`.
+
+        :param include_time: Add the time of each request, in
+            milliseconds since the epoch, as "time".
+        """
+
+        self.storage_id = data["id"]
+        del self.strings[data["stringStart"]:]
+        self.strings.extend(data["strings"])
+        strings = self.strings
+        requests = []
+        for (origin, dest, flags, time) in zip(data["origins"], data["dests"],
+                                               data["flags"], data["times"]):
+            request = {
+                "origin": strings[origin],
+                "dest": strings[dest],
+                "isAllowed": flags & self.ALLOWED_FLAG != 0,
+            }
+            if include_time:
+                request["time"] = data["startTime"] + time
+            requests.append(request)
+        return requests
+
+
+class RequestsCursor(object):
+    """Reads the requests observed after the previous read.
+
+    Requests which have been cleared or dropped before they could be
+    read are counted in `n_missed`.
+    """
+
+    def __init__(self, requests, index):
+        self._requests = requests
+        self.index = index
+        self.n_missed = 0
+
+    def read(self):
+        """Return the new requests and advance the cursor."""
+
+        result = self._requests._fetch(index=self.index)
+        if result is None:
+            return []
+        (first, next_index, requests) = result
+        self.n_missed += max(0, first - self.index)
+        self.index = next_index
+        return requests
+
+
+def iter_recorded_requests(path):
+    """Yield the requests recorded to a file, see `start_recording()`."""
+
+    open_file = gzip.open if path.endswith(".gz") else open
+    with open_file(path, "rb") as f:
+        for line in f:
+            yield json.loads(line)
@@ -3,8 +3,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from firefox_puppeteer.base import BaseLib
-import copy
+from collections import namedtuple
 import os.path
+import shutil
 import json
 
 
@@ -14,6 +15,233 @@ GET_BACKGROUND_PAGE = """
         FakeWebExt.api.backgroundApi.extension.getBackgroundPage()
 """
 
+# Collects the user and temporary rules in `rules`, as
+# `{action, data, temp}` objects.
+GET_USER_RULES = """
+  var {rp} = """ + GET_BACKGROUND_PAGE + """;
+  var rulesets = rp.policy.getUserRulesets();
+  var rules = [];
+  for (let rulesetName of ["user", "temp"]) {
+    let {entries} = rulesets[rulesetName].rawRuleset;
+    for (let [action, actionString] of [[1, "allow"], [2, "deny"]]) {
+      for (let data of entries[actionString]) {
+        rules.push({action, data, temp: rulesetName === "temp"});
+      }
+    }
+  }
+"""
+
+# Captures the user and temporary rules, the enabled subscriptions and
+# the origin URIs in the request memory.
+SNAPSHOT_POLICY = GET_USER_RULES + """
+  var subscriptions = [];
+  var {lists} = rp.policy.subscriptions.getSubscriptions().data;
+  for (let listName of Object.keys(lists)) {
+    for (let subName of Object.keys(lists[listName].subscriptions || {})) {
+      subscriptions.push([listName, subName]);
+    }
+  }
+  var {requestSets} = rp.webRequest.requestMemory;
+  return {
+    rules: JSON.parse(JSON.stringify(rules)),
+    subscriptions,
+    requestMemoryOrigins: Object.keys(requestSets.allowedRequests.origins).
+        concat(Object.keys(requestSets.rejectedRequests.origins)),
+  };
+"""
+
+# Restores a snapshot, see `SNAPSHOT_POLICY`, and returns what has been
+# added and removed since the snapshot. The subscriptions and the request
+# memory are only compared if they are restored.
+# Arguments: the snapshot; whether to store the user rules if changed;
+# whether to restore the subscriptions and the request memory.
+RESTORE_POLICY = """
+  Components.utils.import("resource://gre/modules/Services.jsm");
+  var [snapshot, store, restoreSubscriptions, restoreRequestMemory] =
+      arguments;
+
+  var {rp} = """ + GET_BACKGROUND_PAGE + """;
+  var rulesets = rp.policy.getUserRulesets();
+  var diff = {
+    rules: {added: [], removed: []},
+    subscriptions: {added: [], removed: []},
+    requestMemory: {added: []},
+  };
+
+  // rules
+  // Rules are identified by their canonical string, like `RuleKey`.
+  var Ruleset = rulesets.user.ruleset.constructor;
+  function getRuleKey({action, data, temp}) {
+    return JSON.stringify([action, temp,
+                           Ruleset.rawRuleToCanonicalString(data)]);
+  }
+  var snapshotRules = new Map(snapshot.rules.map(r => [getRuleKey(r), r]));
+  var currentRules = new Map();
+  for (let rulesetName of ["user", "temp"]) {
+    let {entries} = rulesets[rulesetName].rawRuleset;
+    for (let [action, actionString] of [[1, "allow"], [2, "deny"]]) {
+      for (let data of entries[actionString]) {
+        let rule = {action, data, temp: rulesetName === "temp"};
+        currentRules.set(getRuleKey(rule), rule);
+      }
+    }
+  }
+  for (let [key, rule] of currentRules) {
+    if (!snapshotRules.has(key)) {
+      diff.rules.added.push(rule);
+    }
+  }
+  for (let [key, rule] of snapshotRules) {
+    if (!currentRules.has(key)) {
+      diff.rules.removed.push(rule);
+    }
+  }
+  // `removeRule()` removes from both the user and the temporary rules,
+  // so rules of the snapshot are re-added afterwards.
+  for (let {action, data} of diff.rules.added) {
+    rp.policy.removeRule(action, data, true);
+  }
+  var userRulesChanged = false;
+  for (let rule of snapshot.rules) {
+    let {action, data, temp} = rule;
+    let rawRuleset = rulesets[temp ? "temp" : "user"].rawRuleset;
+    if (rawRuleset.ruleExists(action, data)) {
+      continue;
+    }
+    if (temp) {
+      rp.policy.addTemporaryRule(action, data);
+    } else {
+      rp.policy.addRule(action, data, true);
+      userRulesChanged = true;
+    }
+  }
+  userRulesChanged = userRulesChanged ||
+      diff.rules.added.some(rule => !rule.temp);
+  if (store && userRulesChanged) {
+    rp.policy.storeRules();
+  }
+  // subscriptions
+  if (restoreSubscriptions) {
+    let {subscriptions} = rp.policy;
+    let {lists} = subscriptions.getSubscriptions().data;
+    let snapshotSubscriptions = new Set(
+        snapshot.subscriptions.map(s => JSON.stringify(s)));
+    let currentSubscriptions = new Set();
+    for (let listName of Object.keys(lists)) {
+      for (let subName of Object.keys(lists[listName].subscriptions || {})) {
+        let key = JSON.stringify([listName, subName]);
+        currentSubscriptions.add(key);
+        if (!snapshotSubscriptions.has(key)) {
+          diff.subscriptions.added.push([listName, subName]);
+        }
+      }
+    }
+    for (let [listName, subName] of snapshot.subscriptions) {
+      if (!currentSubscriptions.has(JSON.stringify([listName, subName]))) {
+        diff.subscriptions.removed.push([listName, subName]);
+      }
+    }
+    // Like the subscriptions settings page does.
+    let notify = function(aTopic, aListName, aSubName) {
+      Services.obs.notifyObservers(null, aTopic, JSON.stringify({
+        [aListName]: {[aSubName]: true},
+      }));
+    };
+    for (let [listName, subName] of diff.subscriptions.added) {
+      subscriptions.removeSubscription(listName, subName);
+      notify("rpcontinued-subscription-policy-removed", listName, subName);
+    }
+    for (let [listName, subName] of diff.subscriptions.removed) {
+      subscriptions.addSubscription(listName, subName);
+      notify("rpcontinued-subscription-policy-added", listName, subName);
+    }
+  }
+
+  // request memory
+  if (restoreRequestMemory) {
+    let {requestMemory} = rp.webRequest;
+    let snapshotOrigins = new Set(snapshot.requestMemoryOrigins);
+    let currentOrigins = new Set(
+        Object.keys(requestMemory.requestSets.allowedRequests.origins).concat(
+        Object.keys(requestMemory.requestSets.rejectedRequests.origins)));
+    for (let origin of currentOrigins) {
+      if (!snapshotOrigins.has(origin)) {
+        diff.requestMemory.added.push(origin);
+        requestMemory.removeSavedRequestsByOriginURI(origin);
+      }
+    }
+  }
+
+  return JSON.parse(JSON.stringify(diff));
+"""
+
+# Arguments: the rules to remove, or null to remove all user and
+# temporary rules; the rules to add; whether to store the rules. Each
+# rule is an object with "action", "data" and "temp".
+CHANGE_RULES = """
+  var [rulesToRemove, rulesToAdd, store] = arguments;
+
+  var {rp} = """ + GET_BACKGROUND_PAGE + """;
+  if (rulesToRemove === null) {
+    rulesToRemove = [];
+    var rulesets = rp.policy.getUserRulesets();
+    for (let rulesetName of ["user", "temp"]) {
+      let {entries} = rulesets[rulesetName].rawRuleset;
+      for (let [action, actionString] of [[1, "allow"], [2, "deny"]]) {
+        for (let data of entries[actionString]) {
+          rulesToRemove.push({action, data});
+        }
+      }
+    }
+  }
+  for (let {action, data} of rulesToRemove) {
+    rp.policy.removeRule(action, data, true);
+  }
+  for (let {action, data, temp} of rulesToAdd) {
+    if (temp === true) {
+      rp.policy.addTemporaryRule(action, data);
+    } else {
+      rp.policy.addRule(action, data, true);
+    }
+  }
+  if (store) {
+    rp.policy.storeRules();
+  }
+"""
+
+
+# Checks (origin, destination) pairs against the user rules and the
+# subscription rules. Returns the canonical strings of the matched
+# rules, for each pair.
+CHECK_REQUESTS = """
+  Components.utils.import("resource://gre/modules/Services.jsm");
+  var [pairs] = arguments;
+
+  var {rp} = """ + GET_BACKGROUND_PAGE + """;
+  function getRuleStrings(aMatches) {
+    return aMatches.map(([ruleset, match]) => {
+      let {matchToRawRule, rawRuleToCanonicalString} = ruleset.constructor;
+      return rawRuleToCanonicalString(matchToRawRule(match));
+    });
+  }
+  function getMatchedRules(aResult) {
+    return {
+      allow: getRuleStrings(aResult.matchedAllowRules),
+      deny: getRuleStrings(aResult.matchedDenyRules),
+    };
+  }
+  return pairs.map(([origin, dest]) => {
+    let originUri = Services.io.newURI(origin, null, null);
+    let destUri = Services.io.newURI(dest, null, null);
+    return {
+      user: getMatchedRules(
+          rp.policy.checkRequestAgainstUserRules(originUri, destUri)),
+      subscriptions: getMatchedRules(
+          rp.policy.checkRequestAgainstSubscriptionRules(originUri, destUri)),
+    };
+  });
+"""
+
 
 class Rules(BaseLib):
     """Class for managing user rules."""
@@ -73,11 +301,80 @@ class Rules(BaseLib):
                 counter += self._count_rules(allow_value, temp_value)
         return counter
 
+    def add_many(self, rules, store=False):
+        """Add rules in a single script call.
+
+        :param rules: `Rule` instances.
+        :param store: Whether to save the rules to the json file, once
+            all rules are added.
+        """
+
+        self._change_rules([], rules, store)
+
+    def remove_many(self, rules, store=False):
+        """Remove rules in a single script call."""
+
+        self._change_rules(rules, [], store)
+
+    def replace_all(self, rules, store=False):
+        """Replace all user and temporary rules in a single script call.
+        """
+
+        self._change_rules(None, rules, store)
+
     def remove_all(self, store=False):
-        for rule in self.all:
-            rule.remove(store=False)
-        if store:
-            self.save()
+        self._change_rules(None, [], store)
+
+    def snapshot(self):
+        """Capture the policy state in a single script call.
+
+        The snapshot contains the user and temporary rules, the enabled
+        subscriptions and the origin URIs in the request memory.
+        """
+
+        return self.marionette.execute_script(SNAPSHOT_POLICY)
+
+    def restore(self, snapshot, store=False, subscriptions=True,
+                request_memory=True):
+        """Restore a snapshot in a single script call.
+
+        Requests remembered since the snapshot are removed from the
+        request memory. Requests forgotten since the snapshot cannot be
+        restored.
+
+        :param store: Whether to save the user rules, if changed.
+        :param subscriptions: Whether to restore the subscriptions.
+        :param request_memory: Whether to restore the request memory.
+        :returns: A `PolicyDiff` of the state before restoring. Its
+            subscriptions or request memory origins are empty if they
+            are not restored.
+        """
+
+        diff = self.marionette.execute_script(
+            RESTORE_POLICY,
+            script_args=[snapshot, store, subscriptions, request_memory])
+        return PolicyDiff(
+            added_rules=[self._create_rule_from_spec(spec)
+                         for spec in diff["rules"]["added"]],
+            removed_rules=[self._create_rule_from_spec(spec)
+                           for spec in diff["rules"]["removed"]],
+            added_subscriptions=[tuple(s) for s in
+                                 diff["subscriptions"]["added"]],
+            removed_subscriptions=[tuple(s) for s in
+                                   diff["subscriptions"]["removed"]],
+            added_request_memory_origins=diff["requestMemory"]["added"])
+
+    def check_requests(self, pairs):
+        """Check requests against the rules in a single script call.
+
+        :param pairs: `(origin_uri, dest_uri)` tuples.
+        :returns: For each pair, a dict with the keys "user" and
+            "subscriptions", each a dict of the canonical strings of
+            the matched "allow" and "deny" rules.
+        """
+
+        return self.marionette.execute_script(
+            CHECK_REQUESTS, script_args=[[list(pair) for pair in pairs]])
 
     def save(self):
         """Save the rules to the json file."""
@@ -87,10 +384,83 @@ class Rules(BaseLib):
           rp.policy.storeRules();
         """)
 
+    def reload(self):
+        """Load the user rules from the json file again.
+
+        The temporary rules are removed.
+        """
+
+        self.marionette.execute_async_script("""
+          var {rp} = """ + GET_BACKGROUND_PAGE + """;
+          rp.policy.loadUserRules().then(() => {
+            marionetteScriptFinished();
+          });
+        """)
+
+    def start_counting_hits(self):
+        """Start counting how often each rule is matched.
+
+        Counting is off by default, as it slows down every request.
+        Previous counts are discarded.
+        """
+
+        self.marionette.execute_script("""
+          var {rp} = """ + GET_BACKGROUND_PAGE + """;
+          rp.policy.startCountingRuleHits();
+        """)
+
+    def stop_counting_hits(self):
+        """Stop counting rule hits and discard the counts."""
+
+        self.marionette.execute_script("""
+          var {rp} = """ + GET_BACKGROUND_PAGE + """;
+          rp.policy.stopCountingRuleHits();
+        """)
+
+    def get_hits(self):
+        """Get the hits of the user and temporary rules.
+
+        Only requests checked since `start_counting_hits()` are
+        counted.
+
+        :returns: A `RuleHits` instance.
+        """
+
+        result = self.marionette.execute_script(GET_USER_RULES + """
+          return {
+            hits: rp.policy.getRuleHits(),
+            rules: JSON.parse(JSON.stringify(rules)),
+          };
+        """)
+        hits = {}
+        for entry in result["hits"]:
+            if entry["ruleset"] not in ("user", "temp"):
+                continue
+            hit_rule = self.create_rule(entry["rule"],
+                                        allow=entry["ruleAction"] == 1,
+                                        temp=entry["ruleset"] == "temp")
+            hits[hit_rule] = hits.get(hit_rule, 0) + entry["hits"]
+        rules = [self._create_rule_from_spec(spec)
+                 for spec in result["rules"]]
+        unmatched = [rule for rule in rules if rule not in hits]
+        return RuleHits(hits, unmatched)
+
     ##################################
     # Private Properties and Methods #
     ##################################
 
+    def _change_rules(self, rules_to_remove, rules_to_add, store):
+        if rules_to_remove is not None:
+            rules_to_remove = [rule._spec for rule in rules_to_remove]
+        self.marionette.execute_script(
+            CHANGE_RULES,
+            script_args=[rules_to_remove,
+                         [rule._spec for rule in rules_to_add], store])
+
+    def _create_rule_from_spec(self, spec):
+        return self.create_rule(spec["data"], allow=spec["action"] == 1,
+                                temp=spec["temp"])
+
     def _count_rules(self, allow, temp):
         """Count the number of rules for one specific allow/temp combination.
         """
@@ -131,7 +501,88 @@ class Rules(BaseLib):
                 for rule_data in rule_data_list]
 
 
+class PolicyDiff(object):
+    """The changes of the policy state since a snapshot.
+
+    Rules are `Rule` instances, subscriptions `(list_name, sub_name)`
+    tuples.
+    """
+
+    def __init__(self, added_rules, removed_rules, added_subscriptions,
+                 removed_subscriptions, added_request_memory_origins):
+        self.added_rules = added_rules
+        self.removed_rules = removed_rules
+        self.added_subscriptions = added_subscriptions
+        self.removed_subscriptions = removed_subscriptions
+        self.added_request_memory_origins = added_request_memory_origins
+
+    def __nonzero__(self):
+        return bool(self.added_rules or self.removed_rules or
+                    self.added_subscriptions or self.removed_subscriptions or
+                    self.added_request_memory_origins)
+
+    def __repr__(self):
+        return ("PolicyDiff(added_rules={}, removed_rules={}, "
+                "added_subscriptions={}, removed_subscriptions={}, "
+                "added_request_memory_origins={})"
+                .format(self.added_rules, self.removed_rules,
+                        self.added_subscriptions, self.removed_subscriptions,
+                        self.added_request_memory_origins))
+
+
+class RuleHits(object):
+    """The number of times rules were matched.
+
+    `hits` is a list of `(rule, hits)` tuples, the most matched rule
+    first. `unmatched` are the current rules which were not matched at
+    all. Rules which were matched but have been removed since are
+    in `hits`, too.
+    """
+
+    def __init__(self, hits, unmatched):
+        self.hits = sorted(hits.items(),
+                           key=lambda item: (-item[1], item[0]))
+        self.unmatched = sorted(unmatched)
+
+    def __repr__(self):
+        return ("RuleHits(hits={}, unmatched={})"
+                .format(self.hits, self.unmatched))
+
+    def save(self, file_path):
+        """Write the hits to a json file."""
+
+        def get_rule_dict(rule):
+            return {"allow": rule.allow, "temp": rule.temp,
+                    "rule_data": rule.rule_data}
+
+        hits = []
+        for (rule, n_hits) in self.hits:
+            rule_dict = get_rule_dict(rule)
+            rule_dict["hits"] = n_hits
+            hits.append(rule_dict)
+        with open(file_path, "w") as f:
+            json.dump({"hits": hits,
+                       "unmatched": [get_rule_dict(rule)
+                                     for rule in self.unmatched]},
+                      f, indent=2, sort_keys=True)
+
+
+class InvalidRulesFileException(Exception):
+    pass
+
+
 class RulesFile(BaseLib):
+    """A rules file, e.g. `user.json`.
+
+    The validated content of a file is cached, shared by all instances,
+    until the file's mtime, size or inode changes. So reading the same
+    unchanged file again, as done after each test, costs one `stat`.
+    Rule objects and rule keys are only created when needed. Each rule
+    object has its own copy of the rule data.
+    """
+
+    # `(stat_key, _RulesFileContent)` tuples by file path.
+    _cache = {}
 
     def __init__(self, marionette_getter, file_path="user.json"):
         super(RulesFile, self).__init__(marionette_getter)
@@ -148,64 +599,265 @@ class RulesFile(BaseLib):
     #################################
 
     def get_rules(self):
-        if not os.path.isfile(self.file_path):
+        """Return the rules in the file, or None if it does not exist.
+
+        :raises InvalidRulesFileException: If the file is not a valid
+            rules file.
+        """
+
+        content = self._get_content()
+        if content is None:
             return None
+        return [Rule(lambda: self.marionette, rule_data, allow=is_allow,
+                     temp=False)
+                for (is_allow, rule_data) in content.iter_rule_data()]
 
-        with open(self.file_path, 'r') as f:
-            json_data = json.loads(f.read())
+    def count_rules(self):
+        """Return the number of rules in the file, 0 if it does not
+        exist.
+        """
 
-        assert json_data["metadata"]["version"] is 1
+        content = self._get_content()
+        return 0 if content is None else content.n_rules
 
-        entries = json_data["entries"]
-        rules = []
+    def diff(self, other):
+        """Compare the rules in the file to other rules.
 
-        for (keyword, is_allow) in [("allow", True), ("deny", False)]:
-            if keyword not in entries:
-                continue
+        A file which does not exist has no rules.
 
-            for rule_data in entries[keyword]:
-                rules.append(Rule(lambda: self.marionette, rule_data,
-                                  allow=is_allow, temp=False))
+        :param other: `Rule` instances, e.g. from `Rules.get_rules()`,
+            or another `RulesFile`. Temporary rules are ignored, as they
+            are never stored.
+        :returns: A `RulesFileDiff`.
+        """
 
-        return rules
+        own_rules = self._get_rule_data_by_key()
+        if isinstance(other, RulesFile):
+            other_rules = other._get_rule_data_by_key()
+        else:
+            other_rules = dict((rule.key, rule.rule_data) for rule in other
+                               if not rule.temp)
+
+        def get_missing_rules(rules, other_rules):
+            return sorted(Rule(lambda: self.marionette, rule_data,
+                               allow=key.allow, temp=False)
+                          for (key, rule_data) in rules.items()
+                          if key not in other_rules)
+
+        return RulesFileDiff(
+            only_in_file=get_missing_rules(own_rules, other_rules),
+            only_in_other=get_missing_rules(other_rules, own_rules))
+
+    def install(self, source_path):
+        """Copy a policy file to this file's path.
+
+        The browser does not notice the new file until the rules are
+        loaded again, see `Rules.reload()`.
+        """
+
+        directory = os.path.dirname(self.file_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._cache.pop(self.file_path, None)
+        shutil.copyfile(source_path, self.file_path)
 
     def remove(self):
+        self._cache.pop(self.file_path, None)
         if os.path.isfile(self.file_path):
             os.remove(self.file_path)
 
+    ##################################
+    # Private Properties and Methods #
+    ##################################
+
+    def _get_content(self):
+        """Return the file's `_RulesFileContent`, or None if the file
+        does not exist.
+        """
+
+        if not os.path.isfile(self.file_path):
+            self._cache.pop(self.file_path, None)
+            return None
+        with open(self.file_path, "r") as f:
+            stat = os.fstat(f.fileno())
+            stat_key = (stat.st_mtime, stat.st_size, stat.st_ino,
+                        stat.st_dev)
+            cached = self._cache.get(self.file_path)
+            if cached is not None and cached[0] == stat_key:
+                return cached[1]
+            try:
+                json_data = json.load(f)
+            except ValueError as e:
+                raise InvalidRulesFileException(
+                    "{}: {}".format(self.file_path, e))
+        content = _RulesFileContent(
+            _validate_rules_file_data(json_data, self.file_path))
+        self._cache[self.file_path] = (stat_key, content)
+        return content
+
+    def _get_rule_data_by_key(self):
+        content = self._get_content()
+        return {} if content is None else content.rule_data_by_key
+
+
+def _validate_rules_file_data(json_data, file_path):
+    """Check the data like `RawRuleset.checkDataObj()` in ruleset.ts
+    does, and the types of the entries as well.
+
+    :returns: The entries.
+    """
+
+    def check(condition, error):
+        if not condition:
+            raise InvalidRulesFileException(
+                "{}: {}".format(file_path, error))
+
+    check(isinstance(json_data, dict), "not an object")
+    check(isinstance(json_data.get("metadata"), dict), "no 'metadata' key")
+    check("version" in json_data["metadata"], "no 'version' key")
+    version = json_data["metadata"]["version"]
+    check(version == 1,
+          "Wrong metadata version. Expected 1, was {}".format(version))
+    check(isinstance(json_data.get("entries"), dict), "no 'entries' key")
+    entries = json_data["entries"]
+    for keyword in ["allow", "deny"]:
+        rules = entries.get(keyword, [])
+        check(isinstance(rules, list),
+              "'{}' is not a list".format(keyword))
+        for rule_data in rules:
+            check(isinstance(rule_data, dict),
+                  "'{}' rule is not an object".format(keyword))
+            for origin_or_dest in ["o", "d"]:
+                check(isinstance(rule_data.get(origin_or_dest, {}), dict),
+                      "'{}' of a rule is not an object".format(
+                          origin_or_dest))
+    return entries
+
+
+class _RulesFileContent(object):
+    """The validated entries of a rules file."""
+
+    def __init__(self, entries):
+        self._entries = entries
+        self._rule_data_by_key = None
+
+    @property
+    def n_rules(self):
+        return sum(len(self._entries.get(keyword, []))
+                   for keyword in ["allow", "deny"])
+
+    @property
+    def rule_data_by_key(self):
+        """The rule data by `RuleKey`, created on first use."""
+
+        if self._rule_data_by_key is None:
+            self._rule_data_by_key = dict(
+                (RuleKey(is_allow, False,
+                         get_canonical_rule_string(rule_data)), rule_data)
+                for (is_allow, rule_data) in self.iter_rule_data())
+        return self._rule_data_by_key
+
+    def iter_rule_data(self):
+        """Yield `(allow, rule_data)` tuples."""
+
+        for (keyword, is_allow) in [("allow", True), ("deny", False)]:
+            for rule_data in self._entries.get(keyword, []):
+                yield (is_allow, rule_data)
+
+
+class RulesFileDiff(object):
+    """The differences of the rules in a file and other rules.
+
+    Rules are `Rule` instances.
+    """
+
+    def __init__(self, only_in_file, only_in_other):
+        self.only_in_file = only_in_file
+        self.only_in_other = only_in_other
+
+    def __nonzero__(self):
+        return bool(self.only_in_file or self.only_in_other)
+
+    def __repr__(self):
+        return ("RulesFileDiff(only_in_file={}, only_in_other={})"
+                .format(self.only_in_file, self.only_in_other))
+
+
+def get_canonical_rule_string(rule_data):
+    """Return the canonical string of a rule's data, exactly like
+    `Ruleset.rawRuleToCanonicalString()` in ruleset.ts does.
+
+    Two rules with the same string are the same rule for RequestPolicy.
+    """
+
+    parts = [u"{"]
+    has_dest = rule_data.get("d") is not None
+    has_origin = rule_data.get("o") is not None
+    if has_dest:
+        _append_canonical_endpoint_string(rule_data["d"], u"d", parts)
+    if has_dest and has_origin:
+        parts.append(u",")
+    if has_origin:
+        _append_canonical_endpoint_string(rule_data["o"], u"o", parts)
+    parts.append(u"}")
+    return u"".join(parts)
+
+
+def _append_canonical_endpoint_string(endpoint_spec, origin_or_dest, parts):
+    # The quirks of the original are kept: no comma between the port
+    # and the scheme if there is no host, and an additional "}".
+    parts.append(u"\"{}\":{{".format(origin_or_dest))
+    need_comma = False
+    if endpoint_spec.get("h"):
+        parts.append(u"\"h\":\"{}\"".format(endpoint_spec["h"]))
+        need_comma = True
+    if endpoint_spec.get("port"):
+        if need_comma:
+            parts.append(u",")
+        parts.append(u"\"port\":\"{}\"".format(endpoint_spec["port"]))
+    if endpoint_spec.get("s"):
+        if need_comma:
+            parts.append(u",")
+        parts.append(u"\"s\":\"{}\"".format(endpoint_spec["s"]))
+    parts.append(u"}")
+    parts.append(u"}")
+
+
+# The identity of a rule. Rules are equal if their keys are equal.
+RuleKey = namedtuple("RuleKey", ["allow", "temp", "canonical_string"])
+
 
 class Rule(BaseLib):
-    """Class to represent a specific rule."""
+    """Class to represent a specific rule.
+
+    Rules are hashable, so sets of rules and their differences can be
+    computed in linear time. Note that a rule's hash changes if its
+    `allow`, `temp` or `rule_data` is changed.
+    """
+
+    __slots__ = ("allow", "temp", "_rule_data", "_canonical_string")
 
     def __init__(self, marionette_getter, rule_data, allow, temp):
         super(Rule, self).__init__(marionette_getter)
-        self._set_rule_data(rule_data)
+        self.rule_data = rule_data
         self.allow = allow
         self.temp = temp
 
     def __eq__(self, other):
         if not isinstance(other, Rule):
             return False
-        return (self.allow == other.allow and self.temp == other.temp and
-                self.rule_data == other.rule_data)
+        return self.key == other.key
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.key)
+
     def __cmp__(self, other):
-        # Temporary rules first.
-        if self.temp != other.temp:
-            return -1 if self.temp else 1
-        # "Deny" rules first.
-        if self.allow != other.allow:
-            return -1 if not self.allow else 1
-        # Use the dictionary's (`dict`) comparison operators on `rule_data`.
-        if self.rule_data < other.rule_data:
-            return -1
-        elif self.rule_data == other.rule_data:
-            return 0
-        else:
-            return 1
+        # Temporary rules first, then "deny" rules first.
+        return cmp((not self.temp, self.allow, self._canonical_string),
+                   (not other.temp, other.allow, other._canonical_string))
 
     def __repr__(self):
         return ("Rule(rule_data={}, allow={}, temp={})"
@@ -215,6 +867,20 @@ class Rule(BaseLib):
     # Public Properties and Methods #
     #################################
 
+    @property
+    def rule_data(self):
+        return self._rule_data
+
+    @rule_data.setter
+    def rule_data(self, new_rule_data):
+        self._set_rule_data(new_rule_data)
+
+    @property
+    def key(self):
+        """The rule's `RuleKey`."""
+
+        return RuleKey(self.allow, self.temp, self._canonical_string)
+
     def add(self, store=False):
         """Add the rule to the user policy."""
 
@@ -279,16 +945,31 @@ class Rule(BaseLib):
     def _rule_action(self):
         return 1 if self.allow else 2
 
+    @property
+    def _spec(self):
+        """The rule as passed to `CHANGE_RULES`."""
+
+        return {"action": self._rule_action, "data": self.rule_data,
+                "temp": self.temp}
+
     def _get_rule_data_entry(self, first, second):
         if first in self.rule_data and second in self.rule_data[first]:
             return self.rule_data[first][second]
         return None
 
     def _set_rule_data(self, new_rule_data):
-        rule_data = copy.deepcopy(new_rule_data)
-        # Convert port numbers to integer
-        if "o" in rule_data and "port" in rule_data["o"]:
-            rule_data["o"]["port"] = int(rule_data["o"]["port"])
-        if "d" in rule_data and "port" in rule_data["d"]:
-            rule_data["d"]["port"] = int(rule_data["d"]["port"])
-        self.rule_data = rule_data
+        # The rule gets its own copy, so that changing its data cannot
+        # change the caller's data, e.g. the cached content of a
+        # `RulesFile`. Rule data is two levels deep, so copying these is
+        # enough.
+        rule_data = {}
+        for (key, value) in new_rule_data.items():
+            if isinstance(value, dict):
+                value = dict(value)
+                # Convert port numbers to integer
+                port = value.get("port")
+                if isinstance(port, basestring) and port.isdigit():
+                    value["port"] = int(port)
+            rule_data[key] = value
+        self._rule_data = rule_data
+        self._canonical_string = get_canonical_rule_string(rule_data)
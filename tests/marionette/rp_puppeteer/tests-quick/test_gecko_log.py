@@ -3,6 +3,21 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from rp_ui_harness import RequestPolicyTestCase
+from rp_puppeteer.api.gecko_log_follower import (ErrorLoggedException,
+                                                 GeckoLogFollower,
+                                                 GeckoLogTimeoutException)
+from rp_puppeteer.api.gecko_log_parser import (GeckoLogParser,
+                                               is_rp_exception)
+from rp_utils.gecko_log_fingerprints import (ErrorFingerprintDatabase,
+                                             get_fingerprint,
+                                             normalize_error_line)
+from rp_utils.gecko_log_report import analyze_gecko_log
+from rp_utils.gecko_log_testing import (generate_lines,
+                                        reference_is_rp_exception)
+import os
+import tempfile
+import threading
+import time
 
 
 class ErrorIgnoringTests(object):
@@ -23,3 +38,328 @@ class TestIgnoringErrors(ErrorIgnoringTests, RequestPolicyTestCase):
 
 class TestIgnoringExpectedErrors(ErrorIgnoringTests, RequestPolicyTestCase):
     expected_error = True
+
+
+class TestGeckoLogParser(RequestPolicyTestCase):
+
+    def setUp(self):
+        super(TestGeckoLogParser, self).setUp()
+        (fd, self.log_path) = tempfile.mkstemp(suffix=".gecko.log")
+        os.close(fd)
+        self.parser = GeckoLogParser(self.log_path)
+
+    def tearDown(self):
+        try:
+            os.remove(self.log_path)
+        finally:
+            super(TestGeckoLogParser, self).tearDown()
+
+    def _append(self, text):
+        with open(self.log_path, "ab") as f:
+            f.write(text.encode("utf-8"))
+
+    def test_incremental_reading(self):
+        self._append(u"foo\nbar \u00fc\nincomplete")
+        self.assertEqual(self.parser.get_all_lines(), [u"foo", u"bar \u00fc"])
+
+        self._append(u" line\n\n")
+        self.assertEqual(self.parser.get_all_lines(),
+                         [u"foo", u"bar \u00fc", u"incomplete line", u""])
+
+    def test_truncated_file(self):
+        self._append(u"foo\nbar\n")
+        self.assertEqual(self.parser.get_all_lines(), [u"foo", u"bar"])
+
+        with open(self.log_path, "wb") as f:
+            f.write(b"baz\n")
+        self.assertEqual(self.parser.get_all_lines(), [u"baz"])
+
+    def test_lines_by_test(self):
+        self._append(u"foo\n")
+        self.assertEqual(self.parser.get_lines_before_first_test(), [u"foo"])
+        self.assertEqual(self.parser.get_lines_of_current_test(), [u"foo"])
+
+        self._append(u"TEST-START: test_a\nbar\nTEST-START: test_b\n")
+        self.assertEqual(self.parser.get_lines_before_first_test(), [u"foo"])
+        self.assertEqual(self.parser.get_lines_of_current_test(),
+                         [u"TEST-START: test_b"])
+
+        self._append(u"baz\n")
+        self.assertEqual(self.parser.get_lines_of_current_test(),
+                         [u"TEST-START: test_b", u"baz"])
+
+    def test_ignore_state(self):
+        self.assertFalse(self.parser.currently_ignoring_errors())
+        self._append(GeckoLogParser.IGNORE_ERRORS_START + u"\n")
+        self.assertTrue(self.parser.currently_ignoring_errors())
+        self._append(GeckoLogParser.IGNORE_ERRORS_END + u"\n")
+        self.assertFalse(self.parser.currently_ignoring_errors())
+        self._append(GeckoLogParser.EXPECT_ERRORS_START + u"\nfoo\n")
+        self.assertEqual(self.parser._current_ignore_type(), "expect")
+        self._append(GeckoLogParser.EXPECT_ERRORS_END + u"\n")
+        self.assertFalse(self.parser.currently_ignoring_errors())
+
+    def test_iter_all_error_lines(self):
+        for line in generate_lines(5000):
+            self._append(line + u"\n")
+        self._append(u"console.error: [RequestPolicy] incomplete")
+        self.assertEqual(list(self.parser.iter_all_error_lines()),
+                         self.parser.get_all_error_lines())
+
+    def test_analyze_gecko_log(self):
+        error_1 = u"console.error: [RequestPolicy] error 1"
+        error_2 = u"console.error: [RequestPolicy] error 2"
+        self._append(u"\n".join([
+            error_1,
+            u"TEST-START: test_a.py TestA.test_a",
+            u"TEST-START: test_b.py TestB.test_b",
+            error_1,
+            error_2,
+            u""
+        ]))
+        report = analyze_gecko_log(self.log_path)
+        self.assertEqual(report["n_errors"], 3)
+        self.assertEqual(report["first_error"], error_1)
+        self.assertEqual(report["tests"], [
+            {"test": None, "n_errors": 1, "first_error": error_1},
+            {"test": u"test_b.py TestB.test_b", "n_errors": 2,
+             "first_error": error_1},
+        ])
+
+    def test_records(self):
+        self._append(u"\n".join([
+            u"1500000000000\taddons.xpi\tDEBUG\tstarting",
+            u"TEST-START: test_a.py TestA.test_a",
+            (u"JavaScript error: chrome://rpcontinued/content/main.js, "
+             u"line 12: TypeError: foo is undefined"),
+            u"console.warn:",
+            u"[RequestPolicy] Warning: bar",
+            (u"[Parent 12, Main Thread] WARNING: NS_ENSURE_TRUE(x) failed: "
+             u"file /builds/nsDocShell.cpp, line 34"),
+            u""
+        ]))
+
+        records = self.parser.get_records()
+        self.assertEqual(len(records), 6)
+        self.assertEqual([r.severity for r in records],
+                         ["debug", None, "error", "warning", "warning",
+                          "warning"])
+        self.assertEqual([r.test_index for r in records],
+                         [-1, 0, 0, 0, 0, 0])
+
+        js_error = records[2]
+        self.assertEqual(js_error.source,
+                         u"chrome://rpcontinued/content/main.js")
+        self.assertEqual(js_error.source_line, 12)
+        self.assertEqual(js_error.message, u"TypeError: foo is undefined")
+        self.assertIsNone(js_error.logger)
+
+        log_jsm_line = records[0]
+        self.assertEqual(log_jsm_line.logger, u"addons.xpi")
+        self.assertIsNone(log_jsm_line.source)
+        self.assertEqual(log_jsm_line.message, u"starting")
+        self.assertEqual(
+            [r.index for r in self.parser.get_records(logger=u"addons.xpi")],
+            [0])
+        self.assertEqual(self.parser.get_records(source=u"addons"), [])
+
+        self.assertEqual(
+            [r.index for r in self.parser.get_records(
+                severity=["error", "warning"],
+                source=u"chrome://rpcontinued/")],
+            [2])
+        self.assertEqual(
+            [r.index for r in self.parser.get_records_of_current_test(
+                severity="warning")],
+            [3, 4, 5])
+        self.assertEqual(
+            dict((k, len(v)) for (k, v) in
+                 self.parser.group_records("test_index").items()),
+            {-1: 1, 0: 5})
+
+
+class TestGeckoLogFollower(RequestPolicyTestCase):
+
+    error_line = u"[RequestPolicy] Error: foo"
+
+    def setUp(self):
+        super(TestGeckoLogFollower, self).setUp()
+        (fd, self.log_path) = tempfile.mkstemp(suffix=".gecko.log")
+        os.close(fd)
+        self.follower = GeckoLogFollower(self.log_path, interval=0.001)
+        self.follower.start()
+
+    def tearDown(self):
+        try:
+            self.follower.stop()
+            os.remove(self.log_path)
+        finally:
+            super(TestGeckoLogFollower, self).tearDown()
+
+    def _append(self, text):
+        with open(self.log_path, "ab") as f:
+            f.write(text.encode("utf-8"))
+
+    def _append_later(self, text):
+        timer = threading.Timer(0.05, self._append, [text])
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_wait_for_line(self):
+        self._append(u"foo\n")
+        self._append_later(u"bar\nfoo\n")
+        self.assertEqual(self.follower.wait_for_line(u"foo", start=1,
+                                                     timeout=5), 2)
+        self.assertEqual(self.follower.wait_for_line(
+            lambda line: line.startswith(u"b"), timeout=5), 1)
+        self.assertRaises(GeckoLogTimeoutException,
+                          self.follower.wait_for_line, u"baz", timeout=0.05)
+
+    def test_wait_for_quiet(self):
+        self._append_later(u"foo\n")
+        self.follower.wait_for_quiet(0.1, timeout=5)
+        self.assertEqual(self.follower.n_lines, 1)
+
+    def test_invalid_utf8(self):
+        with open(self.log_path, "ab") as f:
+            f.write(b"foo \xff\nbar\n")
+        self.assertEqual(self.follower.wait_for_line(u"bar", timeout=5), 1)
+
+    def test_failing_callback(self):
+        def callback(line):
+            raise ValueError(line)
+
+        self.follower.subscribe_errors(callback)
+        self._append_later(self.error_line + u"\n")
+        start = time.time()
+        self.assertRaises(ValueError, self.follower.wait_for_line, u"never",
+                          timeout=5)
+        self.assertLess(time.time() - start, 4)
+
+        # The thread is restarted by the next call.
+        self._append(u"foo\n")
+        self.assertEqual(self.follower.wait_for_line(u"foo", timeout=5), 1)
+
+    def test_reading_while_following(self):
+        # The follower thread updates the index while it is read.
+        parser = GeckoLogParser(self.log_path)
+        for i in range(200):
+            start_line = u"TEST-START: test_{}".format(i)
+            self._append(u"{}\nline {}\n".format(start_line, i))
+            self.follower.wait_for_line(start_line, timeout=5)
+            lines = parser.get_lines_of_current_test()
+            self.assertEqual(lines[0], start_line)
+            records = parser.get_records_of_current_test()
+            self.assertEqual(records[0].line, start_line)
+
+    def test_subscribe_errors(self):
+        received = []
+        subscription = self.follower.subscribe_errors(received.append)
+        self._append(u"\n".join([
+            u"foo",
+            GeckoLogParser.IGNORE_ERRORS_START,
+            self.error_line + u" ignored",
+            GeckoLogParser.IGNORE_ERRORS_END,
+            self.error_line, u""]))
+        self.follower.poll()
+        self.assertEqual(subscription.errors, [self.error_line])
+        self.assertEqual(received, [self.error_line])
+
+        self.assertRaises(ErrorLoggedException, self.follower.wait_for_line,
+                          u"never", timeout=5, abort_on=subscription)
+
+        subscription.unsubscribe()
+        self._append(self.error_line + u"\n")
+        self.follower.poll()
+        self.assertEqual(len(subscription.errors), 1)
+
+
+class TestErrorClassifier(RequestPolicyTestCase):
+
+    edge_case_lines = [
+        u"",
+        u"[RequestPolicy]",
+        u"ERROR chrome://rpcontinued/content/main.js",
+        u"Console.Error: [RequestPolicy] Error: foo",
+        u"console.errors: [RequestPolicy] foo",
+        u"CONSOLE.WARN: [RequestPolicy] Error: foo",
+        u"console.log: chrome://rpcontinued/ exception",
+        u"xconsole.log: [RequestPolicy] warning",
+        u"[requestpolicy] Error: lower-case marker",
+        u"chrome://RPcontinued/ Error: upper-case marker",
+        u"EXCEPT\u0130ON in chrome://rpcontinued/content/main.js",
+        u"Error in chrome://rpcontinued/content/lib/third-party/x.js",
+        u" [RequestPolicy] Warning: not at the beginning",
+        u"[RequestPolicy] Warning: whitelisted",
+        (u"JavaScript strict warning: "
+         u"chrome://rpcontinued/content/lib/ruleset.js, line 1: "
+         u"ReferenceError: reference to undefined property entryPart.s"),
+        (u"JavaScript strict warning: "
+         u"chrome://rpcontinued/content/lib/ruleset.js, line x: "
+         u"ReferenceError: reference to undefined property entryPart.s"),
+        (u"[JavaScript Warning: \"Expected end of value but found "
+         u"\u201910\u201A.  Error in parsing value for "
+         u"\u2019font-family\u201A.  Declaration dropped.\" "
+         u"{file: \"chrome://rpcontinued/skin/foo.css\""),
+    ]
+
+    def test_compiled_classifier_equals_reference(self):
+        for line in self.edge_case_lines + list(generate_lines(20000)):
+            self.assertEqual(is_rp_exception(line),
+                             reference_is_rp_exception(line),
+                             msg=u"Classification differs: " + line)
+
+
+class TestErrorFingerprints(RequestPolicyTestCase):
+
+    def setUp(self):
+        super(TestErrorFingerprints, self).setUp()
+        (fd, self.db_path) = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.db = ErrorFingerprintDatabase(self.db_path)
+
+    def tearDown(self):
+        try:
+            self.db.close()
+            os.remove(self.db_path)
+        finally:
+            super(TestErrorFingerprints, self).tearDown()
+
+    def test_normalization(self):
+        self.assertEqual(
+            normalize_error_line(
+                u"JavaScript error: chrome://rpcontinued/content/main.js, "
+                u"line 12: Error #345 at http://www.maindomain.test/?a=1"),
+            u"JavaScript error: chrome://rpcontinued/content/main.js, "
+            u"line <n>: Error #<n> at <uri>")
+        self.assertEqual(
+            get_fingerprint(u"[RequestPolicy] Error: foo.js:1:2 0x1f"),
+            get_fingerprint(u"[RequestPolicy] Error: foo.js:30:4 0xab"))
+        self.assertNotEqual(
+            get_fingerprint(u"[RequestPolicy] Error: foo"),
+            get_fingerprint(u"[RequestPolicy] Error: bar"))
+
+    def test_runs(self):
+        run_1 = self.db.add_run("run 1", [
+            ("test_a", u"[RequestPolicy] Error: foo #1"),
+            ("test_a", u"[RequestPolicy] Error: foo #2"),
+            (None, u"[RequestPolicy] Error: bar")])
+        run_2 = self.db.add_run("run 2", [
+            ("test_b", u"[RequestPolicy] Error: foo #3"),
+            ("test_b", u"[RequestPolicy] Error: baz")])
+
+        self.assertFalse(self.db.is_new(u"[RequestPolicy] Error: foo #4"))
+        self.assertTrue(self.db.is_new(u"[RequestPolicy] Error: qux"))
+        self.assertTrue(
+            self.db.is_new(u"[RequestPolicy] Error: baz", run_id=run_2))
+        self.assertFalse(
+            self.db.is_new(u"[RequestPolicy] Error: bar", run_id=run_2))
+        self.assertEqual(
+            [example for (_, example) in self.db.get_new_fingerprints(run_2)],
+            [u"[RequestPolicy] Error: baz"])
+
+        top = self.db.get_top_recurring()
+        self.assertEqual(top[0][1:], (u"[RequestPolicy] Error: foo #1", 2, 3))
+        self.assertEqual(len(top), 3)
+        self.assertEqual(len(self.db.get_top_recurring(last_n_runs=1)), 2)
+        self.assertNotEqual(run_1, run_2)
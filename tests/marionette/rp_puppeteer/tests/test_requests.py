@@ -3,7 +3,12 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from rp_ui_harness import RequestPolicyTestCase
-from rp_puppeteer.api.requests import Requests
+from marionette_driver.errors import TimeoutException
+from rp_puppeteer.api.requests import (COMPACT_STRING_SLACK, Requests,
+                                       iter_recorded_requests)
+import os
+import shutil
+import tempfile
 
 
 PREF_DEFAULT_ALLOW = "extensions.requestpolicy.defaultPolicy.allow"
@@ -216,3 +221,394 @@ class TestGettingRequests(RequestPolicyTestCase):
         self.assertEqual(len(requests), 0,
                          ("All requests should have been filtered out, so "
                           "`requests` should be empty: {}".format(requests)))
+
+
+class TestIncrementalGetting(RequestPolicyTestCase):
+    """Class for testing `count`, `since()`, `tail()` and cursors."""
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+        self.requests.start_listening()
+
+    def tearDown(self):
+        try:
+            self.requests.stop_listening()
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def _navigate(self):
+        with self.marionette.using_context("content"):
+            self.marionette.navigate("http://www.maindomain.test/img_1.html")
+
+    def test_count_since_tail(self):
+        self.assertEqual(self.requests.count, 0)
+        self._navigate()
+        all_requests = self.requests.all
+        self.assertEqual(self.requests.count, len(all_requests))
+        self.assertEqual(self.requests.since(0), all_requests)
+        self.assertEqual(self.requests.since(1), all_requests[1:])
+        self.assertEqual(self.requests.since(len(all_requests)), [])
+        self.assertEqual(self.requests.tail(2), all_requests[-2:])
+        self.assertEqual(self.requests.tail(0), [])
+
+    def test_indices_survive_clear(self):
+        self._navigate()
+        count = self.requests.count
+        self.requests.clear()
+        self.assertEqual(self.requests.count, count)
+        self.assertEqual(self.requests.since(0), [])
+
+        self._navigate()
+        self.assertEqual(self.requests.since(count), self.requests.all)
+
+    def test_cursor(self):
+        cursor = self.requests.cursor()
+        self.assertEqual(cursor.read(), [])
+        self._navigate()
+        first_read = cursor.read()
+        self.assertNotEqual(first_read, [])
+        self.assertEqual(first_read, self.requests.all)
+        self.assertEqual(cursor.read(), [])
+        self.assertEqual(cursor.index, self.requests.count)
+
+
+class TestQueries(RequestPolicyTestCase):
+    """Class for testing the queries evaluated inside the sandbox."""
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+
+        self.prefs.set_pref(PREF_DEFAULT_ALLOW, False)
+        self.requests.start_listening()
+        with self.marionette.using_context("content"):
+            self.marionette.navigate("http://www.maindomain.test/img_1.html")
+        self.all_requests = self.requests.all
+
+    def tearDown(self):
+        try:
+            self.prefs.reset_pref(PREF_DEFAULT_ALLOW)
+            self.requests.stop_listening()
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def _filter(self, fn):
+        return [r for r in self.all_requests if fn(r)]
+
+    def test_find(self):
+        self.assertEqual(self.requests.find(), self.all_requests)
+        self.assertEqual(
+            self.requests.find(is_allowed=False),
+            self._filter(lambda r: not r["isAllowed"]))
+        self.assertEqual(
+            self.requests.find(
+                origin="http://www.maindomain.test/img_1.html",
+                dest_base_domain="otherdomain.test"),
+            self._filter(
+                lambda r: (r["origin"] ==
+                           "http://www.maindomain.test/img_1.html" and
+                           r["dest"].startswith("http://www.otherdomain."))))
+        self.assertEqual(self.requests.find(since=1), self.all_requests[1:])
+        self.assertRaises(TypeError, self.requests.find, foo="bar")
+
+    def test_aggregations(self):
+        self.assertEqual(self.requests.count_matching(),
+                         len(self.all_requests))
+        n_blocked = len(self._filter(lambda r: not r["isAllowed"]))
+        self.assertGreater(n_blocked, 0)
+        self.assertEqual(self.requests.allowed_blocked_totals(), {
+            "allowed": len(self.all_requests) - n_blocked,
+            "blocked": n_blocked,
+        })
+        counts = self.requests.count_by_dest_base_domain()
+        self.assertEqual(sum(counts.values()), len(self.all_requests))
+        self.assertGreater(counts["maindomain.test"], 0)
+        self.assertEqual(counts["otherdomain.test"], n_blocked)
+        self.assertEqual(
+            sorted(self.requests.distinct_origins()),
+            sorted(set(r["origin"] for r in self.all_requests)))
+
+
+class TestWaitingForRequests(RequestPolicyTestCase):
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+        self.requests.start_listening()
+
+    def tearDown(self):
+        try:
+            self.requests.stop_listening()
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def test_wait_for_new_request(self):
+        count = self.requests.count
+        with self.marionette.using_context("content"):
+            self.marionette.execute_script("""
+              window.setTimeout(function() {
+                window.location.href = "http://www.maindomain.test/";
+              }, 200);
+            """)
+        request = self.requests.wait_for(
+            dest="http://www.maindomain.test/", since=count, timeout=10)
+        self.assertEqual(request["dest"], "http://www.maindomain.test/")
+
+    def test_wait_for_observed_request(self):
+        with self.marionette.using_context("content"):
+            self.marionette.navigate("http://www.maindomain.test/")
+        request = self.requests.wait_for(dest_base_domain="maindomain.test",
+                                         timeout=1)
+        self.assertEqual(request, self.requests.find(
+            dest_base_domain="maindomain.test")[0])
+
+    def test_timeout(self):
+        self.assertRaises(TimeoutException, self.requests.wait_for,
+                          dest="http://www.nonexistent.test/", timeout=0.1)
+
+
+class TestCompactCapture(RequestPolicyTestCase):
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+        self.compact_requests = Requests(lambda: self.marionette,
+                                         sandbox="test_requests_compact")
+        self.compact_requests.start_listening(compact=True)
+        self.requests.start_listening()
+
+    def tearDown(self):
+        try:
+            self.requests.stop_listening()
+            self.compact_requests.cleanup_sandbox()
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def _navigate(self, url):
+        with self.marionette.using_context("content"):
+            self.marionette.navigate(url)
+
+    def test_same_requests(self):
+        self._navigate("http://www.maindomain.test/img_1.html")
+        self.assertEqual(self.compact_requests.all, self.requests.all)
+        self.assertEqual(self.compact_requests.tail(1),
+                         self.requests.tail(1))
+        self.assertEqual(
+            self.compact_requests.find(is_allowed=True),
+            self.requests.find(is_allowed=True))
+
+    def test_strings_transferred_once(self):
+        cursor = self.compact_requests.cursor()
+        self._navigate("http://www.maindomain.test/img_1.html")
+        first_read = cursor.read()
+        strings = list(self.compact_requests._decoder.strings)
+        self.assertNotEqual(strings, [])
+
+        self._navigate("http://www.maindomain.test/img_1.html")
+        second_read = cursor.read()
+        self.assertEqual(second_read[0], first_read[0])
+        self.assertEqual(self.compact_requests._decoder.strings[:len(strings)],
+                         strings)
+
+    def test_switch_form(self):
+        self._navigate("http://www.maindomain.test/")
+        count = self.compact_requests.count
+        self.compact_requests.start_listening(compact=False)
+        self.assertEqual(self.compact_requests.count, count)
+        self.assertEqual(self.compact_requests.all, [])
+
+
+class TestRingBuffer(RequestPolicyTestCase):
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+        self.requests.start_listening()
+        self.bounded_requests = Requests(lambda: self.marionette,
+                                         sandbox="test_requests_bounded")
+
+    def tearDown(self):
+        try:
+            self.requests.stop_listening()
+            self.bounded_requests.cleanup_sandbox()
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def _navigate(self, url):
+        with self.marionette.using_context("content"):
+            self.marionette.navigate(url)
+
+    def _test_capacity(self, compact):
+        self.bounded_requests.start_listening(compact=compact, capacity=2)
+        self._navigate("http://www.maindomain.test/img_1.html")
+        self._navigate("http://www.maindomain.test/img_1.html")
+        all_requests = self.requests.all
+        self.assertGreater(len(all_requests), 2)
+
+        self.assertEqual(self.bounded_requests.all, all_requests[-2:])
+        self.assertEqual(self.bounded_requests.count, len(all_requests))
+        self.assertEqual(self.bounded_requests.stats, {
+            "observed": len(all_requests),
+            "stored": 2,
+            "skipped": 0,
+            "dropped": len(all_requests) - 2,
+            "capacity": 2,
+        })
+
+    def test_capacity(self):
+        self._test_capacity(compact=False)
+
+    def test_capacity_compact(self):
+        self._test_capacity(compact=True)
+
+    def test_compact_strings_bounded(self):
+        capacity = 10
+        self.bounded_requests.start_listening(compact=True,
+                                              capacity=capacity)
+        cursor = self.bounded_requests.cursor()
+        n_requests = 0
+        for _ in range(5):
+            self.marionette.execute_script("""
+              const [start, n] = arguments;
+              for (let i = start; i < start + n; ++i) {
+                this.requestObserver.pushRequest({
+                  isAllowed: true,
+                  originUri: "http://origin" + i + ".test/",
+                  destUri: "http://dest" + i + ".test/",
+                });
+              }
+            """, script_args=[n_requests, 1000],
+                sandbox=self.bounded_requests.sandbox, new_sandbox=False)
+            n_requests += 1000
+            cursor.read()
+
+        max_strings = 4 * capacity + COMPACT_STRING_SLACK + 2
+        self.assertLessEqual(len(self.bounded_requests._decoder.strings),
+                             max_strings)
+        self.assertLessEqual(self.marionette.execute_script(
+            "return this.requestObserver.storage.strings.length;",
+            sandbox=self.bounded_requests.sandbox, new_sandbox=False),
+            max_strings)
+        self.assertEqual(self.bounded_requests.all, [
+            {"origin": "http://origin{}.test/".format(i),
+             "dest": "http://dest{}.test/".format(i),
+             "isAllowed": True}
+            for i in range(n_requests - capacity, n_requests)])
+
+    def test_cursor_counts_missed_requests(self):
+        self.bounded_requests.start_listening(capacity=1)
+        cursor = self.bounded_requests.cursor()
+        self._navigate("http://www.maindomain.test/img_1.html")
+        all_requests = self.requests.all
+        self.assertEqual(cursor.read(), all_requests[-1:])
+        self.assertEqual(cursor.n_missed, len(all_requests) - 1)
+
+    def test_only_blocked(self):
+        self.bounded_requests.start_listening(only_blocked=True)
+        self._navigate("http://www.maindomain.test/img_1.html")
+        self.assertEqual(self.bounded_requests.all,
+                         self.requests.find(is_allowed=False))
+        stats = self.bounded_requests.stats
+        self.assertEqual(stats["skipped"],
+                         self.requests.count_matching(is_allowed=True))
+
+    def test_sample_every(self):
+        self.bounded_requests.start_listening(sample_every=2)
+        self._navigate("http://www.maindomain.test/img_1.html")
+        self._navigate("http://www.maindomain.test/img_1.html")
+        self.assertEqual(self.bounded_requests.all, self.requests.all[::2])
+
+    def test_invalid_capacity(self):
+        for capacity in [0, -1]:
+            self.assertRaises(ValueError,
+                              self.bounded_requests.start_listening,
+                              capacity=capacity)
+        self.assertFalse(self.bounded_requests.listening)
+
+    def test_invalid_sample_every(self):
+        for sample_every in [0, -1]:
+            self.assertRaises(ValueError,
+                              self.bounded_requests.start_listening,
+                              sample_every=sample_every)
+        self.assertFalse(self.bounded_requests.listening)
+
+
+class TestRecording(RequestPolicyTestCase):
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+        self.requests.start_listening()
+        self.recording_requests = Requests(lambda: self.marionette,
+                                           sandbox="test_requests_recording")
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        try:
+            self.requests.stop_listening()
+            self.recording_requests.cleanup_sandbox()
+            shutil.rmtree(self.directory)
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def _record(self, filename):
+        path = os.path.join(self.directory, filename)
+        with self.recording_requests.record(path, batch_size=2):
+            self.assertTrue(self.recording_requests.recording)
+            with self.marionette.using_context("content"):
+                self.marionette.navigate(
+                    "http://www.maindomain.test/img_1.html")
+        self.assertFalse(self.recording_requests.recording)
+        recorded = list(iter_recorded_requests(path))
+        self.assertEqual([r["index"] for r in recorded],
+                         range(len(recorded)))
+        for request in recorded:
+            del request["index"]
+            del request["time"]
+        self.assertEqual(recorded, self.requests.all)
+
+    def test_record(self):
+        self._record("requests.ndjson")
+
+    def test_record_compressed(self):
+        self._record("requests.ndjson.gz")
+        self.assertEqual(os.listdir(self.directory), ["requests.ndjson.gz"])
+
+    def test_stats(self):
+        path = os.path.join(self.directory, "requests.ndjson")
+        self.recording_requests.start_recording(path)
+        with self.marionette.using_context("content"):
+            self.marionette.navigate("http://www.maindomain.test/")
+        self.assertEqual(self.recording_requests.recording_stats["observed"],
+                         self.requests.count)
+        stats = self.recording_requests.stop_recording()
+        self.assertEqual(stats["written"], self.requests.count)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertIsNone(self.recording_requests.recording_stats)
+
+
+class TestLatencyStats(RequestPolicyTestCase):
+
+    def setUp(self):
+        RequestPolicyTestCase.setUp(self)
+        self.requests.start_listening()
+
+    def tearDown(self):
+        try:
+            self.requests.stop_listening()
+        finally:
+            RequestPolicyTestCase.tearDown(self)
+
+    def test_latency_stats(self):
+        with self.marionette.using_context("content"):
+            self.marionette.navigate("http://www.maindomain.test/img_1.html")
+        latencies = self.requests.latency_stats(percentiles=(50, 99))
+        self.assertEqual(sorted(latencies.keys()),
+                         ["bookkeeping", "decision", "total"])
+        self.assertEqual(latencies["bookkeeping"]["count"],
+                         self.requests.count)
+        for stats in latencies.values():
+            self.assertLessEqual(stats["min"], stats["percentiles"][50])
+            self.assertLessEqual(stats["percentiles"][50],
+                                 stats["percentiles"][99])
+            self.assertLessEqual(stats["percentiles"][99], stats["max"])
+            self.assertEqual(sum(count for (_, _, count)
+                                 in stats["histogram"]), stats["count"])
+
+        self.requests.clear()
+        self.assertEqual(self.requests.latency_stats(), {})
@@ -3,8 +3,19 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from rp_ui_harness import RequestPolicyTestCase
-from rp_puppeteer.api.rules import Rule, RulesFile
+from rp_puppeteer.api.rules import (InvalidRulesFileException, Rule,
+                                    RulesFile, get_canonical_rule_string)
+from rp_utils.ruleset_matcher import (DEFAULT_POLICY,
+                                      DEFAULT_POLICY_INCONSISTENT_RULES,
+                                      IDENTICAL_IDENTIFIER, USER_POLICY,
+                                      Decision, Policy, Ruleset,
+                                      match_to_raw_rule)
+from rp_utils.ruleset_testing import write_ruleset
 from marionette import SkipTest
+import json
+import os
+import random
+import tempfile
 
 
 class RulesTestCase(RequestPolicyTestCase):
@@ -170,6 +181,38 @@ class TestRules(RulesTestCase):
         self.rules.remove_all()
         self.assertEqual(self.rules.count_rules(), 0)
 
+    def test_add_many(self):
+        self.rules.add_many(self.rules_1248)
+        self.assertEqual(sorted(self.rules.all), sorted(self.rules_1248))
+
+    def test_add_many_equals_adding_one_by_one(self):
+        rules = self.rules_4combinations_same_rule_data
+        for rule in rules:
+            rule.add()
+        rules_added_one_by_one = sorted(self.rules.all)
+        self.rules.remove_all()
+        self.rules.add_many(rules)
+        self.assertEqual(sorted(self.rules.all), rules_added_one_by_one)
+
+    def test_add_many_and_store(self):
+        self.rules_file.remove()
+        self.rules.add_many(self.rules_1248, store=True)
+        expected_rules = [rule for rule in self.rules_1248 if not rule.temp]
+        self.assertEqual(sorted(self.rules_file.get_rules()),
+                         sorted(expected_rules))
+
+    def test_remove_many(self):
+        rules = self.rules_4combinations_different_rule_data
+        self.rules.add_many(rules)
+        self.rules.remove_many(rules[:2])
+        self.assertEqual(sorted(self.rules.all), sorted(rules[2:]))
+
+    def test_replace_all(self):
+        self.rules.add_many(self.rules_1248)
+        self.rules.replace_all(self.rules_4combinations_same_rule_data)
+        self.assertEqual(sorted(self.rules.all),
+                         sorted(self.rules_4combinations_same_rule_data))
+
     def test_save(self):
         self.rules_file.remove()
         self.assertIsNone(self.rules_file.get_rules())
@@ -178,6 +221,101 @@ class TestRules(RulesTestCase):
         self.assertListEqual(self.rules_file.get_rules(), [])
 
 
+class TestSnapshot(RulesTestCase):
+
+    def test_restore_rules(self):
+        self.rules.add_many(self.rules_4combinations_different_rule_data)
+        snapshot = self.rules.snapshot()
+
+        self.rules.remove_many(
+            self.rules_4combinations_different_rule_data[:1])
+        self.rules.add_many(self.rules_4combinations_same_rule_data[1:2])
+        diff = self.rules.restore(snapshot)
+
+        self.assertEqual(diff.added_rules,
+                         self.rules_4combinations_same_rule_data[1:2])
+        self.assertEqual(diff.removed_rules,
+                         self.rules_4combinations_different_rule_data[:1])
+        self.assertEqual(sorted(self.rules.all),
+                         sorted(self.rules_4combinations_different_rule_data))
+
+    def test_restore_unchanged(self):
+        snapshot = self.rules.snapshot()
+        diff = self.rules.restore(snapshot)
+        self.assertFalse(diff)
+        self.assertEqual(self.rules.count_rules(), 0)
+
+    def test_restore_request_memory(self):
+        snapshot = self.rules.snapshot()
+        with self.marionette.using_context("content"):
+            self.marionette.navigate("http://www.maindomain.test/img_1.html")
+        diff = self.rules.restore(snapshot)
+        self.assertIn("http://www.maindomain.test/img_1.html",
+                      diff.added_request_memory_origins)
+        self.assertFalse(self.rules.restore(snapshot))
+
+
+class TestRuleHits(RulesTestCase):
+
+    def setUp(self):
+        super(TestRuleHits, self).setUp()
+
+        cr = self.rules.create_rule
+        self.origin_rule = cr({"o": {"h": "a.test"}}, allow=True, temp=False)
+        self.dest_rule = cr({"d": {"h": "b.test"}}, allow=False, temp=True)
+        self.unmatched_rule = cr({"o": {"h": "c.test"}}, allow=True,
+                                 temp=False)
+        self.rules.add_many([self.origin_rule, self.dest_rule,
+                             self.unmatched_rule])
+        self.pairs = [("http://a.test/", "http://b.test/"),
+                      ("http://www.a.test/", "http://x.test/")]
+
+    def tearDown(self):
+        try:
+            self.rules.stop_counting_hits()
+        finally:
+            super(TestRuleHits, self).tearDown()
+
+    def test_get_hits(self):
+        self.rules.start_counting_hits()
+        self.rules.check_requests(self.pairs)
+        hits = self.rules.get_hits()
+        self.assertEqual(hits.hits, [(self.origin_rule, 2),
+                                     (self.dest_rule, 1)])
+        self.assertEqual(hits.unmatched, [self.unmatched_rule])
+
+    def test_not_counting_by_default(self):
+        self.rules.check_requests(self.pairs)
+        hits = self.rules.get_hits()
+        self.assertEqual(hits.hits, [])
+        self.assertEqual(len(hits.unmatched), 3)
+
+    def test_stop_counting(self):
+        self.rules.start_counting_hits()
+        self.rules.check_requests(self.pairs)
+        self.rules.stop_counting_hits()
+        self.rules.check_requests(self.pairs)
+        self.assertEqual(self.rules.get_hits().hits, [])
+
+    def test_save(self):
+        self.rules.start_counting_hits()
+        self.rules.check_requests(self.pairs[:1])
+        (fd, path) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            self.rules.get_hits().save(path)
+            with open(path) as f:
+                data = json.load(f)
+        finally:
+            os.remove(path)
+        self.assertEqual([(rule["rule_data"], rule["hits"])
+                          for rule in data["hits"]],
+                         [({"d": {"h": "b.test"}}, 1),
+                          ({"o": {"h": "a.test"}}, 1)])
+        self.assertEqual([rule["rule_data"] for rule in data["unmatched"]],
+                         [{"o": {"h": "c.test"}}])
+
+
 class TestRulesFile(RulesTestCase):
 
     def setUp(self):
@@ -210,6 +348,190 @@ class TestRulesFile(RulesTestCase):
         # remove() should not raise an exception.
         self.nonexistant_file.remove()
 
+    def test_count_rules(self):
+        self.assertEqual(self.nonexistant_file.count_rules(), 0)
+        self.baserule.add(store=True)
+        self.assertEqual(self.rules_file.count_rules(), 1)
+        self.baserule.remove(store=True)
+        self.assertEqual(self.rules_file.count_rules(), 0)
+
+    def test_changes_are_noticed(self):
+        self.baserule.add(store=True)
+        self.assertListEqual(self.rules_file.get_rules(), [self.baserule])
+        self.baserule.remove(store=True)
+        self.assertListEqual(self.rules_file.get_rules(), [])
+
+    def test_invalid_file(self):
+        (fd, path) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        rules_file = RulesFile(lambda: self.marionette, path)
+        try:
+            for content in ["{", "[]", '{"entries": {}}',
+                            '{"metadata": {"version": 2}, "entries": {}}',
+                            '{"metadata": {"version": 1}}',
+                            ('{"metadata": {"version": 1}, '
+                             '"entries": {"allow": {}}}')]:
+                with open(path, "w") as f:
+                    f.write(content)
+                with self.assertRaises(InvalidRulesFileException):
+                    rules_file.get_rules()
+        finally:
+            rules_file.remove()
+
+    def test_rules_do_not_share_data_with_the_cache(self):
+        (fd, path) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        rules_file = RulesFile(lambda: self.marionette, path)
+        try:
+            with open(path, "w") as f:
+                json.dump({"metadata": {"version": 1},
+                           "entries": {"allow": [{"o": {"h": "a.test"}}]}},
+                          f)
+            (rule,) = rules_file.get_rules()
+            rule.rule_data["o"]["h"] = "b.test"
+            (diff_rule,) = rules_file.diff([]).only_in_file
+            diff_rule.rule_data["o"]["h"] = "c.test"
+            self.assertEqual(rules_file.get_rules()[0].rule_data,
+                             {"o": {"h": "a.test"}})
+        finally:
+            rules_file.remove()
+
+    def test_diff(self):
+        temp_rule = self.baserule_variants["different_temp"]
+        other_rule = self.baserule_variants["different_rule_data"]
+        self.assertFalse(self.nonexistant_file.diff([temp_rule]))
+
+        self.baserule.add(store=True)
+        self.assertFalse(self.rules_file.diff(self.rules.get_rules()))
+        self.assertFalse(self.rules_file.diff(self.rules_file))
+        diff = self.rules_file.diff([other_rule, temp_rule])
+        self.assertListEqual(diff.only_in_file, [self.baserule])
+        self.assertListEqual(diff.only_in_other, [other_rule])
+        diff = self.nonexistant_file.diff(self.rules_file)
+        self.assertListEqual(diff.only_in_other, [self.baserule])
+
+        self.baserule.remove(store=True)
+
+    def test_install_and_reload(self):
+        (fd, path) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            write_ruleset(path, 200, seed=1)
+            self.rules_file.install(path)
+            self.rules.reload()
+            self.assertEqual(self.rules.count_rules(temp=False), 200)
+            self.assertListEqual(sorted(self.rules.get_rules(temp=False)),
+                                 sorted(self.rules_file.get_rules()))
+        finally:
+            os.remove(path)
+            self.rules_file.remove()
+            self.rules.reload()
+
+
+class TestRulesetMatcher(RulesTestCase):
+    """Compare the pure-Python ruleset matcher to the browser."""
+
+    HOSTS = [None, "example.com", "www.example.com", "example.org", "*",
+             "*.example.com", "*.com", "com", "127.0.0.1", "::1"]
+    SCHEMES = [None, "http", "https", "*"]
+    PORTS = [None, 80, 8080, "*"]
+    URIS = ["http://example.com/", "https://www.example.com/path",
+            "http://a.b.example.com:8080/", "https://example.org:443/",
+            "http://www.EXAMPLE.org/", "ftp://example.com/",
+            "http://127.0.0.1/", "http://[::1]:8080/", "about:blank",
+            "data:text/plain,x", "file:///tmp/x"]
+
+    def _create_random_rules(self, n_rules, temp, seed):
+        rand = random.Random(seed)
+
+        def create_endpoint_spec():
+            spec = {}
+            for (key, choices) in [("h", self.HOSTS), ("s", self.SCHEMES),
+                                   ("port", self.PORTS)]:
+                value = rand.choice(choices)
+                if value is not None:
+                    spec[key] = value
+            return spec
+
+        rules = []
+        for _ in range(n_rules):
+            rule_data = {}
+            kind = rand.choice(["o", "d", "od"])
+            if "o" in kind:
+                rule_data["o"] = create_endpoint_spec()
+            if "d" in kind:
+                rule_data["d"] = create_endpoint_spec()
+            rules.append(self.rules.create_rule(
+                rule_data, allow=rand.random() < 0.5,
+                temp=temp and rand.random() < 0.5))
+        return rules
+
+    def _get_rule_strings(self, result):
+        return dict(
+            (action, sorted(get_canonical_rule_string(match_to_raw_rule(m))
+                            for (_, m) in matches))
+            for (action, matches) in [("allow", result.matched_allow_rules),
+                                      ("deny", result.matched_deny_rules)])
+
+    def _assert_same_matches(self, policy, check_subscriptions):
+        pairs = [(origin, dest) for origin in self.URIS for dest in self.URIS]
+        results = self.rules.check_requests(pairs)
+        for ((origin, dest), result) in zip(pairs, results):
+            expected = self._get_rule_strings(
+                policy.check_user_rules(origin, dest))
+            self.assertEqual(
+                dict((key, sorted(value))
+                     for (key, value) in result["user"].items()),
+                expected, "{} -> {}".format(origin, dest))
+            if check_subscriptions:
+                expected = self._get_rule_strings(
+                    policy.check_subscription_rules(origin, dest))
+                self.assertEqual(
+                    dict((key, sorted(value))
+                         for (key, value) in result["subscriptions"].items()),
+                    expected, "{} -> {}".format(origin, dest))
+
+    def test_user_and_temp_rules(self):
+        self.rules.add_many(self._create_random_rules(80, True, seed=1))
+        rulesets = {True: Ruleset(name="temp"), False: Ruleset(name="user")}
+        for rule in self.rules.get_rules():
+            rulesets[rule.temp].add_rule(rule.rule_data, rule.allow)
+        self._assert_same_matches(Policy(rulesets.values()),
+                                  check_subscriptions=False)
+
+    def test_policy_files(self):
+        self.rules.add_many(self._create_random_rules(80, False, seed=2),
+                            store=True)
+        policies_path = os.path.dirname(self.rules_file.file_path)
+        policy = Policy.from_directory(os.path.dirname(policies_path))
+        self._assert_same_matches(policy, check_subscriptions=True)
+
+    def test_decide(self):
+        ruleset = Ruleset.from_raw({
+            "metadata": {"version": 1},
+            "entries": {
+                "allow": [{"o": {"h": "a.test"}, "d": {"h": "b.test"}},
+                          {"d": {"h": "c.test"}}],
+                "deny": [{"d": {"h": "*.test"}}],
+            }
+        })
+        policy = Policy([ruleset])
+        for (origin, dest, expected) in [
+                ("http://a.test/", "http://b.test/",
+                 Decision(True, USER_POLICY)),
+                ("http://a.test/", "http://d.test/",
+                 Decision(False, USER_POLICY)),
+                ("http://a.test/", "http://c.test/",
+                 Decision(None, DEFAULT_POLICY_INCONSISTENT_RULES)),
+                ("http://a.test/", "http://a.test:80/x",
+                 Decision(True, IDENTICAL_IDENTIFIER)),
+                ("http://a.test/", "http://example.com/",
+                 Decision(None, DEFAULT_POLICY))]:
+            self.assertEqual(policy.decide(origin, dest), expected)
+        self.assertEqual(
+            list(policy.decide_many([("http://a.test/", "http://b.test/")])),
+            [Decision(True, USER_POLICY)])
+
 
 class TestRule(RulesTestCase):
 
@@ -219,6 +541,27 @@ class TestRule(RulesTestCase):
                                 allow=False, temp=False)
         self.assertEqual(string_port_rule.origin_port, 80)
 
+    def test_hash(self):
+        rules = set(self.rules_1248 + self.rules_1248)
+        self.assertEqual(len(rules), len(self.rules_1248))
+        baserule_copy = self.rules.create_rule(
+            {"o": {"h": "a"}}, allow=False, temp=False)
+        self.assertIn(baserule_copy, rules)
+        for rule in self.baserule_variants.values():
+            self.assertNotEqual(hash(self.baserule), hash(rule))
+
+    def test_canonical_string(self):
+        rule = self.shp_shp_rule
+        self.assertEqual(
+            rule.key.canonical_string,
+            self.marionette.execute_script("""
+              var {Ruleset} = Components.utils.
+                  import("chrome://rpcontinued/content/bootstrap.jsm", {}).
+                  FakeWebExt.api.backgroundApi.extension.getBackgroundPage().
+                  rp.policy.getUserRulesets().user.ruleset.constructor;
+              return Ruleset.rawRuleToCanonicalString(arguments[0]);
+            """, script_args=[rule.rule_data]))
+
     def test_eq_and_ne_rich_comparisons(self):
         # Test that `Rule` has both the __eq__ and the __ne__ method
         self.assertIn("__eq__", dir(Rule))
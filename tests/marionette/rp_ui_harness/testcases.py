@@ -4,6 +4,13 @@
 
 from firefox_ui_harness.testcases import FirefoxTestCase
 from rp_puppeteer import RequestPolicyPuppeteer
+from rp_puppeteer.api.rules import InvalidRulesFileException
+
+
+# A policy state without any user or temporary rules, in the format of
+# `Rules.snapshot()`.
+EMPTY_RULES_SNAPSHOT = {"rules": [], "subscriptions": [],
+                        "requestMemoryOrigins": []}
 
 
 class RequestPolicyTestCase(RequestPolicyPuppeteer, FirefoxTestCase):
@@ -21,8 +28,15 @@ class RequestPolicyTestCase(RequestPolicyPuppeteer, FirefoxTestCase):
     # Public Properties and Methods #
     #################################
 
+    def setUp(self, *args, **kwargs):
+        FirefoxTestCase.setUp(self, *args, **kwargs)
+        # Let a test fail as soon as it waits on the gecko log after an
+        # error has been logged, instead of on teardown.
+        self.gecko_log.start_failing_fast()
+
     def tearDown(self, *args, **kwargs):
         try:
+            self.gecko_log.stop_failing_fast()
             self._check_and_fix_leaked_rules()
             self._check_and_fix_leaked_rules_in_rules_file()
             self._check_and_fix_ignoring_errors()
@@ -35,18 +49,24 @@ class RequestPolicyTestCase(RequestPolicyPuppeteer, FirefoxTestCase):
     ##################################
 
     def _check_and_fix_leaked_rules(self):
-        try:
-            n_rules = self.rules.count_rules()
-            self.assertEqual(n_rules, 0,
-                             ("A test must not leak rules. Rule count is {}, "
-                              "but should be zero."
-                              ).format(n_rules))
-        finally:
-            self.rules.remove_all()
+        # Restoring a state without rules removes all rules in a single
+        # script call and returns them.
+        diff = self.rules.restore(EMPTY_RULES_SNAPSHOT, subscriptions=False,
+                                  request_memory=False)
+        leaked_rules = diff.added_rules + diff.removed_rules
+        n_rules = len(leaked_rules)
+        self.assertEqual(n_rules, 0,
+                         ("A test must not leak rules. Rule count is {}, "
+                          "but should be zero: {}"
+                          ).format(n_rules, leaked_rules))
 
     def _check_and_fix_leaked_rules_in_rules_file(self):
-        rules = self.rules_file.get_rules()
-        n_rules = 0 if rules is None else len(rules)
+        try:
+            n_rules = self.rules_file.count_rules()
+        except InvalidRulesFileException as e:
+            self.rules.save()
+            self.fail(("A test must not leak an invalid rules file. "
+                       "The file has been overwritten: {}").format(e))
         if n_rules != 0:
             self.rules.save()
             self.fail(("A test must not leak rules in the rules file. "
@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from mozlog import get_default_logger
+import os
+import tempfile
+
+from rp_ui_harness import RequestPolicyTestCase
+from rp_utils import ruleset_benchmark as B
+from rp_utils.gecko_log_benchmark import (compare_to_baseline,
+                                          load_baseline, save_baseline)
+
+
+class TestRulesetBenchmark(RequestPolicyTestCase):
+    """Benchmark large user rulesets, see `rp_utils.ruleset_benchmark`.
+
+    This test is not part of any manifest; it has to be run explicitly.
+    It is configured by environment variables:
+
+    * RP_RULESET_BENCHMARK_SIZES: comma-separated numbers of rules
+    * RP_RULESET_BENCHMARK_BASELINE: the baseline file
+    * RP_RULESET_BENCHMARK_SAVE_BASELINE: if set, the results are stored
+      as baseline instead of being compared to it. Otherwise the test
+      fails if there is no baseline.
+    """
+
+    def test_ruleset_benchmark(self):
+        sizes = os.environ.get("RP_RULESET_BENCHMARK_SIZES")
+        sizes = (B.DEFAULT_SIZES if not sizes else
+                 [int(n) for n in sizes.split(",")])
+        baseline = os.environ.get("RP_RULESET_BENCHMARK_BASELINE",
+                                  B.DEFAULT_BASELINE)
+        save = bool(os.environ.get("RP_RULESET_BENCHMARK_SAVE_BASELINE"))
+        if not save and not os.path.exists(baseline):
+            self.fail("No baseline at {}. Record one with "
+                      "RP_RULESET_BENCHMARK_SAVE_BASELINE=1.".format(baseline))
+        directory = os.path.join(tempfile.gettempdir(),
+                                 "rp-ruleset-benchmark")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        results = B.run_benchmarks(self.marionette, self.rules,
+                                   self.rules_file, directory, sizes=sizes,
+                                   log=self._log)
+
+        if save:
+            save_baseline(baseline, results)
+            self._log("baseline saved to {}".format(baseline))
+            return
+        regressions = compare_to_baseline(results, load_baseline(baseline))
+        self.assertEqual(regressions, [])
+
+    def _log(self, message):
+        get_default_logger().info(message)
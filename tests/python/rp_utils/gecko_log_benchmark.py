@@ -0,0 +1,358 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""A benchmark suite for the gecko log pipeline.
+
+The suite runs on synthetic logs, see `gecko_log_testing`, so no
+browser is needed. Each benchmark runs in a fresh worker process, so
+that its peak memory can be measured independently of the other
+benchmarks.
+
+Results are dicts mapping `"<benchmark>/<n_lines>"` to metrics:
+
+* `throughput`: lines per second (higher is better)
+* `latency`: seconds per call (lower is better)
+* `peak_memory`: bytes allocated at most (lower is better)
+
+Additionally, each result contains a `calibration` score, the speed
+of the worker process for pure Python code, measured right before the
+benchmark. Baselines are results stored as JSON. When comparing to a
+baseline of another machine, time metrics can be scaled by the ratio
+of the calibration scores. On the same machine scaling only adds
+noise, so it is off by default.
+"""
+
+import json
+import os
+import resource
+import shutil
+import time
+from multiprocessing import Pool
+
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "gecko_log_benchmark_baseline.json")
+DEFAULT_TOLERANCE = 0.25
+# Differences below these are considered noise.
+MEMORY_SLACK = 4 * 1024 * 1024
+LATENCY_SLACK = 0.0002
+# The number of lines which are appended per simulated test.
+LINES_PER_TEST = 500
+
+_HIGHER_IS_BETTER = {
+    "throughput": True,
+    "latency": False,
+    "peak_memory": False,
+    # Used by `ruleset_benchmark`.
+    "memory": False,
+}
+
+
+def _get_peak_memory():
+    # `ru_maxrss` is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _min_duration(fn, max_repetitions=100, max_total_duration=1.0):
+    """Call `fn` repeatedly and return the shortest duration."""
+
+    durations = []
+    total_start = time.time()
+    while (len(durations) < max_repetitions and
+           time.time() - total_start < max_total_duration):
+        start = time.time()
+        fn()
+        durations.append(time.time() - start)
+    return min(durations)
+
+
+def _append_test(path, lines):
+    with open(path, "ab") as f:
+        for line in lines:
+            f.write(line.encode("utf-8"))
+            f.write(b"\n")
+
+
+####################
+# Benchmark cases  #
+####################
+
+# Each case gets the path of a log with `n_lines` lines and returns
+# a dict of metrics, except `peak_memory`, which is measured around it.
+
+def _throughput(fn, n_lines):
+    return {"throughput": n_lines / _min_duration(fn,
+                                                  max_total_duration=2.0)}
+
+
+def bench_error_lines_streaming(path, n_lines):
+    """`get_gecko_log_error_lines()`, as used by check_gecko_log.py."""
+
+    from rp_utils.utils import get_gecko_log_error_lines
+    return _throughput(lambda: get_gecko_log_error_lines(path), n_lines)
+
+
+def bench_parser_index(path, n_lines):
+    """Building the in-memory index of a log."""
+
+    from rp_puppeteer.api.gecko_log_parser import GeckoLogIndex
+    # A new index each time, instead of the shared one.
+    return _throughput(lambda: GeckoLogIndex(path).update(), n_lines)
+
+
+def bench_ignore_helper(path, n_lines):
+    """`IgnoreHelper.update_and_check()` on every line."""
+
+    from rp_puppeteer.api.gecko_log_parser import (
+        GeckoLogParser, IgnoreHelper, IGNORE_ERRORS_END, IGNORE_ERRORS_START)
+    lines = GeckoLogParser(path).get_all_lines()
+
+    def check_lines():
+        helper = IgnoreHelper(IGNORE_ERRORS_START, IGNORE_ERRORS_END)
+        for line in lines:
+            helper.update_and_check(line)
+
+    return _throughput(check_lines, n_lines)
+
+
+def bench_classifier(path, n_lines):
+    """`is_rp_exception()` on every line."""
+
+    from rp_puppeteer.api.gecko_log_parser import (GeckoLogParser,
+                                                   is_rp_exception)
+    lines = GeckoLogParser(path).get_all_lines()
+
+    def classify_lines():
+        for line in lines:
+            is_rp_exception(line)
+
+    return _throughput(classify_lines, n_lines)
+
+
+def bench_error_lines(path, n_lines):
+    """`GeckoLogParser.get_all_error_lines()` on an up-to-date index."""
+
+    from rp_puppeteer.api.gecko_log_parser import GeckoLogParser
+    parser = GeckoLogParser(path)
+    parser.get_all_lines()
+    return _throughput(parser.get_all_error_lines, n_lines)
+
+
+def bench_records(path, n_lines):
+    """Parsing all lines into `GeckoLogRecords`."""
+
+    from rp_puppeteer.api.gecko_log_parser import GeckoLogIndex
+    from rp_puppeteer.api.gecko_log_records import GeckoLogRecords
+    index = GeckoLogIndex(path)
+    index.update()
+
+    def parse_records():
+        GeckoLogRecords(index.lines, index.test_starts).update()
+
+    return _throughput(parse_records, n_lines)
+
+
+def _make_method_case(method_name, **kwargs):
+    def bench(path, n_lines):
+        from rp_puppeteer.api.gecko_log_parser import GeckoLogParser
+        parser = GeckoLogParser(path)
+        parser.get_all_lines()
+        method = getattr(parser, method_name)
+        return {"latency": _min_duration(lambda: method(**kwargs))}
+    bench.__doc__ = "Latency of `GeckoLogParser.{}()`.".format(method_name)
+    return bench
+
+
+def bench_after_test(path, n_lines):
+    """The check done after each test: a new test's lines are appended
+    to the log, then the errors of the current test are looked up.
+    """
+
+    from rp_puppeteer.api.gecko_log_parser import GeckoLogParser
+    from rp_utils.gecko_log_testing import generate_lines
+    parser = GeckoLogParser(path)
+    parser.get_all_lines()
+    test_lines = list(generate_lines(LINES_PER_TEST + 1,
+                                     lines_per_test=LINES_PER_TEST,
+                                     seed=n_lines))[1:]
+
+    def run_test():
+        _append_test(path, test_lines)
+        parser.currently_ignoring_errors()
+        parser.get_error_lines_of_current_test()
+
+    return {"latency": _min_duration(run_test, max_repetitions=20)}
+
+
+CASES = [
+    ("error_lines_streaming", bench_error_lines_streaming),
+    ("parser_index", bench_parser_index),
+    ("ignore_helper", bench_ignore_helper),
+    ("classifier", bench_classifier),
+    ("error_lines", bench_error_lines),
+    ("records", bench_records),
+    ("get_all_lines", _make_method_case("get_all_lines")),
+    ("get_lines_of_current_test",
+     _make_method_case("get_lines_of_current_test")),
+    ("get_error_lines_of_current_test",
+     _make_method_case("get_error_lines_of_current_test")),
+    ("get_error_lines_before_first_test",
+     _make_method_case("get_error_lines_before_first_test")),
+    ("currently_ignoring_errors",
+     _make_method_case("currently_ignoring_errors")),
+    ("after_test", bench_after_test),
+]
+_CASES_BY_NAME = dict(CASES)
+
+
+##########
+# Runner #
+##########
+
+def get_log(directory, n_lines):
+    """Return the path of a synthetic log, generating it if needed."""
+
+    from rp_utils.gecko_log_testing import write_log
+    path = os.path.join(directory, "benchmark-{}.gecko.log".format(n_lines))
+    if not os.path.exists(path):
+        write_log(path + ".tmp", n_lines, lines_per_test=LINES_PER_TEST)
+        os.rename(path + ".tmp", path)
+    return path
+
+
+def _run_case(args):
+    (name, path, n_lines) = args
+    if name == "after_test":
+        # The case appends to the log, so it works on a copy.
+        copy = path + ".after_test"
+        shutil.copyfile(path, copy)
+        path = copy
+    calibration = calibrate()
+    memory_before = _get_peak_memory()
+    try:
+        metrics = _CASES_BY_NAME[name](path, n_lines)
+    finally:
+        if name == "after_test":
+            os.remove(path)
+    metrics["peak_memory"] = max(0, _get_peak_memory() - memory_before)
+    metrics["calibration"] = calibration
+    return metrics
+
+
+def calibrate():
+    """Return a score of the machine's speed for pure Python code."""
+
+    def workload():
+        total = 0
+        for i in xrange(20000):
+            total += len(u"line {}".format(i).split(u" "))
+        return total
+
+    return 0.1 / _min_duration(workload, max_repetitions=50,
+                               max_total_duration=5.0)
+
+
+def run_benchmarks(directory, sizes=DEFAULT_SIZES, names=None,
+                   log=None):
+    """Run the benchmark cases on logs of the given sizes.
+
+    :param directory: Where the synthetic logs are generated and kept.
+    :param names: The names of the cases to run. Defaults to all.
+    :param log: A function called with a progress message.
+    """
+
+    names = [name for (name, _) in CASES if names is None or name in names]
+    results = {}
+    # A new worker process for each case.
+    pool = Pool(1, maxtasksperchild=1)
+    try:
+        for n_lines in sizes:
+            path = get_log(directory, n_lines)
+            for name in names:
+                key = "{}/{}".format(name, n_lines)
+                results[key] = pool.apply(_run_case, ((name, path, n_lines),))
+                if log is not None:
+                    log(format_result(key, results[key]))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def format_result(key, metrics):
+    parts = []
+    if "throughput" in metrics:
+        parts.append("{:>10.0f} lines/s".format(metrics["throughput"]))
+    if "latency" in metrics:
+        parts.append("{:>10.3f} ms".format(metrics["latency"] * 1000))
+    parts.append("{:>8.1f} MB".format(metrics["peak_memory"] / 1024.0 ** 2))
+    return "{:<45} {}".format(key, "  ".join(parts))
+
+
+#############
+# Baselines #
+#############
+
+def save_baseline(path, results):
+    """Store results as baseline.
+
+    Results of an existing baseline which have not been measured again
+    are kept.
+    """
+
+    all_results = load_baseline(path) if os.path.exists(path) else {}
+    all_results.update(results)
+    with open(path, "w") as f:
+        json.dump(all_results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE,
+                        scale=False):
+    """Return a list of messages, one for each regression.
+
+    A metric regresses if it is worse than the baseline by more than
+    `tolerance`, a fraction of the baseline value.
+
+    :param scale: Whether to scale time metrics by the ratio of the
+        calibration scores.
+    """
+
+    regressions = []
+    for (key, metrics) in sorted(results.items()):
+        baseline_metrics = baseline.get(key)
+        if baseline_metrics is None:
+            continue
+        speed_ratio = 1.0
+        if scale:
+            speed_ratio = (metrics["calibration"] /
+                           baseline_metrics["calibration"])
+        for (metric, value) in sorted(metrics.items()):
+            if (metric not in _HIGHER_IS_BETTER or
+                    metric not in baseline_metrics):
+                continue
+            expected = baseline_metrics[metric]
+            if metric == "throughput":
+                expected *= speed_ratio
+            elif metric == "latency":
+                expected /= speed_ratio
+            if _HIGHER_IS_BETTER[metric]:
+                regressed = value < expected * (1 - tolerance)
+            else:
+                limit = expected * (1 + tolerance)
+                if metric in ("peak_memory", "memory"):
+                    limit += MEMORY_SLACK
+                elif metric == "latency":
+                    limit += LATENCY_SLACK
+                regressed = value > limit
+            if regressed:
+                regressions.append("{} {}: {:.6g} (expected {:.6g})".format(
+                    key, metric, value, expected))
+    return regressions
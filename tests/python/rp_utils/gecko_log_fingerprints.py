@@ -0,0 +1,160 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Fingerprint gecko log errors and record them across test runs.
+
+A fingerprint identifies an error independently of the details which
+change from run to run, such as line numbers, timestamps, numbers and
+URIs of web pages.
+"""
+
+import hashlib
+import re
+import sqlite3
+import time
+
+
+# (pattern, replacement) pairs, applied in this order.
+_NORMALIZATIONS = [
+    # moz-extension UUIDs
+    (re.compile(r"moz-extension://[0-9a-f-]+/"), u"moz-extension://<uuid>/"),
+    # URIs of web pages, but not of chrome:// or resource:// files.
+    (re.compile(r"\b(?:https?|ftp|file)://[^\s\"',)]*"), u"<uri>"),
+    # source line and column numbers
+    (re.compile(r"\bline:? \d+"), u"line <n>"),
+    (re.compile(r"(\.\w+):\d+(?::\d+)?"), u"\\1:<n>"),
+    # hex addresses
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), u"<hex>"),
+    # other numbers, including leading timestamps
+    (re.compile(r"\d+"), u"<n>"),
+]
+
+
+def normalize_error_line(line):
+    for (pattern, replacement) in _NORMALIZATIONS:
+        line = pattern.sub(replacement, line)
+    return line
+
+
+def get_fingerprint(line):
+    normalized = normalize_error_line(line)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+class ErrorFingerprintDatabase(object):
+    """A SQLite store of error fingerprints and their occurrences.
+
+    Each run, e.g. one check of a gecko log, is recorded with the
+    number of occurrences of each fingerprint per test.
+    """
+
+    SCHEMA = """
+      CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        created REAL NOT NULL
+      );
+      CREATE TABLE IF NOT EXISTS fingerprints (
+        fingerprint TEXT PRIMARY KEY,
+        normalized TEXT NOT NULL,
+        example TEXT NOT NULL,
+        first_run INTEGER NOT NULL REFERENCES runs(id)
+      );
+      CREATE TABLE IF NOT EXISTS occurrences (
+        run INTEGER NOT NULL REFERENCES runs(id),
+        fingerprint TEXT NOT NULL REFERENCES fingerprints(fingerprint),
+        test TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (run, fingerprint, test)
+      );
+      CREATE INDEX IF NOT EXISTS occurrences_by_fingerprint
+        ON occurrences (fingerprint, run);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def add_run(self, name, error_lines):
+        """Record a run.
+
+        :param name: A name for the run, e.g. the log file name.
+        :param error_lines: An iterable of `(test_name, line)` tuples.
+            The test name may be None.
+        :returns: The id of the run.
+        """
+
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO runs (name, created) VALUES (?, ?)",
+                (name, time.time()))
+            run_id = cursor.lastrowid
+            counts = {}
+            for (test_name, line) in error_lines:
+                fingerprint = get_fingerprint(line)
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO fingerprints "
+                    "(fingerprint, normalized, example, first_run) "
+                    "VALUES (?, ?, ?, ?)",
+                    (fingerprint, normalize_error_line(line), line, run_id))
+                key = (fingerprint, test_name or u"")
+                counts[key] = counts.get(key, 0) + 1
+            self._connection.executemany(
+                "INSERT INTO occurrences (run, fingerprint, test, count) "
+                "VALUES (?, ?, ?, ?)",
+                [(run_id, counted_fingerprint, test, count)
+                 for ((counted_fingerprint, test), count)
+                 in counts.items()])
+        return run_id
+
+    def add_gecko_log(self, path):
+        """Record the errors of a gecko log as a run named after it."""
+
+        from rp_utils.gecko_log_report import iter_error_lines_by_test
+        return self.add_run(path, iter_error_lines_by_test(path))
+
+    def is_new(self, line, run_id=None):
+        """Whether an error has not occurred before the given run.
+
+        Without `run_id`, check whether it has not been seen at all.
+        """
+
+        row = self._connection.execute(
+            "SELECT first_run FROM fingerprints WHERE fingerprint = ?",
+            (get_fingerprint(line),)).fetchone()
+        if row is None:
+            return True
+        return run_id is not None and row[0] >= run_id
+
+    def get_new_fingerprints(self, run_id):
+        """Return `(fingerprint, example)` of errors first seen in a run."""
+
+        return self._connection.execute(
+            "SELECT fingerprint, example FROM fingerprints "
+            "WHERE first_run = ? ORDER BY fingerprint",
+            (run_id,)).fetchall()
+
+    def get_top_recurring(self, last_n_runs=50, limit=20):
+        """Return the errors which occurred in most of the last runs.
+
+        :returns: A list of `(fingerprint, example, n_runs, n_occurrences)`
+            tuples, ordered by `n_runs` and `n_occurrences`.
+        """
+
+        return self._connection.execute(
+            "SELECT o.fingerprint, f.example, "
+            "       COUNT(DISTINCT o.run) AS n_runs, "
+            "       SUM(o.count) AS n_occurrences "
+            "FROM occurrences o "
+            "JOIN fingerprints f ON f.fingerprint = o.fingerprint "
+            "WHERE o.run IN "
+            "  (SELECT id FROM runs ORDER BY id DESC LIMIT ?) "
+            "GROUP BY o.fingerprint "
+            "ORDER BY n_runs DESC, n_occurrences DESC "
+            "LIMIT ?",
+            (last_n_runs, limit)).fetchall()
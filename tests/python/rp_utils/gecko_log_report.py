@@ -0,0 +1,111 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Analyze many gecko logs in parallel and merge the results."""
+
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+import os
+
+
+def find_gecko_logs(paths):
+    """Expand directories to the `*.gecko.log` files they contain.
+
+    Symlinks inside directories, such as `logs/latest.gecko.log`, are
+    skipped because they point to logs which are listed anyway.
+    """
+
+    gecko_logs = []
+    for path in paths:
+        if not os.path.isdir(path):
+            gecko_logs.append(path)
+            continue
+        for filename in sorted(os.listdir(path)):
+            file_path = os.path.join(path, filename)
+            if (filename.endswith(".gecko.log") and
+                    os.path.isfile(file_path) and
+                    not os.path.islink(file_path)):
+                gecko_logs.append(file_path)
+    return gecko_logs
+
+
+class ErrorSummary(object):
+    """Summarizes the error lines of one log, see `analyze_gecko_log()`.
+
+    :param max_errors: Ignore the errors after this many.
+    """
+
+    def __init__(self, path, max_errors=None):
+        self.path = path
+        self.max_errors = max_errors
+        self.n_errors = 0
+        self.first_error = None
+        self.tests = []
+
+    def add(self, test_name, line):
+        if self.max_errors is not None and self.n_errors >= self.max_errors:
+            return
+        if self.first_error is None:
+            self.first_error = line
+        if len(self.tests) == 0 or self.tests[-1]["test"] != test_name:
+            self.tests.append({"test": test_name, "n_errors": 0,
+                               "first_error": line})
+        self.tests[-1]["n_errors"] += 1
+        self.n_errors += 1
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "n_errors": self.n_errors,
+            "first_error": self.first_error,
+            "tests": self.tests,
+        }
+
+
+def iter_error_lines_by_test(path):
+    """Iterate over the `(test_name, line)` tuples of a log's errors."""
+
+    from rp_puppeteer.api.gecko_log_parser import GeckoLogParser
+    parser = GeckoLogParser(path)
+    return parser.iter_all_error_lines_by_test(return_expected_as_well=False)
+
+
+def analyze_gecko_log(path, max_errors=None):
+    """Return a JSON-serializable summary of the errors in one log."""
+
+    summary = ErrorSummary(path)
+    for (test_name, line) in islice(iter_error_lines_by_test(path),
+                                    max_errors):
+        summary.add(test_name, line)
+    return summary.to_dict()
+
+
+def merge_summaries(files):
+    """Merge the summaries of single logs into a report."""
+
+    return {
+        "n_files": len(files),
+        "n_files_with_errors": sum(1 for f in files if f["n_errors"] > 0),
+        "n_errors": sum(f["n_errors"] for f in files),
+        "files": files,
+    }
+
+
+def analyze_gecko_logs(paths, processes=None, max_errors=None):
+    """Analyze the logs in a process pool and merge the summaries.
+
+    :param processes: The number of worker processes. Defaults to the
+        number of CPUs.
+    :param max_errors: Stop analyzing a log after this many errors.
+    """
+
+    analyze = partial(analyze_gecko_log, max_errors=max_errors)
+    pool = Pool(processes)
+    try:
+        files = pool.map(analyze, paths, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return merge_summaries(files)
@@ -0,0 +1,122 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Helpers for testing and benchmarking the gecko log parser.
+
+None of the helpers needs a browser.
+"""
+
+import io
+import random
+import re
+
+from rp_puppeteer.api.gecko_log_parser import (IGNORE_ERRORS_END,
+                                               IGNORE_ERRORS_START,
+                                               WHITELIST, retype)
+
+
+# (weight, line) pairs. "{n}" is replaced by a random number.
+SAMPLE_LINES = [
+    (40, u"{n}\taddons.xpi\tDEBUG\tLoading bootstrap scope from "
+         u"resource://gre/modules/addons/XPIProvider.jsm"),
+    (20, u"{n}\tMarionette\tTRACE\tconn0 -> [0,{n},\"executeScript\","
+         u"{{\"scriptTimeout\":null}}]"),
+    (10, u"console.log: [RequestPolicy] Info: request #{n} processed"),
+    (5, u"[Parent {n}, Main Thread] WARNING: NS_ENSURE_TRUE(mDocShell) "
+        u"failed: file /builds/worker/docshell/nsDocShell.cpp, line {n}"),
+    (5, u"JavaScript warning: https://www.maindomain.test/lib.js, "
+        u"line {n}: unreachable code after return statement"),
+    (3, u"console.warn: [RequestPolicy] Warning: slow request #{n}"),
+    # whitelisted
+    (2, u"[RequestPolicy] Warning: no rules for #{n}"),
+    (1, u"JavaScript warning: chrome://rpcontinued/content/lib/utils.js, "
+        u"line {n}: mutating the [[Prototype]] of an object will cause "
+        u"your code to run very slowly; instead create the object with "
+        u"the correct initial [[Prototype]] value using Object.create"),
+    (1, u"JavaScript error: chrome://rpcontinued/content/third-party/"
+        u"jquery.min.js, line {n}: TypeError: a is undefined"),
+    # errors
+    (1, u"JavaScript error: chrome://rpcontinued/content/lib/ruleset.js, "
+        u"line {n}: TypeError: entry is undefined"),
+    (1, u"console.error: [RequestPolicy] Error #{n}: something failed"),
+]
+
+_LINE_CHOICES = [line for (weight, line) in SAMPLE_LINES
+                 for _ in range(weight)]
+
+
+def generate_lines(n_lines, lines_per_test=500, ignore_region_rate=0.1,
+                   seed=0):
+    """Yield `n_lines` lines which resemble the gecko log of a test run.
+
+    Every `lines_per_test` lines a new test starts. A fraction of the
+    tests, as specified by `ignore_region_rate`, contain a region in
+    which errors are ignored.
+    """
+
+    rand = random.Random(seed)
+    n_test = 0
+    ignoring = False
+    for i in range(n_lines):
+        position = i % lines_per_test
+        if i > 0 and position == 0:
+            n_test += 1
+            yield u"TEST-START: test_{0}.py TestCase.test_{0}".format(n_test)
+            continue
+        if position == 10 and rand.random() < ignore_region_rate:
+            ignoring = True
+            yield IGNORE_ERRORS_START
+            continue
+        if ignoring and position == 30:
+            ignoring = False
+            yield IGNORE_ERRORS_END
+            continue
+        yield rand.choice(_LINE_CHOICES).format(n=rand.randint(1, 99999))
+
+
+def write_log(path, n_lines, **kwargs):
+    """Write a synthetic gecko log, see `generate_lines()`."""
+
+    with io.open(path, "w", encoding="utf-8") as f:
+        for line in generate_lines(n_lines, **kwargs):
+            f.write(u"{}\n".format(line))
+
+
+def _reference_is_exception(line):
+    line = line.lower()
+    if re.match(r"^console\.(?!error)", line):
+        return False
+    for word in ["error", "warning", "exception"]:
+        if line.find(word) != -1:
+            return True
+    return False
+
+
+def reference_is_rp_exception(line):
+    """The error classifier as implemented before it was compiled into
+    regular expressions. Serves as the reference for differential tests.
+    """
+
+    if not _reference_is_exception(line):
+        return False
+
+    if (
+        line.find("[RequestPolicy]") == -1 and
+        line.find("chrome://rpcontinued/") == -1
+    ):
+        return False
+
+    if line.find("/third-party/") != -1:
+        return False
+
+    for pattern in WHITELIST:
+        if isinstance(pattern, retype):
+            if pattern.match(line):
+                return False
+        else:
+            # string
+            if line.find(pattern) == 0:
+                return False
+
+    return True
@@ -0,0 +1,238 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""A benchmark of loading and checking large user rulesets.
+
+Unlike the gecko log benchmark, this one needs a running browser: the
+synthetic rulesets, see `ruleset_testing`, are installed as the
+profile's `user.json` and measured through Marionette.
+
+Results are dicts mapping `"<phase>/<n_rules>"` to metrics:
+
+* `latency`: seconds (lower is better); for `lookup` the mean time
+  of one check, with `latency_p50` and `latency_p99` for information.
+* `memory`: bytes kept on the heap by the result of `parse` and
+  `create` plus `to_ruleset` (lower is better).
+
+The phases are `load_user_rules` (reading, parsing and building the
+user ruleset, as on startup), `parse` (`JSON.parse()` only),
+`create` (`RawRuleset.create()`), `to_ruleset` (building the lookup
+tree, which defers most entries until their domain is looked up),
+`build_all` (adding all deferred entries afterwards),
+`to_ruleset_eager` (building the whole tree up front, with
+`toRuleset(name, false)`, for comparison), `add_host`
+(only adding the rules' hosts to a tree) and `lookup`
+(`checkRequestAgainstUserRules()` on the loaded ruleset).
+Baselines are stored and compared like those of `gecko_log_benchmark`.
+"""
+
+import json
+import os
+import shutil
+
+from rp_puppeteer.api.rules import GET_BACKGROUND_PAGE
+from rp_utils.ruleset_testing import generate_uri_pairs, write_ruleset
+
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "ruleset_benchmark_baseline.json")
+N_LOOKUPS = 10000
+SCRIPT_TIMEOUT = 300000
+
+_TIME_PHASES = ["load_user_rules", "parse", "create", "to_ruleset",
+                "build_all", "to_ruleset_eager", "add_host"]
+
+# Arguments: the path of the ruleset file; (origin, dest) URI pairs.
+# Times are in milliseconds, memory in bytes. The memory values are
+# null if the heap size is not available.
+BENCHMARK_RULESET = """
+  Components.utils.import("resource://gre/modules/osfile.jsm");
+  Components.utils.import("resource://gre/modules/Services.jsm");
+  var [path, uriPairs] = arguments;
+  var {classes: Cc, interfaces: Ci, utils: Cu} = Components;
+
+  var {rp} = """ + GET_BACKGROUND_PAGE + """;
+  var now = typeof Cu.now === "function" ? () => Cu.now() : Date.now;
+  var memoryReporterManager = Cc["@mozilla.org/memory-reporter-manager;1"].
+      getService(Ci.nsIMemoryReporterManager);
+  function getHeapSize() {
+    Cu.forceGC();
+    Cu.forceCC();
+    Cu.forceGC();
+    try {
+      return memoryReporterManager.heapAllocated;
+    } catch (e) {
+      return null;
+    }
+  }
+  function getDifference(aBefore, aAfter) {
+    return aBefore === null || aAfter === null ? null : aAfter - aBefore;
+  }
+  function time(aFn) {
+    let start = now();
+    let result = aFn();
+    return [now() - start, result];
+  }
+
+  var result = {};
+  var loadStart = now();
+  rp.policy.loadUserRules().then(() => {
+    result.load_user_rules = now() - loadStart;
+    return OS.File.read(path, {encoding: "utf-8"});
+  }).then((text) => {
+    let userRawRuleset = rp.policy.getUserRulesets().user.rawRuleset;
+    let {log, uriService} = userRawRuleset;
+    let RawRuleset = userRawRuleset.constructor;
+
+    let heapBefore = getHeapSize();
+    let data;
+    [result.parse, data] = time(() => JSON.parse(text));
+    let heapAfterParse = getHeapSize();
+    let rawRuleset;
+    [result.create, rawRuleset] = time(
+        () => RawRuleset.create(log, uriService, data));
+    let ruleset;
+    [result.to_ruleset, ruleset] = time(
+        () => rawRuleset.toRuleset("benchmark"));
+    result.parse_memory = getDifference(heapBefore, heapAfterParse);
+    result.to_ruleset_memory = getDifference(heapAfterParse, getHeapSize());
+    [result.build_all] = time(() => ruleset.addAllDeferredEntries());
+    [result.to_ruleset_eager] = time(
+        () => rawRuleset.toRuleset("benchmark-eager", false));
+    let Ruleset = ruleset.constructor;
+
+    let hosts = new Set();
+    for (let action of ["allow", "deny"]) {
+      for (let ruleData of data.entries[action] || []) {
+        for (let endpointSpec of [ruleData.o, ruleData.d]) {
+          if (endpointSpec && endpointSpec.h) {
+            hosts.add(endpointSpec.h);
+          }
+        }
+      }
+    }
+    [result.add_host] = time(() => {
+      let hostsRuleset = new Ruleset(log, uriService, "hosts");
+      for (let host of hosts) {
+        hostsRuleset.addHost(host);
+      }
+    });
+
+    let uris = uriPairs.map(([origin, dest]) => [
+      Services.io.newURI(origin, null, null),
+      Services.io.newURI(dest, null, null),
+    ]);
+    result.lookups = uris.map(([originUri, destUri]) => {
+      let start = now();
+      rp.policy.checkRequestAgainstUserRules(originUri, destUri);
+      return now() - start;
+    });
+    marionetteScriptFinished(result);
+  }).catch((e) => {
+    marionetteScriptFinished({error: String(e)});
+  });
+"""
+
+
+def get_ruleset(directory, n_rules):
+    """Return the path of a synthetic ruleset, generating it if needed.
+    """
+
+    path = os.path.join(directory, "benchmark-{}.json".format(n_rules))
+    if not os.path.exists(path):
+        write_ruleset(path + ".tmp", n_rules, seed=n_rules)
+        os.rename(path + ".tmp", path)
+    return path
+
+
+def _percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _measure(marionette, path, uri_pairs):
+    measurement = marionette.execute_async_script(
+        BENCHMARK_RULESET, script_args=[path, uri_pairs],
+        script_timeout=SCRIPT_TIMEOUT)
+    if "error" in measurement:
+        raise Exception("Ruleset benchmark failed: {}"
+                        .format(measurement["error"]))
+    return measurement
+
+
+def run_benchmarks(marionette, rules, rules_file, directory,
+                   sizes=DEFAULT_SIZES, repetitions=3, n_lookups=N_LOOKUPS,
+                   log=None):
+    """Install rulesets of the given sizes and measure them.
+
+    Each ruleset is measured `repetitions` times; the shortest times
+    and the first memory values are kept. Afterwards the previous user
+    rules file is restored and loaded again.
+
+    :param rules: A `Rules` instance, to reload the user rules.
+    :param rules_file: The `RulesFile` of `user.json`.
+    :param directory: Where the synthetic rulesets are generated and
+        kept.
+    :param log: A function called with a progress message.
+    """
+
+    backup_path = os.path.join(directory, "backup.json")
+    has_original = os.path.isfile(rules_file.file_path)
+    if has_original:
+        shutil.copyfile(rules_file.file_path, backup_path)
+    results = {}
+    try:
+        for n_rules in sizes:
+            path = get_ruleset(directory, n_rules)
+            rules_file.install(path)
+            with open(path) as f:
+                uri_pairs = generate_uri_pairs(json.load(f), n_lookups,
+                                               seed=n_rules)
+            measurements = [_measure(marionette, path, uri_pairs)
+                            for _ in range(repetitions)]
+            size_results = _summarize(measurements)
+            for (phase, metrics) in sorted(size_results.items()):
+                key = "{}/{}".format(phase, n_rules)
+                results[key] = metrics
+                if log is not None:
+                    log(format_result(key, metrics))
+    finally:
+        if has_original:
+            rules_file.install(backup_path)
+            os.remove(backup_path)
+        else:
+            rules_file.remove()
+        rules.reload()
+    return results
+
+
+def _summarize(measurements):
+    first = measurements[0]
+    results = {}
+    for phase in _TIME_PHASES:
+        results[phase] = {
+            "latency": min(m[phase] for m in measurements) / 1000.0,
+        }
+    for (phase, memory_key) in [("parse", "parse_memory"),
+                                ("to_ruleset", "to_ruleset_memory")]:
+        if first[memory_key] is not None:
+            results[phase]["memory"] = first[memory_key]
+    lookups = sorted(min(durations) / 1000.0 for durations
+                     in zip(*[m["lookups"] for m in measurements]))
+    results["lookup"] = {
+        "latency": sum(lookups) / len(lookups),
+        "latency_p50": _percentile(lookups, 0.5),
+        "latency_p99": _percentile(lookups, 0.99),
+    }
+    return results
+
+
+def format_result(key, metrics):
+    parts = ["{:>10.3f} ms".format(metrics["latency"] * 1000)]
+    if "latency_p99" in metrics:
+        parts.append("p99 {:>8.3f} ms".format(metrics["latency_p99"] * 1000))
+    if "memory" in metrics:
+        parts.append("{:>8.1f} MB".format(metrics["memory"] / 1024.0 ** 2))
+    return "{:<30} {}".format(key, "  ".join(parts))
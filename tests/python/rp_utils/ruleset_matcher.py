@@ -0,0 +1,642 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""A pure-Python implementation of RequestPolicy's rule matching.
+
+`Ruleset` reproduces `Ruleset.check()` of ruleset.ts, including its
+`DomainEntry` tree and `Rule.isMatch()`, and `Policy` reproduces the
+rule-based part of `RequestProcessor.process()`: the identical-origin
+check, then the user rules, then the subscription rules. Whatever the
+browser decides by other means (link clicks, redirects, compatibility
+rules, the default policy) is out of scope.
+
+Like the original, the matching ignores paths, so results only depend
+on the scheme, host and port of the URIs. They are cached per such
+endpoint, which makes checking the millions of pairs of a proxy log
+fast, as most endpoints recur.
+
+URIs are parsed like Gecko does it for the common schemes. Known
+differences: IDNs are not converted and IPv4 addresses are not
+normalized.
+"""
+
+from collections import namedtuple
+import json
+import os
+import re
+import socket
+
+
+# See `RequestReason` in request-result.ts.
+USER_POLICY = 1
+SUBSCRIPTION_POLICY = 2
+DEFAULT_POLICY = 3
+DEFAULT_POLICY_INCONSISTENT_RULES = 4
+IDENTICAL_IDENTIFIER = 13
+
+# The lists which are enabled if `subscriptions.json` does not exist,
+# see `UserSubscriptions.create()`.
+DEFAULT_SUBSCRIPTIONS = {
+    "official": ["allow_embedded", "allow_extensions", "allow_functionality",
+                 "allow_mozilla", "allow_sameorg", "deny_trackers"],
+}
+
+# The number of URIs or endpoints cached at most, per cache.
+CACHE_SIZE = 100000
+
+# Schemes whose URIs Gecko parses as `nsStandardURL`, and the ports
+# which such URLs omit as default ports. URIs of other schemes have
+# neither a host nor a port.
+_STANDARD_URL_SCHEMES = frozenset([
+    "http", "https", "ftp", "file", "ws", "wss", "resource", "chrome",
+    "moz-extension"])
+_URL_DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21, "ws": 80,
+                      "wss": 443}
+# See `getDefaultPortForScheme()` in uri-service.ts.
+_RULE_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_SCHEME_RE = re.compile(r"^\s*([a-zA-Z][a-zA-Z0-9+.-]*):")
+_AUTHORITY_END_RE = re.compile(r"[/?#\\]")
+_PARSE_INT_RE = re.compile(r"^\s*([+-]?\d+)")
+
+
+# The parts of a URI which rules depend on. `host` is "" if the URI has
+# none, `port` is -1 for the default port, `pre_path` is what
+# `nsIURI.prePath` returns.
+Endpoint = namedtuple("Endpoint", ["scheme", "host", "port", "pre_path"])
+
+# The decision on a request. `allowed` is None if the default policy
+# decides, see `reason`.
+Decision = namedtuple("Decision", ["allowed", "reason"])
+
+
+def parse_uri(uri):
+    """Return the `Endpoint` of a URI.
+
+    :raises ValueError: If the URI has no scheme or an invalid port.
+    """
+
+    match = _SCHEME_RE.match(uri)
+    if match is None:
+        raise ValueError(u"Invalid URI: {}".format(uri))
+    scheme = match.group(1).lower()
+    if scheme not in _STANDARD_URL_SCHEMES:
+        return Endpoint(scheme, u"", -1, scheme + u":")
+
+    rest = uri[match.end():].lstrip(u"/\\")
+    if scheme == "file":
+        # "file:///path" has an empty host.
+        if not uri[match.end():].startswith(u"//"):
+            return Endpoint(scheme, u"", -1, u"file://")
+        rest = uri[match.end() + 2:]
+    end = _AUTHORITY_END_RE.search(rest)
+    authority = rest if end is None else rest[:end.start()]
+    (userinfo, _, host_port) = authority.rpartition(u"@")
+
+    port = -1
+    if host_port.startswith(u"["):
+        (host, _, port_part) = host_port[1:].partition(u"]")
+        host_with_brackets = u"[" + host.lower() + u"]"
+        port_string = port_part[1:] if port_part.startswith(u":") else None
+    else:
+        (host, colon, port_string) = host_port.partition(u":")
+        host_with_brackets = host.lower()
+        if not colon:
+            port_string = None
+    if port_string:
+        if not port_string.isdigit():
+            raise ValueError(u"Invalid port in URI: {}".format(uri))
+        port = int(port_string)
+        if port == _URL_DEFAULT_PORTS.get(scheme):
+            port = -1
+
+    pre_path = scheme + u"://"
+    if userinfo:
+        pre_path += userinfo + u"@"
+    pre_path += host_with_brackets
+    if port != -1:
+        pre_path += u":{}".format(port)
+    return Endpoint(scheme, host.lower(), port, pre_path)
+
+
+def is_ip_address(host):
+    """Whether the host is an IP address, like `isIPAddress()` in
+    uri-service.ts decides it.
+    """
+
+    if u":" in host:
+        try:
+            socket.inet_pton(socket.AF_INET6, host)
+            return True
+        except (socket.error, ValueError):
+            return False
+    try:
+        socket.inet_aton(host)
+        return True
+    except (socket.error, ValueError):
+        return False
+
+
+def _parse_rule_port(port):
+    """Return the port number of a rule's port, like `parseInt()`, or
+    None if it is NaN.
+    """
+
+    if isinstance(port, bool):
+        return None
+    if isinstance(port, (int, long, float)):
+        return port
+    if not isinstance(port, basestring):
+        return None
+    match = _PARSE_INT_RE.match(port)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def _has_standard_port(scheme, port):
+    return (port == -1 or scheme != "http" and scheme != "https" or
+            port == _RULE_DEFAULT_PORTS[scheme])
+
+
+class _Rule(object):
+    """A `Rule` of ruleset.ts. Paths are not supported, as in the
+    original, where they are never set.
+    """
+
+    __slots__ = ("scheme", "port", "_port_number", "allow_origin",
+                 "deny_origin", "allow_destination", "deny_destination",
+                 "destinations")
+
+    def __init__(self, scheme, port):
+        self.scheme = scheme or None
+        self.port = port or None
+        self._port_number = (None if self.port in (None, "*") else
+                             _parse_rule_port(self.port))
+        self.allow_origin = False
+        self.deny_origin = False
+        self.allow_destination = False
+        self.deny_destination = False
+        self.destinations = None
+
+    def is_match(self, scheme, port, spec_has_host):
+        if (self.scheme is not None and self.scheme != "*" and
+                self.scheme != scheme):
+            return False
+        if self.port is not None:
+            # "*" means any port, no port means the default ports.
+            if self.port != "*":
+                rule_port = self._port_number
+                if rule_port is None:
+                    return False
+                if rule_port != port and not (
+                        port == -1 and
+                        rule_port == _RULE_DEFAULT_PORTS.get(scheme)):
+                    return False
+        elif spec_has_host and not _has_standard_port(scheme, port):
+            return False
+        return True
+
+
+class _Entry(object):
+    """A `DomainEntry` or `IPAddressEntry`, or the rules of a ruleset
+    which do not specify a host. `host` is the entry's host as used
+    in rules, or None.
+    """
+
+    __slots__ = ("host", "rules", "_rules_by_key")
+
+    def __init__(self, host):
+        self.host = host
+        self.rules = []
+        self._rules_by_key = {}
+
+    def add_rule(self, scheme, port):
+        """Return the rule with the given scheme and port, which is
+        created if needed, like `Rules.add()` does.
+        """
+
+        key = (scheme or None, port or None)
+        rule = self._rules_by_key.get(key)
+        if rule is None:
+            rule = _Rule(scheme, port)
+            self._rules_by_key[key] = rule
+            self.rules.append(rule)
+        return rule
+
+
+class Ruleset(object):
+    """A ruleset, as created by `RawRuleset.toRuleset()`."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self._non_host_entry = _Entry(None)
+        # Domain entries by the domain's parts, joined by ".". All
+        # levels of a domain have an entry, as in the `DomainEntry`
+        # tree, e.g. "com", "example.com" and "*.example.com".
+        self._domains = {}
+        self._ip_addresses = {}
+        self._origin_cache = {}
+        self._dest_cache = {}
+
+    @classmethod
+    def from_raw(cls, raw_ruleset, name=None):
+        """Create a ruleset from the contents of a policy file.
+
+        :raises ValueError: If the data is invalid, see
+            `RawRuleset.checkDataObj()`.
+        """
+
+        _check_raw_ruleset(raw_ruleset)
+        ruleset = cls(name)
+        entries = raw_ruleset["entries"]
+        for (action_string, allow) in [("allow", True), ("deny", False)]:
+            for rule_data in entries.get(action_string) or []:
+                ruleset.add_rule(rule_data, allow)
+        return ruleset
+
+    @classmethod
+    def from_file(cls, path, name=None):
+        with open(path, "r") as f:
+            return cls.from_raw(json.load(f), name)
+
+    def add_rule(self, rule_data, allow):
+        """Add a rule, like `RawRuleset._addEntryToRuleset()` does."""
+
+        # Endpoint specs are objects, so empty ones count as well.
+        origin = rule_data.get("o")
+        dest = rule_data.get("d")
+        if origin is not None and dest is not None:
+            rule = self._add_endpoint(origin)
+            if rule.destinations is None:
+                rule.destinations = Ruleset()
+            rule = rule.destinations._add_endpoint(dest)
+            rule.allow_destination |= allow
+            rule.deny_destination |= not allow
+        elif origin is not None:
+            rule = self._add_endpoint(origin)
+            rule.allow_origin |= allow
+            rule.deny_origin |= not allow
+        elif dest is not None:
+            rule = self._add_endpoint(dest)
+            rule.allow_destination |= allow
+            rule.deny_destination |= not allow
+
+    def check(self, origin, dest):
+        """Return the matches of a request, like `Ruleset.check()`.
+
+        :param origin: The origin's `Endpoint`.
+        :param dest: The destination's `Endpoint`.
+        :returns: A tuple of the allow matches and the deny matches.
+            Matches are tuples like in ruleset.ts, but with internal
+            entry and rule objects, see `match_to_raw_rule()`.
+        """
+
+        allow_matches = []
+        deny_matches = []
+        for (entry, rule) in self._get_origin_rules(origin):
+            if rule.allow_origin:
+                allow_matches.append(("origin", entry, rule))
+            if rule.deny_origin:
+                deny_matches.append(("origin", entry, rule))
+            if rule.destinations is not None:
+                (dest_allows, dest_denies) = (
+                    rule.destinations._get_dest_rules(dest))
+                for (dest_entry, dest_rule) in dest_allows:
+                    allow_matches.append(("origin-to-dest", entry, rule,
+                                          dest_entry, dest_rule))
+                for (dest_entry, dest_rule) in dest_denies:
+                    deny_matches.append(("origin-to-dest", entry, rule,
+                                         dest_entry, dest_rule))
+        (dest_allows, dest_denies) = self._get_dest_rules(dest)
+        for (entry, rule) in dest_allows:
+            allow_matches.append(("dest", entry, rule))
+        for (entry, rule) in dest_denies:
+            deny_matches.append(("dest", entry, rule))
+        return (allow_matches, deny_matches)
+
+    def get_host_matches(self, host):
+        """Return the `(entry, spec_has_host)` tuples of the entries a
+        host matches, like `Ruleset.getHostMatches()`. Entries without
+        rules are omitted.
+        """
+
+        matches = []
+        if self._non_host_entry.rules:
+            matches.append((self._non_host_entry, False))
+        if not host:
+            return matches
+
+        if is_ip_address(host):
+            entry = self._ip_addresses.get(host)
+            if entry is not None:
+                matches.append((entry, True))
+            return matches
+
+        domains = self._domains
+        entry = domains.get(u"*")
+        if entry is not None:
+            matches.append((entry, True))
+        parts = host.split(u".")
+        for i in range(len(parts) - 1, -1, -1):
+            level = u".".join(parts[i:])
+            entry = domains.get(level)
+            if entry is None:
+                break
+            matches.append((entry, True))
+            # Check for *.domain rules at each level.
+            entry = domains.get(u"*." + level)
+            if entry is not None:
+                matches.append((entry, True))
+        return [match for match in matches if match[0].rules]
+
+    def clear_cache(self):
+        self._origin_cache.clear()
+        self._dest_cache.clear()
+
+    ##################################
+    # Private Properties and Methods #
+    ##################################
+
+    def _add_endpoint(self, endpoint_spec):
+        """Return the rule for an endpoint, like
+        `RawRuleset._addEntryHelper()` does.
+        """
+
+        self.clear_cache()
+        host = endpoint_spec.get("h")
+        if not host:
+            entry = self._non_host_entry
+        elif is_ip_address(host):
+            entry = self._ip_addresses.get(host)
+            if entry is None:
+                entry = self._ip_addresses[host] = _Entry(host)
+        else:
+            entry = self._add_domain(host)
+        return entry.add_rule(endpoint_spec.get("s"),
+                              endpoint_spec.get("port"))
+
+    def _add_domain(self, domain):
+        parts = domain.split(u".")
+        full_name = u""
+        entry = None
+        for i in range(len(parts) - 1, -1, -1):
+            # `fullName` is built like in `Ruleset._addDomain()`.
+            full_name = parts[i] + (u"." if full_name else u"") + full_name
+            level = u".".join(parts[i:])
+            entry = self._domains.get(level)
+            if entry is None:
+                entry = self._domains[level] = _Entry(full_name)
+        return entry
+
+    def _get_origin_rules(self, origin):
+        """Return the `(entry, rule)` tuples of the rules which match
+        the origin and may be relevant for checking requests.
+        """
+
+        key = origin[:3]
+        result = self._origin_cache.get(key)
+        if result is None:
+            (scheme, host, port) = key
+            result = []
+            for (entry, spec_has_host) in self.get_host_matches(host):
+                for rule in entry.rules:
+                    if ((rule.allow_origin or rule.deny_origin or
+                         rule.destinations is not None) and
+                            rule.is_match(scheme, port, spec_has_host)):
+                        result.append((entry, rule))
+            if len(self._origin_cache) >= CACHE_SIZE:
+                self._origin_cache.clear()
+            self._origin_cache[key] = result
+        return result
+
+    def _get_dest_rules(self, dest):
+        """Return the `(entry, rule)` tuples of the allow and deny rules
+        which match the destination.
+        """
+
+        key = dest[:3]
+        result = self._dest_cache.get(key)
+        if result is None:
+            (scheme, host, port) = key
+            allows = []
+            denies = []
+            for (entry, spec_has_host) in self.get_host_matches(host):
+                for rule in entry.rules:
+                    if ((rule.allow_destination or rule.deny_destination) and
+                            rule.is_match(scheme, port, spec_has_host)):
+                        if rule.allow_destination:
+                            allows.append((entry, rule))
+                        if rule.deny_destination:
+                            denies.append((entry, rule))
+            result = (allows, denies)
+            if len(self._dest_cache) >= CACHE_SIZE:
+                self._dest_cache.clear()
+            self._dest_cache[key] = result
+        return result
+
+
+def _check_raw_ruleset(raw_ruleset):
+    if not isinstance(raw_ruleset, dict):
+        error = "not an object"
+    elif "metadata" not in raw_ruleset:
+        error = "no 'metadata' key"
+    elif "version" not in raw_ruleset["metadata"]:
+        error = "no 'version' key"
+    elif raw_ruleset["metadata"]["version"] != 1:
+        error = "Wrong metadata version. Expected 1, was {}".format(
+            raw_ruleset["metadata"]["version"])
+    elif "entries" not in raw_ruleset:
+        error = "no 'entries' key"
+    else:
+        return
+    raise ValueError("Invalid policy data: " + error)
+
+
+def match_to_raw_rule(match):
+    """Return the rule data of a match, like `Ruleset.matchToRawRule()`.
+    """
+
+    raw_rule = {}
+    if match[0] == "origin":
+        _set_raw_endpoint(raw_rule, "o", match[1], match[2])
+    elif match[0] == "dest":
+        _set_raw_endpoint(raw_rule, "d", match[1], match[2])
+    else:
+        _set_raw_endpoint(raw_rule, "o", match[1], match[2])
+        _set_raw_endpoint(raw_rule, "d", match[3], match[4])
+    return raw_rule
+
+
+def _set_raw_endpoint(raw_rule, origin_or_dest, entry, rule):
+    endpoint_spec = raw_rule[origin_or_dest] = {}
+    if entry.host:
+        endpoint_spec["h"] = entry.host
+    if rule.scheme:
+        endpoint_spec["s"] = rule.scheme
+    if rule.port:
+        endpoint_spec["port"] = rule.port
+
+
+class RequestResult(object):
+    """The matches of a request, like `RequestResult` in
+    request-result.ts. Matches are `(ruleset, match)` tuples.
+    """
+
+    __slots__ = ("matched_allow_rules", "matched_deny_rules")
+
+    def __init__(self):
+        self.matched_allow_rules = []
+        self.matched_deny_rules = []
+
+    def resolve_conflict(self):
+        """Return `(conflict_can_be_resolved, should_allow)`.
+
+        Conflicts are resolved by origin-to-destination rules.
+        """
+
+        n_allow = self._count_origin_to_dest_rules(self.matched_allow_rules)
+        n_deny = self._count_origin_to_dest_rules(self.matched_deny_rules)
+        if n_allow == 0 and n_deny > 0:
+            return (True, False)
+        if n_allow > 0 and n_deny == 0:
+            return (True, True)
+        return (False, None)
+
+    @staticmethod
+    def _count_origin_to_dest_rules(matches):
+        return sum(1 for (_, match) in matches
+                   if match[0] == "origin-to-dest")
+
+
+class Policy(object):
+    """The user and subscription rulesets of a profile.
+
+    :param user_rulesets: The user rulesets, e.g. the user rules and
+        the temporary rules.
+    :param subscription_rulesets: The rulesets of the enabled
+        subscriptions.
+    """
+
+    def __init__(self, user_rulesets=(), subscription_rulesets=()):
+        self.user_rulesets = list(user_rulesets)
+        self.subscription_rulesets = list(subscription_rulesets)
+        self._uri_cache = {}
+
+    @classmethod
+    def from_directory(cls, path):
+        """Load the policy of a profile.
+
+        :param path: The "requestpolicy" directory of a profile. The
+            user rules are read from "policies/user.json", the enabled
+            subscriptions from "subscriptions.json". Missing files are
+            skipped, like the browser does.
+        """
+
+        policies_path = os.path.join(path, "policies")
+        user_rulesets = []
+        user_file = os.path.join(policies_path, "user.json")
+        if os.path.isfile(user_file):
+            user_rulesets.append(Ruleset.from_file(user_file, "user"))
+
+        subscriptions = DEFAULT_SUBSCRIPTIONS
+        subscriptions_file = os.path.join(path, "subscriptions.json")
+        if os.path.isfile(subscriptions_file):
+            with open(subscriptions_file, "r") as f:
+                lists = json.load(f).get("lists")
+            if lists is not None:
+                subscriptions = dict(
+                    (list_name, list((data.get("subscriptions") or {})))
+                    for (list_name, data) in lists.items())
+        subscription_rulesets = []
+        for (list_name, sub_names) in sorted(subscriptions.items()):
+            for sub_name in sorted(sub_names):
+                sub_file = os.path.join(policies_path, "subscriptions",
+                                        list_name, sub_name + ".json")
+                if os.path.isfile(sub_file):
+                    subscription_rulesets.append(
+                        Ruleset.from_file(sub_file, sub_name))
+
+        return cls(user_rulesets, subscription_rulesets)
+
+    def check_user_rules(self, origin_uri, dest_uri):
+        """Like `checkRequestAgainstUserRules()`.
+
+        :returns: A `RequestResult`.
+        """
+
+        return self._check_rulesets(self.user_rulesets,
+                                    self._parse_uri(origin_uri),
+                                    self._parse_uri(dest_uri))
+
+    def check_subscription_rules(self, origin_uri, dest_uri):
+        """Like `checkRequestAgainstSubscriptionRules()`."""
+
+        return self._check_rulesets(self.subscription_rulesets,
+                                    self._parse_uri(origin_uri),
+                                    self._parse_uri(dest_uri))
+
+    def decide(self, origin_uri, dest_uri):
+        """Return the `Decision` on a request.
+
+        :raises ValueError: If a URI is invalid.
+        """
+
+        return self._decide(self._parse_uri(origin_uri),
+                            self._parse_uri(dest_uri))
+
+    def decide_many(self, pairs):
+        """Yield the `Decision` on each `(origin_uri, dest_uri)` pair."""
+
+        decide = self.decide
+        for (origin_uri, dest_uri) in pairs:
+            yield decide(origin_uri, dest_uri)
+
+    def clear_cache(self):
+        self._uri_cache.clear()
+        for ruleset in self.user_rulesets + self.subscription_rulesets:
+            ruleset.clear_cache()
+
+    ##################################
+    # Private Properties and Methods #
+    ##################################
+
+    def _parse_uri(self, uri):
+        endpoint = self._uri_cache.get(uri)
+        if endpoint is None:
+            endpoint = parse_uri(uri)
+            if len(self._uri_cache) >= CACHE_SIZE:
+                self._uri_cache.clear()
+            self._uri_cache[uri] = endpoint
+        return endpoint
+
+    def _check_rulesets(self, rulesets, origin, dest):
+        result = RequestResult()
+        for ruleset in rulesets:
+            (allow_matches, deny_matches) = ruleset.check(origin, dest)
+            for match in allow_matches:
+                result.matched_allow_rules.append((ruleset, match))
+            for match in deny_matches:
+                result.matched_deny_rules.append((ruleset, match))
+        return result
+
+    def _decide(self, origin, dest):
+        # See `RequestProcessor.process()`.
+        if origin.pre_path == dest.pre_path:
+            return Decision(True, IDENTICAL_IDENTIFIER)
+        for (rulesets, reason) in [
+                (self.user_rulesets, USER_POLICY),
+                (self.subscription_rulesets, SUBSCRIPTION_POLICY)]:
+            result = self._check_rulesets(rulesets, origin, dest)
+            if result.matched_allow_rules and result.matched_deny_rules:
+                (conflict_can_be_resolved, should_allow) = (
+                    result.resolve_conflict())
+                if conflict_can_be_resolved:
+                    return Decision(should_allow, reason)
+                return Decision(None, DEFAULT_POLICY_INCONSISTENT_RULES)
+            if result.matched_deny_rules:
+                return Decision(False, reason)
+            if result.matched_allow_rules:
+                return Decision(True, reason)
+        return Decision(None, DEFAULT_POLICY)
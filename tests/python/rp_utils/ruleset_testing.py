@@ -0,0 +1,138 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Helpers for testing and benchmarking large rulesets.
+
+None of the helpers needs a browser.
+"""
+
+import json
+import random
+
+
+TOP_LEVEL_DOMAINS = ["com", "org", "net", "de", "test"]
+SCHEMES = ["http", "https", "ftp", "*"]
+PORTS = [80, 443, 8080, 8443, "*"]
+
+
+def _generate_host(rand, n_domains, max_subdomain_depth, wildcard_rate,
+                   ip_rate):
+    if rand.random() < ip_rate:
+        if rand.random() < 0.25:
+            return u"fd00::{:x}".format(rand.randint(1, 0xffff))
+        return u"10.{}.{}.{}".format(rand.randint(0, 255),
+                                     rand.randint(0, 255),
+                                     rand.randint(1, 254))
+    domain_number = rand.randrange(n_domains)
+    labels = [u"domain{}".format(domain_number),
+              TOP_LEVEL_DOMAINS[domain_number % len(TOP_LEVEL_DOMAINS)]]
+    for _ in range(rand.randint(0, max_subdomain_depth)):
+        labels.insert(0, u"sub{}".format(rand.randint(0, 9)))
+    if rand.random() < wildcard_rate:
+        labels.insert(0, u"*")
+    return u".".join(labels)
+
+
+def generate_rules(n_rules, seed=0, n_domains=None, max_subdomain_depth=3,
+                   wildcard_rate=0.1, ip_rate=0.05, scheme_rate=0.2,
+                   port_rate=0.1, origin_rate=0.3, dest_rate=0.3,
+                   deny_rate=0.3):
+    """Yield `(allow, rule_data)` tuples of `n_rules` distinct rules.
+
+    :param n_domains: The number of second-level domains the hosts are
+        chosen from. Defaults to a fifth of `n_rules`, so that domains
+        have several rules and subdomains.
+    :param max_subdomain_depth: Hosts have up to this many labels in
+        front of the second-level domain.
+    :param wildcard_rate: The fraction of hosts starting with "*.".
+    :param ip_rate: The fraction of hosts which are IP addresses, a
+        quarter of them IPv6.
+    :param scheme_rate: The fraction of endpoints with a scheme.
+    :param port_rate: The fraction of endpoints with a port.
+    :param origin_rate: The fraction of origin rules.
+    :param dest_rate: The fraction of destination rules. The remaining
+        rules are origin-to-destination rules.
+    :param deny_rate: The fraction of deny rules.
+    """
+
+    rand = random.Random(seed)
+    if n_domains is None:
+        n_domains = max(1, n_rules // 5)
+
+    def generate_endpoint_spec():
+        spec = {"h": _generate_host(rand, n_domains, max_subdomain_depth,
+                                    wildcard_rate, ip_rate)}
+        if rand.random() < scheme_rate:
+            spec["s"] = rand.choice(SCHEMES)
+        if rand.random() < port_rate:
+            spec["port"] = rand.choice(PORTS)
+        return spec
+
+    seen = set()
+    n_attempts = 0
+    while len(seen) < n_rules:
+        n_attempts += 1
+        if n_attempts > n_rules * 100:
+            raise ValueError("Cannot generate {} distinct rules of this "
+                             "shape.".format(n_rules))
+        kind = rand.random()
+        rule_data = {}
+        if kind < origin_rate + (1 - origin_rate - dest_rate):
+            rule_data["o"] = generate_endpoint_spec()
+        if kind >= origin_rate:
+            rule_data["d"] = generate_endpoint_spec()
+        allow = rand.random() >= deny_rate
+        key = (allow, json.dumps(rule_data, sort_keys=True))
+        if key in seen:
+            continue
+        seen.add(key)
+        yield (allow, rule_data)
+
+
+def generate_raw_ruleset(n_rules, **kwargs):
+    """Return a ruleset in the format of `user.json`, see
+    `generate_rules()`.
+    """
+
+    entries = {"allow": [], "deny": []}
+    for (allow, rule_data) in generate_rules(n_rules, **kwargs):
+        entries["allow" if allow else "deny"].append(rule_data)
+    return {"metadata": {"version": 1}, "entries": entries}
+
+
+def write_ruleset(path, n_rules, **kwargs):
+    """Write a synthetic `user.json`, see `generate_rules()`."""
+
+    with open(path, "w") as f:
+        json.dump(generate_raw_ruleset(n_rules, **kwargs), f)
+
+
+def generate_uri_pairs(raw_ruleset, n_pairs, hit_rate=0.5, seed=0):
+    """Return `(origin_uri, dest_uri)` tuples for lookups in a ruleset.
+
+    :param hit_rate: The fraction of URIs whose host is taken from the
+        rules. The other hosts are not in the ruleset.
+    """
+
+    rand = random.Random(seed)
+    hosts = set()
+    for rules in raw_ruleset["entries"].values():
+        for rule_data in rules:
+            for endpoint_spec in rule_data.values():
+                if endpoint_spec.get("h"):
+                    hosts.add(endpoint_spec["h"].replace(u"*", u"www"))
+    hosts = sorted(hosts)
+
+    def generate_uri():
+        if hosts and rand.random() < hit_rate:
+            host = rand.choice(hosts)
+        else:
+            host = u"unknown{}.example".format(rand.randint(0, 9999))
+        if u":" in host:
+            host = u"[{}]".format(host)
+        scheme = rand.choice(["http", "https"])
+        port = u":8080" if rand.random() < 0.1 else u""
+        return u"{}://{}{}/".format(scheme, host, port)
+
+    return [(generate_uri(), generate_uri()) for _ in range(n_pairs)]
@@ -6,9 +6,15 @@ from rp_utils import constants as C
 
 
 def get_gecko_log_error_lines(file):
+    return list(iter_gecko_log_error_lines(file))
+
+
+def iter_gecko_log_error_lines(file):
+    """Iterate over the error lines of a gecko log in constant memory."""
+
     from rp_puppeteer.api.gecko_log_parser import GeckoLogParser
     parser = GeckoLogParser(file)
-    return parser.get_all_error_lines(return_expected_as_well=False)
+    return parser.iter_all_error_lines(return_expected_as_well=False)
 
 
 def create_profile(addons, pref_categories, profile=None):
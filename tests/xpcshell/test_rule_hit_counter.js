@@ -0,0 +1,120 @@
+/* exported run_test */
+const {Log} = require("lib/classes/log");
+const log = new Log();
+
+const {UriService} = require("app/services/uri-service");
+const uriService = new UriService(log);
+
+const {C} = require("data/constants");
+const {RawRuleset, RuleHitCounter} = require("app/policy/ruleset");
+
+const ALLOW = C.RULE_ACTION_ALLOW;
+const DENY = C.RULE_ACTION_DENY;
+
+// @ts-ignore
+function run_test() {
+  run_next_test();
+}
+
+const ORIGIN_RULE = {o: {h: "example.com"}};
+const DEST_RULE = {d: {h: "*.example.net", s: "https"}};
+const ORIGIN_TO_DEST_RULE = {o: {h: "example.com"}, d: {h: "example.org"}};
+
+function createRuleset(entries) {
+  return RawRuleset.create(log, uriService, {
+    entries: JSON.parse(JSON.stringify(entries)),
+    metadata: {version: 1},
+  }).toRuleset("user");
+}
+
+function check(ruleset, originSpec, destSpec) {
+  return ruleset.check(uriService.getUriObject(originSpec),
+      uriService.getUriObject(destSpec));
+}
+
+function getSortedHits(counter) {
+  return counter.getHits().sort((a, b) => b.hits - a.hits);
+}
+
+add_test(function() {
+  // setup
+  const ruleset = createRuleset({
+    allow: [ORIGIN_RULE, DEST_RULE, ORIGIN_TO_DEST_RULE],
+    deny: [],
+  });
+  const counter = new RuleHitCounter();
+
+  // exercise
+  // An origin match and an origin-to-destination match.
+  let [allowMatches] = check(ruleset, "http://example.com/",
+      "http://example.org/");
+  counter.countMatches("user", ALLOW, allowMatches);
+  // An origin match and a destination match.
+  [allowMatches] = check(ruleset, "http://example.com/",
+      "https://www.example.net/");
+  counter.countMatches("user", ALLOW, allowMatches);
+  // A destination match only.
+  [allowMatches] = check(ruleset, "http://unknown.test/",
+      "https://example.net/");
+  counter.countMatches("user", ALLOW, allowMatches);
+  // No match.
+  [allowMatches] = check(ruleset, "http://unknown.test/",
+      "http://www.example.net/");
+  counter.countMatches("user", ALLOW, allowMatches);
+
+  // verify
+  Assert.deepEqual(getSortedHits(counter), [
+    {ruleset: "user", ruleAction: ALLOW, rule: ORIGIN_RULE, hits: 2},
+    {ruleset: "user", ruleAction: ALLOW, rule: DEST_RULE, hits: 2},
+    {ruleset: "user", ruleAction: ALLOW, rule: ORIGIN_TO_DEST_RULE, hits: 1},
+  ]);
+
+  run_next_test();
+});
+
+add_test(function() {
+  // setup
+  const counter = new RuleHitCounter();
+  const entries = {allow: [ORIGIN_RULE], deny: [ORIGIN_RULE]};
+
+  // exercise
+  // The same rule is counted separately for each ruleset and rule
+  // action, but not separately for each `Ruleset` object.
+  for (let i = 0; i < 2; i++) {
+    const ruleset = createRuleset(entries);
+    const [allowMatches, denyMatches] = check(ruleset,
+        "http://example.com/", "http://example.org/");
+    counter.countMatches("user", ALLOW, allowMatches);
+    counter.countMatches("user", DENY, denyMatches);
+    counter.countMatches("temp", ALLOW, allowMatches);
+  }
+
+  // verify
+  const hits = counter.getHits();
+  Assert.equal(hits.length, 3);
+  Assert.deepEqual(hits.map(({ruleset, ruleAction}) => [ruleset, ruleAction]),
+      [["user", ALLOW], ["user", DENY], ["temp", ALLOW]]);
+  for (let ruleHits of hits) {
+    Assert.deepEqual(ruleHits.rule, ORIGIN_RULE);
+    Assert.equal(ruleHits.hits, 2);
+  }
+
+  run_next_test();
+});
+
+add_test(function() {
+  // setup
+  const ruleset = createRuleset({allow: [ORIGIN_RULE], deny: []});
+  const counter = new RuleHitCounter();
+  const [allowMatches] = check(ruleset, "http://example.com/",
+      "http://example.org/");
+  counter.countMatches("user", ALLOW, allowMatches);
+
+  // exercise
+  counter.reset();
+
+  // verify
+  Assert.deepEqual(counter.getHits(), []);
+
+  run_next_test();
+});
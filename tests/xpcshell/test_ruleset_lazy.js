@@ -0,0 +1,187 @@
+/* exported run_test */
+const {Log} = require("lib/classes/log");
+const log = new Log();
+
+const {UriService} = require("app/services/uri-service");
+const uriService = new UriService(log);
+
+const {C} = require("data/constants");
+const {RawRuleset, Ruleset} = require("app/policy/ruleset");
+
+const ALLOW = C.RULE_ACTION_ALLOW;
+const DENY = C.RULE_ACTION_DENY;
+
+// @ts-ignore
+function run_test() {
+  run_next_test();
+}
+
+const RULESET_DATA = {
+  metadata: {version: 1},
+  entries: {
+    allow: [
+      {o: {h: "*.com"}},
+      {d: {h: "*"}},
+      {d: {h: "*.example.com", s: "https"}},
+      {o: {h: "www.example.com"}, d: {h: "cdn.example.net"}},
+      {o: {h: "example.org"}, d: {h: "*.example.net", port: 8080}},
+      {o: {h: "1.2.3.4"}},
+      {d: {h: "::1", port: "*"}},
+      {o: {h: "1.2.3.4"}, d: {h: "::1"}},
+      {o: {s: "file"}},
+      {d: {h: "a.b.c.example.org"}},
+    ],
+    deny: [
+      {d: {h: "*.net"}},
+      {o: {h: "*"}, d: {h: "tracker.example.com"}},
+      {d: {h: "5.6.7.8"}},
+      {o: {h: "*.example.org"}, d: {h: "example.com"}},
+      {d: {h: "com"}},
+    ],
+  },
+};
+
+const HOSTS = [
+  "com", "*", "*.com", "example.com", "www.example.com", "*.example.com",
+  "example.net", "*.example.net", "example.org", "a.b.c.example.org",
+  "1.2.3.4", "5.6.7.8", "::1", "unknown.test",
+];
+
+const URIS = [
+  "http://com/", "http://example.com/", "https://www.example.com/",
+  "http://tracker.example.com/", "http://cdn.example.net/",
+  "http://cdn.example.net:8080/", "http://example.org/",
+  "http://www.example.org/", "http://a.b.c.example.org/",
+  "http://1.2.3.4/", "http://5.6.7.8/", "http://[::1]/",
+  "http://[::1]:8080/", "http://unknown.test/", "file:///etc/hosts",
+];
+
+function copy(data) {
+  return JSON.parse(JSON.stringify(data));
+}
+
+function buildEagerly(data) {
+  const rawRuleset = RawRuleset.create(log, uriService, data);
+  return {rawRuleset, ruleset: rawRuleset.toRuleset("user", false)};
+}
+
+function buildLazily(data) {
+  const rawRuleset = RawRuleset.create(log, uriService, data);
+  return {rawRuleset, ruleset: rawRuleset.toRuleset("user", true)};
+}
+
+function matchesToStrings(matches) {
+  return matches.map(match => match[0] + " " +
+      Ruleset.rawRuleToCanonicalString(Ruleset.matchToRawRule(match)));
+}
+
+function checkAll(ruleset) {
+  const results = [];
+  for (let originSpec of URIS) {
+    for (let destSpec of URIS) {
+      const [allowMatches, denyMatches] = ruleset.check(
+          uriService.getUriObject(originSpec),
+          uriService.getUriObject(destSpec));
+      results.push([
+        originSpec, destSpec,
+        matchesToStrings(allowMatches), matchesToStrings(denyMatches),
+      ]);
+    }
+  }
+  return results;
+}
+
+function describeHost(ruleset, host) {
+  const entry = ruleset.getHost(host);
+  if (!entry) {
+    return null;
+  }
+  return Array.from(entry.rules).map(rule => rule.toString());
+}
+
+function assertSameResults(eager, lazy) {
+  Assert.deepEqual(checkAll(lazy.ruleset), checkAll(eager.ruleset));
+}
+
+add_test(function() {
+  // setup
+  const eager = buildEagerly(copy(RULESET_DATA));
+  const lazy = buildLazily(copy(RULESET_DATA));
+
+  // verify
+  assertSameResults(eager, lazy);
+
+  run_next_test();
+});
+
+add_test(function() {
+  // setup
+  const eager = buildEagerly(copy(RULESET_DATA));
+  const lazy = buildLazily(copy(RULESET_DATA));
+
+  // exercise and verify
+  // `getHost()` is the first call, so it has to add the deferred entries.
+  for (let host of HOSTS) {
+    Assert.deepEqual(describeHost(lazy.ruleset, host),
+        describeHost(eager.ruleset, host), host);
+  }
+  assertSameResults(eager, lazy);
+
+  run_next_test();
+});
+
+add_test(function() {
+  // setup
+  const eager = buildEagerly(copy(RULESET_DATA));
+  const lazy = buildLazily(copy(RULESET_DATA));
+
+  // exercise and verify
+  // The rules are removed before their hosts have been looked up.
+  const removedRules = [
+    [ALLOW, {o: {h: "*.com"}}],
+    [ALLOW, {o: {h: "www.example.com"}, d: {h: "cdn.example.net"}}],
+    [ALLOW, {o: {h: "1.2.3.4"}, d: {h: "::1"}}],
+    [DENY, {o: {h: "*"}, d: {h: "tracker.example.com"}}],
+    [DENY, {d: {h: "*.net"}}],
+  ];
+  for (let [ruleAction, rule] of removedRules) {
+    eager.rawRuleset.removeRule(ruleAction, copy(rule), eager.ruleset);
+    lazy.rawRuleset.removeRule(ruleAction, copy(rule), lazy.ruleset);
+    assertSameResults(eager, lazy);
+  }
+  for (let host of HOSTS) {
+    Assert.deepEqual(describeHost(lazy.ruleset, host),
+        describeHost(eager.ruleset, host), host);
+  }
+  Assert.deepEqual(lazy.rawRuleset.entries, eager.rawRuleset.entries);
+
+  run_next_test();
+});
+
+add_test(function() {
+  // setup
+  const lazy = buildLazily(copy(RULESET_DATA));
+
+  // exercise
+  lazy.ruleset.addAllDeferredEntries();
+
+  // verify
+  assertSameResults(buildEagerly(copy(RULESET_DATA)), lazy);
+
+  run_next_test();
+});
+
+add_test(function() {
+  // setup
+  const rawRuleset = RawRuleset.create(log, uriService, {
+    entries: {allow: [{o: {h: "example.com", pathRegex: "("}}], deny: []},
+    metadata: {version: 1},
+  });
+
+  // exercise and verify
+  // An invalid entry is rejected when the ruleset is built, in both modes.
+  Assert.throws(() => rawRuleset.toRuleset("user", false), SyntaxError);
+  Assert.throws(() => rawRuleset.toRuleset("user", true), SyntaxError);
+
+  run_next_test();
+});